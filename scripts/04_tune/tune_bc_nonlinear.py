@@ -8,6 +8,7 @@
 
 
 from svinterface.core.zerod.solver import SolverResults, Solver0Dcpp
+from svinterface.core.zerod.objective import TuningObjective, extract_traces
 from svinterface.core.zerod.lpn import LPN
 from svinterface.core.bc import Inflow, RCR
 from svinterface.manager import Manager
@@ -19,6 +20,7 @@ import numpy as np
 import argparse
 import shutil
 from copy import deepcopy
+from functools import partial
 from scipy import optimize
 import matplotlib.pyplot as plt
 
@@ -226,22 +228,19 @@ def construct_tuning_lpn(params: TuneParams, main_lpn: LPN):
 # Opt Func #
 ############
 
-def opt_function(x, main_lpn: LPN, tuning_lpn: LPN, params: TuneParams):
+# traces of the tuning lpn used by the losses
+TRACES = [('branch_mpa', 'pressure_in'), ('branch_rpa_rd', 'flow_out')]
+
+# tuned values per entry of x = [C, R_LPA, R_RPA], with resistances split 1:9 between proximal and distal
+TUNING_COLUMNS = [[(('vessel', 2, 'C'), 1.0), (('vessel', 5, 'C'), 1.0)],
+                  [(('vessel', 2, 'R'), .1), (('vessel', 3, 'R'), .9)],
+                  [(('vessel', 5, 'R'), .1), (('vessel', 6, 'R'), .9)]]
+
+def opt_function(x, objective: TuningObjective, params: TuneParams):
     ''' Each iteration of optimization runs this
     '''
-    
-    # run a simulation
-    modify_params(tuning_lpn, x)
-    solver = Solver0Dcpp(tuning_lpn,
-                         use_steady=False,
-                         last_cycle_only=True)
-    rez = solver.run_sim()
-    
     # compute decomposed loss
-    mPAP_loss, qRPA_loss, maxPAP_loss, minPAP_loss = loss_function(results = rez,
-                         tune_params = params,
-                         inflow = main_lpn.inflow,
-                         )
+    mPAP_loss, qRPA_loss, maxPAP_loss, minPAP_loss = objective.residuals(x)[0] ** 2
     # aggregate
     loss = mPAP_loss + qRPA_loss + maxPAP_loss + minPAP_loss
     
@@ -251,52 +250,75 @@ def opt_function(x, main_lpn: LPN, tuning_lpn: LPN, params: TuneParams):
     
     return loss
 
-def squared_error(target, sim):
-    ''' returns squared error
+def residual_vector(x, objective: TuningObjective, params: TuneParams):
+    ''' Each iteration of least squares runs this, returning the residuals whose squares are the losses
     '''
-    return ((sim - target)/target)**2
+    residuals = objective.residuals(x)[0]
+    mPAP_loss, qRPA_loss, maxPAP_loss, minPAP_loss = residuals ** 2
+    
+    # report
+    params.iter += 1
+    print(f"{params.iter:^15}|{mPAP_loss:^15.5f}|{maxPAP_loss:^15.5f}|{minPAP_loss:^15.5f}|{qRPA_loss:^15.5f}|{residuals @ residuals:^15f}")
+    
+    return residuals
 
-def piecewise_error(lower, upper, sim):
-    ''' returns a piecewise error
+def residual_jacobian(x, objective: TuningObjective, params: TuneParams):
+    ''' Jacobian of the residuals by finite differences, with every perturbation solved in parallel
     '''
-    if sim > lower and sim < upper:
-        return 0
-    if sim < lower:
-        return squared_error(lower, sim)
-    if sim > upper:
-        return squared_error(upper, sim)
-        
-def loss_function(results: SolverResults, tune_params: TuneParams, inflow: Inflow, intermediate = False):
-    ''' Loss function
+    return objective.jacobian(x)[1]
 
-        Tunes mPAP, RPA Flow, systolic PAP, .01 of Q mse in rpa.
-        returns mean of 4 losses.
+def population_function(X, objective: TuningObjective, params: TuneParams):
+    ''' Each generation of a population based optimizer runs this, with candidates as columns of X
     '''
+    losses = objective.loss(X.T)
     
-    mpa = results.vessel_df('branch_mpa')
-    rpa = results.vessel_df('branch_rpa_rd')
-    
+    # report the best candidate
+    params.iter += 1
+    print(f"{params.iter:^15}|{len(losses):^15}|{losses.min():^15f}|{np.median(losses):^15f}")
     
-    # qRPA
-    qRPA_sim = np.trapz(rpa['flow_out'].to_numpy(), rpa['time'].to_numpy()) / inflow.tc
+    return losses
+
+def relative_error(target, sim):
+    ''' returns relative error
+    '''
+    return (sim - target)/target
+
+def piecewise_residual(lower, upper, sim):
+    ''' returns a piecewise relative error, 0 within [lower, upper]
+    '''
+    return np.where(sim < lower, relative_error(lower, sim), np.where(sim > upper, relative_error(upper, sim), 0.0))
+
+def tuning_values(time, traces, inflow: Inflow):
+    ''' (mPAP, qRPA, maxPAP, minPAP) of [..., TRACES, time] traces
+    '''
+    mpa_P = traces[..., 0, :]
+    rpa_Q = traces[..., 1, :]
+    mPAP_sim = np.trapz(mpa_P, time, axis = -1) / inflow.tc
+    qRPA_sim = np.trapz(rpa_Q, time, axis = -1) / inflow.tc
+    return mPAP_sim, qRPA_sim, mpa_P.max(axis = -1), mpa_P.min(axis = -1)
+
+def residual_function(time, traces, tune_params: TuneParams, inflow: Inflow):
+    ''' Residuals (mPAP, qRPA, maxPAP, minPAP) of a population of [candidates, TRACES, time] traces. Their squares are the losses.
+    '''
+    mPAP_sim, qRPA_sim, maxPAP_sim, minPAP_sim = tuning_values(time, traces, inflow)
     qRPA_meas = inflow.mean_inflow * tune_params.rpa_flow_split
-    qRPA_loss = squared_error(qRPA_meas, qRPA_sim )
+    return np.stack([piecewise_residual(tune_params.mPAP_meas[0], tune_params.mPAP_meas[1], mPAP_sim),
+                     relative_error(qRPA_meas, qRPA_sim),
+                     piecewise_residual(tune_params.maxPAP_meas[0], tune_params.maxPAP_meas[1], maxPAP_sim),
+                     piecewise_residual(tune_params.minPAP_meas[0], tune_params.minPAP_meas[1], minPAP_sim)], axis = -1)
 
-    # maxPAP
-    maxPAP_sim = mpa['pressure_in'].to_numpy().max()
-    maxPAP_loss = piecewise_error(tune_params.maxPAP_meas[0], tune_params.maxPAP_meas[1], maxPAP_sim)
-    
-    # minPAP
-    minPAP_sim = mpa['pressure_in'].to_numpy().min()
-    minPAP_loss = piecewise_error(tune_params.minPAP_meas[0], tune_params.minPAP_meas[1], minPAP_sim)
-    
-    # mPAP
-    mPAP_sim = np.trapz(mpa['pressure_in'].to_numpy(), mpa['time'].to_numpy()) / inflow.tc
-    mPAP_loss = piecewise_error(tune_params.mPAP_meas[0], tune_params.mPAP_meas[1], mPAP_sim )
-    #mPAP_loss = squared_error(1/3 * maxPAP_sim + 2/3 * minPAP_sim, mPAP_sim)
+def loss_function(results: SolverResults, tune_params: TuneParams, inflow: Inflow, intermediate = False):
+    ''' Loss function
+
+        Tunes mPAP, RPA Flow, systolic PAP, .01 of Q mse in rpa.
+        returns mean of 4 losses.
+    '''
+    arr = extract_traces(results, TRACES)
+    time, traces = arr[0], arr[1:]
+    mPAP_loss, qRPA_loss, maxPAP_loss, minPAP_loss = residual_function(time, traces, tune_params, inflow) ** 2
 
     if intermediate:
-        return mPAP_loss , qRPA_loss, maxPAP_loss, minPAP_loss, (mPAP_sim, qRPA_sim, maxPAP_sim, minPAP_sim)
+        return mPAP_loss , qRPA_loss, maxPAP_loss, minPAP_loss, tuning_values(time, traces, inflow)
     
     return mPAP_loss, qRPA_loss, maxPAP_loss, minPAP_loss
 
@@ -391,7 +413,7 @@ def total_area(areas):
 # Tune Driver #
 ###############
 
-def tune(TM: Manager, main_lpn: LPN, tuning_lpn: LPN, params: TuneParams, tuning_dir: Path):
+def tune(TM: Manager, main_lpn: LPN, tuning_lpn: LPN, params: TuneParams, tuning_dir: Path, method = 'nelder-mead', max_workers = None):
     ''' Tuning Steps
     '''
     # setup initial conditions
@@ -400,20 +422,61 @@ def tune(TM: Manager, main_lpn: LPN, tuning_lpn: LPN, params: TuneParams, tuning
     tuning_lpn_file = tuning_dir / (TM['metadata']['model_name'] + '_tuning.in')
     tuning_lpn.write_lpn_file(str(tuning_lpn_file))
     
-    # bounds
-    bounds = optimize.Bounds([0,0,0], [ np.inf, np.inf, np.inf], keep_feasible=True)
-    
-    # run optimizer
-    print(f"{'Iteration':^15}|{'mPAP Loss':^15}|{'maxPAP Loss':^15}|{'minPAP Loss':^15}|{'qRPA Loss':^15}|{'Total Loss':^15}")
-    print("-" * 15 * 7 + "-" * 6)
-    
-    results = optimize.minimize(fun = opt_function,
-                                x0 = x0,
-                                args = (main_lpn,
-                                        tuning_lpn, params),
-                                method='Nelder-Mead',
-                                bounds=bounds,
-                                options = {'disp': True})
+    # nelder-mead is serial, and least squares solves one perturbation per parameter at once
+    if method == 'nelder-mead':
+        max_workers = 1
+    elif method == 'least_squares' and max_workers is None:
+        max_workers = len(x0)
+    
+    # workers construct the solver once and only update the tuned vessels of each candidate
+    objective = TuningObjective(tuning_lpn,
+                                TUNING_COLUMNS,
+                                TRACES,
+                                residuals = partial(residual_function, tune_params = params, inflow = main_lpn.inflow),
+                                max_workers = max_workers,
+                                use_steady = False,
+                                last_cycle_only = True)
+    
+    with objective:
+        if method == 'nelder-mead':
+            # bounds
+            bounds = optimize.Bounds([0,0,0], [ np.inf, np.inf, np.inf], keep_feasible=True)
+            
+            # run optimizer
+            print(f"{'Iteration':^15}|{'mPAP Loss':^15}|{'maxPAP Loss':^15}|{'minPAP Loss':^15}|{'qRPA Loss':^15}|{'Total Loss':^15}")
+            print("-" * 15 * 7 + "-" * 6)
+            results = optimize.minimize(fun = opt_function,
+                                        x0 = x0,
+                                        args = (objective, params),
+                                        method='Nelder-Mead',
+                                        bounds=bounds,
+                                        options = {'disp': True})
+        elif method == 'least_squares':
+            # trust region reflective with bounds, each Jacobian costs one parallel wave of solves
+            print(f"{'Evaluation':^15}|{'mPAP Loss':^15}|{'maxPAP Loss':^15}|{'minPAP Loss':^15}|{'qRPA Loss':^15}|{'Total Loss':^15}")
+            print("-" * 15 * 7 + "-" * 6)
+            results = optimize.least_squares(fun = residual_vector,
+                                             x0 = x0,
+                                             jac = residual_jacobian,
+                                             bounds = (0, np.inf),
+                                             x_scale = 'jac',
+                                             args = (objective, params),
+                                             verbose = 1)
+        elif method == 'differential_evolution':
+            # every generation is solved in parallel, within two orders of magnitude of the initial conditions
+            print(f"{'Generation':^15}|{'Candidates':^15}|{'Best Loss':^15}|{'Median Loss':^15}")
+            print("-" * 15 * 4 + "-" * 3)
+            results = optimize.differential_evolution(func = population_function,
+                                                      bounds = list(zip(x0 * 1e-2, x0 * 1e2)),
+                                                      args = (objective, params),
+                                                      x0 = x0,
+                                                      vectorized = True,
+                                                      updating = 'deferred',
+                                                      polish = False,
+                                                      disp = True)
+        else:
+            raise ValueError(f"Unknown tuning method {method}.")
+        print(f"Solved {objective.num_evals} candidates.")
             
     # set prev x0 as start point
     x0 = results.x
@@ -500,11 +563,12 @@ def validate_results(tune_params: TuneParams, main_lpn: LPN, tuning_lpn: LPN, x,
     
     results_dict['columns'] = ['Optimized', 'Desired']
     
-    # run a sim w/ last cycle only
+    # run a single sim of all cycles, using the last cycle for losses and the last 3 cycles for plots
     solver = Solver0Dcpp(tuning_lpn,
                          use_steady=False,
-                         last_cycle_only=True)
-    tune_results = solver.run_sim()
+                         last_cycle_only=False)
+    all_results = solver.run_sim()
+    tune_results = all_results.last_cycles(int(main_lpn.simulation_params['number_of_time_pts_per_cardiac_cycle']))
     
     mPAP_loss, qRPA_loss, maxPAP_loss, minPAP_loss, (mPAP_sim, qRPA_sim, maxPAP_sim, minPAP_sim) = loss_function(tune_results, tune_params, main_lpn.inflow, intermediate = True)
     
@@ -526,11 +590,7 @@ def validate_results(tune_params: TuneParams, main_lpn: LPN, tuning_lpn: LPN, x,
     
     write_json(save_dir / 'values.json', results_dict, sort_keys = False)
     
-    # run a sim without last cycle
-    solver = Solver0Dcpp(tuning_lpn,
-                         use_steady=False,
-                         last_cycle_only=False)
-    tune_results = solver.run_sim()
+    tune_results = all_results
     
     ## save flow and pressure graphs (last 3 cycles)
     fig, ax = plt.subplots(2, 3, figsize=(30, 20))
@@ -613,6 +673,8 @@ if __name__ == '__main__':
     parser.add_argument('-i', dest = 'config', help = 'Config.yaml file')
     parser.add_argument('--f', dest = 'force', action = 'store_true', default = False, help = 'Whether to restart tuning, even if tuning was already done once.')
     parser.add_argument('--s', dest = 'sensitivity_test', action = 'store_true', default = False, help = 'flag to run sensitivity tests or not')
+    parser.add_argument('--method', dest = 'method', default = 'nelder-mead', choices = ['nelder-mead', 'least_squares', 'differential_evolution'], help = 'optimizer. least_squares uses parallel finite difference Jacobians and differential_evolution solves each generation in parallel: Default = nelder-mead')
+    parser.add_argument('-j', dest = 'workers', type = int, default = None, help = 'number of processes for least_squares and differential_evolution: Default = number of parameters for least_squares, number of cpus otherwise')
     
     args = parser.parse_args()
     
@@ -652,7 +714,7 @@ if __name__ == '__main__':
     tuning_lpn = construct_tuning_lpn(params, main_lpn)
     
     # run optimizer
-    tune(TM, main_lpn, tuning_lpn, params, tuning_dir)
+    tune(TM, main_lpn, tuning_lpn, params, tuning_dir, method = args.method, max_workers = args.workers)
     
     # save a copy of the base lpn to main
     base_lpn_path = Path(TM['workspace']['root']) / 'base_lpn.in'
@@ -8,36 +8,17 @@
 
 
 
-from svinterface.core.zerod.lpn import LPN, OriginalLPN
+from svinterface.core.zerod.lpn import LPN
 from svinterface.core.polydata import Centerlines
-from svinterface.core.zerod.solver import Solver0Dcpp
+from svinterface.core.zerod.jacobian import Jacobian
 from svinterface.manager.baseManager import Manager
-from svinterface.utils.misc import m2d
+from svinterface.utils.misc import m2d, d2m
 
 import numpy as np
 import argparse
-from concurrent.futures import ProcessPoolExecutor
 
 
 
-def conc_sim(lpn: OriginalLPN, junc_id: int, which: int, junction_outlet_vessels: list):
-    ''' To run simulations using multi-processing '''
-    # compute a R as 1 and original value
-    r = 1 + lpn.get_junction(junc_id)['junction_values']['R_poiseuille'][which]
-    # change to JC
-    lpn.change_junction_outlet(junction_id_or_name = junc_id, which = which, R = r)
-    # Solver
-    tmp = Solver0Dcpp(lpn, last_cycle_only=True, mean_only=True, debug = False)
-    tmp_sim = tmp.run_sim()
-
-    # get results
-    tmp_sim.convert_to_mmHg()
-    pressures_cur = tmp_sim.result_df.iloc[junction_outlet_vessels]['pressure_in'].to_numpy()
-    # undo change
-    lpn.change_junction_outlet(junction_id_or_name = junc_id, which = which, R = 0)
-
-    return pressures_cur     
-
 def linear_transform(zerod_lpn: LPN, threed_c: Centerlines, M: Manager, iterations: int):
     
     # get relevant positions
@@ -75,30 +56,22 @@ def linear_transform_side(zerod_lpn: LPN, threed_c: Centerlines, M: Manager, sid
     # extract target pressures.
     target_pressures = threed_c.get_pointdata_array("avg_pressure")[junction_gids + [0]]
     
-    # compute initial case
-    tmp = Solver0Dcpp(zerod_lpn, last_cycle_only=True, mean_only=True, debug = False)
-    init_sim = tmp.run_sim()
-    init_sim.convert_to_mmHg()
-    pressures_init = init_sim.result_df.iloc[junction_outlet_vessels + [0]]['pressure_in'].to_numpy()
     
     
 
         
-    # iterate through each junction outlet (submit futures)
-    futures = []
-    with ProcessPoolExecutor() as executor:
-        for junc_node in junction_nodes:
-            for idx, vess in enumerate(junc_node.vessel_info[0]['outlet_vessels']):
-                print(f"Changing junction {junc_node.id} vessel {idx}.")
-                futures.append(executor.submit(conc_sim, zerod_lpn.get_fast_lpn(), junc_node.id, idx, junction_outlet_vessels + [0]))
-        pressures = []
-        # parse futures in order
-        print("Retrieving results...")
-        for idx, f in enumerate(futures):
-            
-            ps = f.result()
-            pressures.append( ps - pressures_init)
-            print(f"\tRetrieved results for process {idx}/{len(futures)}")
+    # junction outlets
+    params = []
+    for junc_node in junction_nodes:
+        for idx, vess in enumerate(junc_node.vessel_info[0]['outlet_vessels']):
+            params.append(('junction', junc_node.id, idx, 'R'))
+    
+    print("Computing sensitivities...")
+    with Jacobian(zerod_lpn, params, [('pressure_in', junction_outlet_vessels + [0])], steps = np.ones(len(params)), last_cycle_only=True) as jac:
+        f0, J = jac.jacobian()
+    # the unperturbed solution is the initial case
+    pressures_init = d2m(f0)
+    pressures = list(d2m(J).T)
             
     # convert to numpy
     # add constant & transpose
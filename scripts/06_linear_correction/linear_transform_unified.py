@@ -6,37 +6,20 @@
 # 
 # Description: Perform a linear transform on the junctions, but only saves physical values. Original Linear transform
 
-from svinterface.core.zerod.lpn import LPN, OriginalLPN
+from svinterface.core.zerod.lpn import LPN
 from svinterface.core.polydata import Centerlines
 from svinterface.core.zerod.solver import Solver0Dcpp
+from svinterface.core.zerod.jacobian import Jacobian
+from svinterface.core.zerod.steady import SteadySolver
 from svinterface.manager.baseManager import Manager
-from svinterface.utils.misc import m2d
+from svinterface.utils.misc import m2d, d2m
 
 import argparse
 import numpy as np
-from concurrent.futures import ProcessPoolExecutor
 
 
 
-def conc_sim(lpn: OriginalLPN, junc_id: int, which: int, junction_outlet_vessels: list):
-    ''' To run simulations using multi-processing '''
-    # compute a R as 10%
-    r = 1 + lpn.get_junction(junc_id)['junction_values']['R_poiseuille'][which]
-    # change to JC
-    lpn.change_junction_outlet(junction_id_or_name = junc_id, which = which, R = r)
-    # Solver
-    tmp = Solver0Dcpp(lpn, last_cycle_only=True, mean_only=True, debug = False)
-    tmp_sim = tmp.run_sim()
-
-    # get results
-    tmp_sim.convert_to_mmHg()
-    pressures_cur = tmp_sim.result_df.iloc[junction_outlet_vessels]['pressure_in'].to_numpy()
-    # undo change
-    lpn.change_junction_outlet(junction_id_or_name = junc_id, which = which, R = 0)
-
-    return pressures_cur       
-        
-def linear_transform(zerod_lpn: LPN, threed_c: Centerlines, M: Manager):
+def linear_transform(zerod_lpn: LPN, threed_c: Centerlines, M: Manager, transient = False):
 
     # get relevant positions
     tree = zerod_lpn.get_tree()
@@ -59,28 +42,32 @@ def linear_transform(zerod_lpn: LPN, threed_c: Centerlines, M: Manager):
     
     # compute initial case
     tmp = Solver0Dcpp(zerod_lpn, last_cycle_only=True, mean_only=True, debug = False)
-    init_sim = tmp.run_sim()
+    init_sim = tmp.run_sim_mean()
     init_sim.convert_to_mmHg()
-    pressures_init = init_sim.result_df.iloc[junction_outlet_vessels + [0]]['pressure_in'].to_numpy()
+    pressures_init = init_sim.get_poi([('pressure_in', junction_outlet_vessels + [0])])
     
     
 
         
-    # iterate through each junction outlet (submit futures)
-    futures = []
-    with ProcessPoolExecutor() as executor:
-        for junc_node in zerod_lpn.tree_bfs_iterator(tree, allow = 'junction'):
-            for idx, vess in enumerate(junc_node.vessel_info[0]['outlet_vessels']):
-                print(f"Changing junction {junc_node.id} vessel {idx}.")
-                futures.append(executor.submit(conc_sim, zerod_lpn.get_fast_lpn(), junc_node.id, idx, junction_outlet_vessels + [0]))
-        pressures = []
-        # parse futures in order
-        print("Retrieving results...")
-        for idx, f in enumerate(futures):
-            
-            ps = f.result()
-            pressures.append( ps - pressures_init)
-            print(f"\tRetrieved results for process {idx}/{len(futures)}")
+    # iterate through each junction outlet, perturbing R by 1
+    params = []
+    for junc_node in zerod_lpn.tree_bfs_iterator(tree, allow = 'junction'):
+        for idx, vess in enumerate(junc_node.vessel_info[0]['outlet_vessels']):
+            params.append(('junction', junc_node.id, idx))
+    
+    poi = [('pressure_in', junction_outlet_vessels + [0])]
+    if transient:
+        # one transient simulation per R = 1 perturbation
+        print("Computing transient sensitivities...")
+        with Jacobian(zerod_lpn, [p + ('R',) for p in params], poi, steps = np.ones(len(params)), last_cycle_only=True) as jac:
+            _, J = jac.jacobian()
+        pressures = list(d2m(J).T)
+    else:
+        # dP/dR of every junction outlet from a single steady state factorization
+        print("Computing steady state sensitivities...")
+        steady = SteadySolver(zerod_lpn)
+        steady.solve()
+        pressures = list(steady.sensitivity(poi, params, mmHg = True).T)
             
     # convert to numpy
     # add constant & transpose
@@ -147,7 +134,7 @@ if __name__ == '__main__':
     
     parser = argparse.ArgumentParser(description="Perform a linear optimization on the branches")
     parser.add_argument("-i", dest = 'config', help = 'config.yaml file')
-    
+    parser.add_argument("--transient", action='store_true', default=False, help="Compute sensitivities with a transient simulation per perturbation rather than a steady state linear solve.")
     args = parser.parse_args()
     
     
@@ -166,4 +153,4 @@ if __name__ == '__main__':
     # load centerlines
     threed_c = Centerlines.load_centerlines(threed_file)
     
-    linear_transform(zerod_lpn,threed_c, M)
\ No newline at end of file
+    linear_transform(zerod_lpn,threed_c, M, args.transient)
\ No newline at end of file
@@ -4,334 +4,37 @@
 # Last Modified: Thursday, 14th September 2023 7:19:45 pm
 # Modified By: John Lee (jlee88@nd.edu>)
 # 
-# Description: A long running operation (2+ hrs) where given a 3D .vtu file and its corresponding centerlines, flows and pressures can be mapped back onto the 1D centerlines
-# (Individual script that can be run on compute cluster), Requires centerlines that are generated by svInterface.
+# Description: A long running operation where given a 3D .vtu file and its corresponding centerlines, flows and pressures can be mapped back onto the 1D centerlines
+# (Individual script that can be run on compute cluster with svinterface installed), Requires centerlines that are generated by svInterface.
+# Slices are integrated in parallel by svinterface.core.threed.slicing, use -j to set the number of processes.
+# Given the LPN (-l), only the points needed for its caps, junctions and vessels are sliced, optionally every --stride along branches.
+# Completed slices are checkpointed to <outfile>.ckpt.npz (also on SIGTERM, i.e. cluster walltime), and rerunning the same command resumes from it.
 #! FLOW IS COMPUTED INCORRECTLY
 
-
-import os
-import vtk
-from vtk.util.numpy_support import numpy_to_vtk as n2v
-from vtk.util.numpy_support import vtk_to_numpy as v2n
+from svinterface.core.threed.slicing import extract_results, PLAN_QUANTITIES
+from svinterface.core.zerod.lpn import LPN
 
 from tqdm import tqdm
 import argparse
+import signal
+import sys
 
 
-##########
-# Most Code provited by Martin @ https://github.com/StanfordCBCL/DataCuration/blob/36f0e23ebe8c6a593d3d0c1b26cced940e25de40/get_mean_flow_3d.py#L60-L122 
-###########
-
-
-class Integration:
-    """
-    Class to perform integration on slices
-    """
-
-    def __init__(self, inp):
-        try:
-            self.integrator = vtk.vtkIntegrateAttributes()
-        except AttributeError:
-            raise Exception('vtkIntegrateAttributes is currently only supported by pvpython')
-
-        if not inp.GetOutput().GetNumberOfPoints():
-            raise Exception('Empty slice')
-
-        self.integrator.SetInputData(inp.GetOutput())
-        self.integrator.Update()
-
-    def evaluate(self, res_name):
-        """
-        Evaluate integral.
-        Distinguishes between scalar integration (e.g. pressure) and normal projection (velocity)
-        Optionally divides integral by integrated area
-        Args:
-            field: pressure, velocity, ...
-            res_name: name of array
-        Returns:
-            Scalar integral
-        """
-        # type of result
-        field = res_name.split('_')[0]
-
-        if field == 'velocity':
-            int_name = 'normal_' + res_name
-        else:
-            int_name = res_name
-
-        # evaluate integral
-        integral = v2n(self.integrator.GetOutput().GetPointData().GetArray(int_name))[0]
-
-        # choose if integral should be divided by area
-        if field == 'velocity':
-            return integral
-        else:
-            return integral / self.area()
-
-    def area(self):
-        """
-        Evaluate integrated surface area
-        Returns:
-        Area
-        """
-        return v2n(self.integrator.GetOutput().GetCellData().GetArray('Area'))[0]
-    
-    
-    
-def read_geo(fname):
-    """
-    Read geometry from file, chose corresponding vtk reader
-    Args:
-        fname: vtp surface or vtu volume mesh
-    Returns:
-        vtk reader, point data, cell data
-    """
-    _, ext = os.path.splitext(fname)
-    if ext == '.vtp':
-        reader = vtk.vtkXMLPolyDataReader()
-    elif ext == '.vtu':
-        reader = vtk.vtkXMLUnstructuredGridReader()
-    else:
-        raise ValueError('File extension ' + ext + ' unknown.')
-    reader.SetFileName(fname)
-    reader.Update()
-
-    return reader
-
-
-def write_geo(fname, input):
-    """
-    Write geometry to file
-    Args:
-        fname: file name
-    """
-    _, ext = os.path.splitext(fname)
-    if ext == '.vtp':
-        writer = vtk.vtkXMLPolyDataWriter()
-    elif ext == '.vtu':
-        writer = vtk.vtkXMLUnstructuredGridWriter()
-    else:
-        raise ValueError('File extension ' + ext + ' unknown.')
-    writer.SetFileName(fname)
-    writer.SetInputData(input)
-    writer.Update()
-    writer.Write()
-    
-def cut_plane(inp, origin, normal):
-    """
-    Cuts geometry at a plane
-    Args:
-        inp: InputConnection
-        origin: cutting plane origin
-        normal: cutting plane normal
-    Returns:
-        cut: cutter object
-    """
-    # define cutting plane
-    plane = vtk.vtkPlane()
-    plane.SetOrigin(origin[0], origin[1], origin[2])
-    plane.SetNormal(normal[0], normal[1], normal[2])
-
-    # define cutter
-    cut = vtk.vtkCutter()
-    cut.SetInputData(inp)
-    cut.SetCutFunction(plane)
-    cut.Update()
-    return cut
-
-def connectivity(inp, origin):
-    """
-    If there are more than one unconnected geometries, extract the closest one
-    Args:
-        inp: InputConnection
-        origin: region closest to this point will be extracted
-    Returns:
-        con: connectivity object
-    """
-    con = vtk.vtkConnectivityFilter()
-    con.SetInputData(inp.GetOutput())
-    con.SetExtractionModeToClosestPointRegion()
-    con.SetClosestPoint(origin[0], origin[1], origin[2])
-    con.Update()
-    return con
-
-def calculator(inp, function, inp_arrays, out_array):
-    """
-    Function to add vtk calculator
-    Args:
-        inp: InputConnection
-        function: string with function expression
-        inp_arrays: list of input point data arrays
-        out_array: name of output array
-    Returns:
-        calc: calculator object
-    """
-    calc = vtk.vtkArrayCalculator()
-    for a in inp_arrays:
-        calc.AddVectorArrayName(a)
-    calc.SetInputData(inp.GetOutput())
-    if hasattr(calc, 'SetAttributeModeToUsePointData'):
-        calc.SetAttributeModeToUsePointData()
-    else:
-        calc.SetAttributeTypeToPointData()
-    calc.SetFunction(function)
-    calc.SetResultArrayName(out_array)
-    calc.Update()
-    return calc
-
-
-def get_res_names(inp, res_fields):
-    # result name list
-    res = []
-
-    # get integral for each result
-    for i in range(inp.GetPointData().GetNumberOfArrays()):
-        res_name = inp.GetPointData().GetArrayName(i)
-        field = res_name.split('_')[0]
-        num = res_name.split('_')[-1]
-
-        # check if field should be added to output
-        if field in res_fields:
-            try:
-                float(num)
-                res += [res_name]
-            except ValueError:
-                pass
-
-    return res
-
-def slice_vessel(inp_3d, origin, normal):
-    """
-    Slice 3d geometry at certain plane
-    Args:
-        inp_1d: vtk InputConnection for 1d centerline
-        inp_3d: vtk InputConnection for 3d volume model
-        origin: plane origin
-        normal: plane normal
-    Returns:
-        Integration object
-    """
-    # cut 3d geometry
-    cut_3d = cut_plane(inp_3d, origin, normal)
-
-    # extract region closest to centerline
-    con = connectivity(cut_3d, origin)
-
-    return con
-
-def get_integral(inp_3d, origin, normal):
-    """
-    Slice simulation at certain plane and integrate
-    Args:
-        inp_1d: vtk InputConnection for 1d centerline
-        inp_3d: vtk InputConnection for 3d volume model
-        origin: plane origin
-        normal: plane normal
-    Returns:
-        Integration object
-    """
-    # slice vessel at given location
-    inp = slice_vessel(inp_3d, origin, normal)
-
-    # recursively add calculators for normal velocities
-    for v in get_res_names(inp_3d, 'velocity'):
-        fun = 'dot((iHat*'+repr(normal[0])+'+jHat*'+repr(normal[1])+'+kHat*'+repr(normal[2])+'),' + v + ')'
-        #fun = '(iHat*'+repr(normal[0])+'+jHat*'+repr(normal[1])+'+kHat*'+repr(normal[2])+').' + v 
-        inp = calculator(inp, fun, [v], 'normal_' + v)
-
-    return Integration(inp)
-
-
-def extract_results(fpath_1d, fpath_3d, fpath_out, only_caps=False, only_juncs=False, all=False):
-    """
-    Extract 3d results at 1d model nodes (integrate over cross-section)
-    Args:
-        fpath_1d: path to 1d model
-        fpath_3d: path to 3d simulation results
-        fpath_out: output path
-        only_caps: extract solution only at caps, not in interior (much faster)
-    Returns:
-        res: dictionary of results in all branches, in all segments for all result arrays
-    """
-    # read 1d and 3d model
-    reader_1d = read_geo(fpath_1d).GetOutput()
-    reader_3d = read_geo(fpath_3d).GetOutput()
-
-    # get all result array names
-    res_names = get_res_names(reader_3d, ['pressure', 'velocity'])
-
-    # get point and normals from centerline
-    points = v2n(reader_1d.GetPoints().GetData())
-    normals = v2n(reader_1d.GetPointData().GetArray('CenterlineSectionNormal'))
-    gid = v2n(reader_1d.GetPointData().GetArray('GlobalNodeId'))
-    
-    # get valid array
-    if only_caps:
-        valid = v2n(reader_1d.GetPointData().GetArray('Caps_0D')) + 1
-    elif only_juncs:
-        valid = v2n(reader_1d.GetPointData().GetArray('Junctions_0D')) + 1
-    elif all:
-        valid = v2n(reader_1d.GetPointData().GetArray('Junctions_0D')) + v2n(reader_1d.GetPointData().GetArray('Vessels_0D')) + v2n(reader_1d.GetPointData().GetArray('Caps_0D')) + 3
-        
-    # initialize output
-    for name in res_names + ['area', 'valid']:
-        array = vtk.vtkDoubleArray()
-        if name == 'valid':
-            array = vtk.vtkIntArray()
-        array.SetName(name)
-        array.SetNumberOfValues(reader_1d.GetNumberOfPoints())
-        array.Fill(0)
-        reader_1d.GetPointData().AddArray(array)
-    
-
-    # move points on caps slightly to ensure nice integration
-    ids = vtk.vtkIdList()
-    eps_norm = 1.0e-3
-
-    # integrate results on all points of intergration cells
-    for i in tqdm(range(reader_1d.GetNumberOfPoints())):
-        # check if point is cap
-        reader_1d.GetPointCells(i, ids)
-        skip = False
-        # shift points at caps for better integration
-        if ids.GetNumberOfIds() == 1:
-            if gid[i] == 0:
-                # inlet
-                points[i] += eps_norm * normals[i]
-            else:
-                # outlets
-                points[i] -= eps_norm * normals[i]
-        else:
-            # skip if an only flag is set and the point is invalid.
-            if (only_caps or only_juncs or all) and valid[i] == 0:
-                continue
-            
-
-
-        # create integration object (slice geometry at point/normal)
-        try:
-            integral = get_integral(reader_3d, points[i], normals[i])
-        except Exception:
-            continue
-
-        # integrate all output arrays
-        for name in res_names:
-            reader_1d.GetPointData().GetArray(name).SetValue(i, integral.evaluate(name))
-        reader_1d.GetPointData().GetArray('area').SetValue(i, integral.area())
-        reader_1d.GetPointData().GetArray('valid').SetValue(i, 1)
-
-    write_geo(fpath_out, reader_1d)
-
-    
-    
-
 if __name__ == '__main__':
     
-    parser = argparse.ArgumentParser(description = 'extract 3D to centerlines (takes 1hr +)')
+    parser = argparse.ArgumentParser(description = 'extract 3D to centerlines (takes 1hr + serially)')
     
     parser.add_argument('-c', dest = 'centerlines', help = 'centerlines file')
     parser.add_argument('-v', dest = 'volume', help = 'vtu file of results')
     parser.add_argument('-o', dest = 'outfile', help = 'output vtp file')
+    parser.add_argument('-j', dest = 'workers', type = int, default = 1, help = 'number of processes, each loading the volume once: Default = 1')
+    parser.add_argument('--chunksize', type = int, default = 8, help = 'slices per task sent to a process: Default = 8')
+    parser.add_argument('--checkpoint_interval', type = float, default = 600, help = 'seconds between checkpoints of completed slices: Default = 600')
+    parser.add_argument('--restart', default = False, action = 'store_true', help = 'ignore an existing checkpoint')
+    parser.add_argument('--no_local', dest = 'local', default = True, action = 'store_false', help = 'cut the whole volume at every slice, rather than only cells near the slice sized from the centerline section areas')
+    parser.add_argument('-l', dest = 'lpn', default = None, help = 'LPN of the centerlines, to only slice the points it needs (replaces --caps/--juncs/--0D)')
+    parser.add_argument('--quantities', nargs = '+', default = list(PLAN_QUANTITIES), choices = PLAN_QUANTITIES, help = 'with -l, quantities of the LPN to slice for: Default = all')
+    parser.add_argument('--stride', type = float, default = None, help = 'with -l, also slice every stride of path length along each branch')
     flags = parser.add_mutually_exclusive_group(required=False)
     flags.add_argument('--caps', dest = 'caps', default = False, action = 'store_true', help = 'whether to save caps only')
     flags.add_argument('--juncs', dest = 'juncs', default = False, action = 'store_true', help = 'whether to save junctions only')
@@ -339,8 +42,10 @@ if __name__ == '__main__':
     
     args = parser.parse_args()
     
-    try:
-        extract_results(args.centerlines, args.volume, args.outfile, only_caps=args.caps, only_juncs=args.juncs, all=args.all)
-    except Exception as e:
-        print(e)
-        
+    # exit on SIGTERM so the checkpoint is saved
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    
+    lpn = LPN.from_file(args.lpn) if args.lpn else None
+    
+    extract_results(args.centerlines, args.volume, args.outfile, only_caps=args.caps, only_juncs=args.juncs, all=args.all, num_workers = args.workers, chunksize = args.chunksize, progress = tqdm, local = args.local, checkpoint_interval = args.checkpoint_interval, restart = args.restart,
+                    lpn = lpn, quantities = args.quantities, stride = args.stride)
@@ -7,57 +7,20 @@
 # Description:  Perform a linear correction all resistances in diseased model
 
 
-from svinterface.core.zerod.lpn import LPN, OriginalLPN
+from svinterface.core.zerod.lpn import LPN
 from svinterface.core.polydata import Centerlines
 from svinterface.core.zerod.solver import Solver0Dcpp
+from svinterface.core.zerod.jacobian import Jacobian
 from svinterface.manager.baseManager import Manager
-from svinterface.utils.misc import m2d
+from svinterface.utils.misc import m2d, d2m
 
 import argparse
 import numpy as np
 from pathlib import Path
-import pandas as pd
-from concurrent.futures import ProcessPoolExecutor
 import json
 
 
 
-def junc_sim(lpn: OriginalLPN, junc_id: int, which: int, poi_0d):
-    ''' To run simulations using multi-processing '''
-    
-    # get downstream vessel.
-    r = 1
-    # change to JC
-    lpn.change_junction_outlet(junction_id_or_name = junc_id, which = which, R = r, mode='add')
-    # Solver
-    tmp = Solver0Dcpp(lpn, last_cycle_only=True, mean_only=True, debug = False)
-    tmp_sim = tmp.run_sim()
-
-    # get results
-    tmp_sim.convert_to_mmHg()
-    pressures_cur = pd.concat([tmp_sim.result_df.iloc[poi_0d[0]]['pressure_in'], tmp_sim.result_df.iloc[poi_0d[1]]['pressure_out'], tmp_sim.result_df.iloc[poi_0d[2]]['pressure_in']]).to_numpy()
-    # undo change
-    lpn.change_junction_outlet(junction_id_or_name = junc_id, which = which, R = -r, mode = 'add')
-
-    return pressures_cur   
-
-def vess_sim(lpn: OriginalLPN, vess: int, poi_0d):
-    ''' To run simulations using multi-processing '''
-    dr = 1
-    # change to JC
-    lpn.change_vessel(vessel_id = vess, R = dr, mode = 'add')
-    # Solver
-    tmp = Solver0Dcpp(lpn, last_cycle_only=True, mean_only=True, debug = False)
-    tmp_sim = tmp.run_sim()
-
-    # get results
-    tmp_sim.convert_to_mmHg()
-    pressures_cur = pd.concat([tmp_sim.result_df.iloc[poi_0d[0]]['pressure_in'], tmp_sim.result_df.iloc[poi_0d[1]]['pressure_out'],  tmp_sim.result_df.iloc[poi_0d[2]]['pressure_in']]).to_numpy()
-    # undo change
-    lpn.change_vessel(vessel_id = vess, R = -dr, mode = 'add')
-
-    return pressures_cur       
-        
 def linear_transform(zerod_lpn: LPN, threed_c: Centerlines, M: Manager,iter: int):
     
     # get relevant positions
@@ -102,42 +65,27 @@ def linear_transform_side(zerod_lpn: LPN, threed_c: Centerlines, M: Manager, sid
         
     # points of interest
     poi_3d = junction_gids + segment_gids + [0] # include inlet
-    poi_0d = lambda df: pd.concat([df.iloc[junction_outlet_vessels]['pressure_in'], df.iloc[segment_vess_ids]['pressure_out'], df.iloc[[0]]['pressure_in']]).to_numpy()
     
     # extract target pressures.
     target_pressures = threed_c.get_pointdata_array("avg_pressure")[poi_3d]
     
-    # compute initial case
-    tmp = Solver0Dcpp(zerod_lpn, last_cycle_only=True, mean_only=True, debug = False)
-    init_sim = tmp.run_sim()
-    init_sim.convert_to_mmHg()
-    pressures_init = poi_0d(init_sim.result_df)
 
         
-    # submit jobs
-    futures = []
-    with ProcessPoolExecutor() as executor:
-        # iterate through each junction outlet (submit futures)
-        for junc_node in junction_nodes:
-            for idx, vess in enumerate(junc_node.vessel_info[0]['outlet_vessels']):
-                print(f"Changing junction {junc_node.id} downstream vessel {idx}.")
-                futures.append(executor.submit(junc_sim, zerod_lpn.get_fast_lpn(), junc_node.id, idx, [junction_outlet_vessels, segment_vess_ids, [0]]))
-        # iterate through vessel segments
-        for vid in segment_vess_ids:
-            print(f"Changing vessel {vid}.")
-            futures.append(executor.submit(vess_sim, zerod_lpn.get_fast_lpn(), vid, [junction_outlet_vessels, segment_vess_ids, [0]]))
-            
-        
-        pressures = []
-        # parse futures in order
-        print("Retrieving results...")
-        for idx, f in enumerate(futures):
-            
-            ps = f.result()
-            #print(ps, pressures_init)
-            # compute difference
-            pressures.append( ps - pressures_init)
-            print(f"\tRetrieved results for process {idx}/{len(futures)}")
+    # parameters: junction outlets, then vessel segments
+    params = []
+    for junc_node in junction_nodes:
+        for idx, vess in enumerate(junc_node.vessel_info[0]['outlet_vessels']):
+            params.append(('junction', junc_node.id, idx, 'R'))
+    for vid in segment_vess_ids:
+        params.append(('vessel', vid, 'R'))
+    
+    print("Computing sensitivities...")
+    poi = [('pressure_in', junction_outlet_vessels), ('pressure_out', segment_vess_ids), ('pressure_in', [0])]
+    with Jacobian(zerod_lpn, params, poi, steps = np.ones(len(params)), last_cycle_only=True) as jac:
+        f0, J = jac.jacobian()
+    # the unperturbed solution is the initial case
+    pressures_init = d2m(f0)
+    pressures = list(d2m(J).T)
             
     # convert to numpy
     # add constant & transpose
@@ -263,7 +211,7 @@ if __name__ == '__main__':
     
     # run the pipeline
     solver = Solver0Dcpp(zerod_lpn, debug = True)
-    solver.run_sim_pipeline(validate=True, save_csv=True, save_branch=False, out_dir = str(correction_dir))
-    M.register('csv', str(correction_dir / 'branch_results.csv'), ['parameterization','corrections', args.name])
+    solver.run_sim_pipeline(validate=True, save_csv=False, save_branch=False, out_dir = str(correction_dir))
+    M.register('results', str(correction_dir / 'branch_results'), ['parameterization','corrections', args.name])
     M.update()
     
\ No newline at end of file
@@ -14,17 +14,17 @@
 
 import argparse
 
-from svinterface.core.zerod.lpn import LPN, FastLPN
+from svinterface.core.zerod.lpn import LPN
 from svinterface.core.polydata import Centerlines
 from svinterface.core.bc import RCR 
-from svinterface.core.zerod.solver import Solver0Dcpp, SolverResults
+from svinterface.core.zerod.solver import Solver0Dcpp
+from svinterface.core.zerod.jacobian import Jacobian
+from svinterface.core.zerod.steady import SteadySolver
 from svinterface.manager.baseManager import Manager
-from svinterface.utils.misc import m2d
+from svinterface.utils.misc import m2d, d2m
 import numpy as np
 from pathlib import Path
-import pandas as pd
 import json
-from concurrent.futures import ProcessPoolExecutor, wait
 
 def get_distances(diseased_cent: Centerlines, stented_cent: Centerlines):
     '''Retrieves the distance between diseased and stented centerlines'''
@@ -77,53 +77,16 @@ def split_vessel_junc(d: list, lpn: LPN, points: float ):
                     valid_vess_ids.add(node.ids[idx])
     return valid_vess_ids, valid_junc_ids
 
-def junc_sim(lpn: FastLPN, junc_id: int, which: int, poi_0d):
-    ''' To run simulations using multi-processing '''
-    # get downstream vessel.
-    # compute a R as 10%
-    r = 1
-    # change to JC
-    lpn.change_junction_outlet(junction_id_or_name = junc_id, which = which, R = r, mode='add')
-    # Solver
-    tmp = Solver0Dcpp(lpn, last_cycle_only=True, mean_only=True, debug = False)
-    tmp_sim = tmp.run_sim()
-
-    # get results
-    tmp_sim.convert_to_mmHg()
-    pressures_cur = pd.concat([tmp_sim.result_df.iloc[poi_0d[0]]['pressure_in'], tmp_sim.result_df.iloc[poi_0d[1]]['pressure_out'], tmp_sim.result_df.iloc[poi_0d[2]]['pressure_in']]).to_numpy()
-    # undo change
-    lpn.change_junction_outlet(junction_id_or_name = junc_id, which = which, R = -r, mode = 'add')
-
-    return pressures_cur   
-
-def vess_sim(lpn: FastLPN, vess: int, poi_0d):
-    ''' To run simulations using multi-processing '''
-    # compute a R as 10%
-    dr = 1
-    # change to JC
-    lpn.change_vessel(vessel_id = vess, R = dr, mode = 'add')
-    # Solver
-    tmp = Solver0Dcpp(lpn, last_cycle_only=True, mean_only=True, debug = False)
-    tmp_sim = tmp.run_sim()
-
-    # get results
-    tmp_sim.convert_to_mmHg()
-    pressures_cur = pd.concat([tmp_sim.result_df.iloc[poi_0d[0]]['pressure_in'], tmp_sim.result_df.iloc[poi_0d[1]]['pressure_out'],  tmp_sim.result_df.iloc[poi_0d[2]]['pressure_in']]).to_numpy()
-    # undo change
-    lpn.change_vessel(vessel_id = vess, R = -dr, mode = 'add')
-
-    return pressures_cur       
-        
-def linear_transform(zerod_lpn: LPN, threed_c: Centerlines, M: Manager, junctions:set, vessels: set, iterations: int):
+def linear_transform(zerod_lpn: LPN, threed_c: Centerlines, M: Manager, junctions:set, vessels: set, iterations: int, transient = False):
     
     total_glob = 0
     for i in range(iterations):
         for side in  'MPA', 'RPA', 'LPA':
             print(f"Evaluating {side}.")
-            total_glob += linear_transform_side(zerod_lpn, threed_c, M, side, junctions, vessels)
+            total_glob += linear_transform_side(zerod_lpn, threed_c, M, side, junctions, vessels, transient)
     # print(total_glob)
         
-def linear_transform_side(zerod_lpn: LPN, threed_c: Centerlines, M: Manager, side, junctions: set, vessels: set):
+def linear_transform_side(zerod_lpn: LPN, threed_c: Centerlines, M: Manager, side, junctions: set, vessels: set, transient = False):
 
     # get relevant positions
     tree = zerod_lpn.get_tree()
@@ -157,44 +120,39 @@ def linear_transform_side(zerod_lpn: LPN, threed_c: Centerlines, M: Manager, sid
         
     # points of interest
     poi_3d = junction_gids + segment_gids + [0] # include inlet
-    poi_0d = lambda df: pd.concat([df.iloc[junction_outlet_vessels]['pressure_in'], df.iloc[segment_vess_ids]['pressure_out'], df.iloc[[0]]['pressure_in']]).to_numpy()
+    poi_0d = lambda res: res.get_poi([('pressure_in', junction_outlet_vessels), ('pressure_out', segment_vess_ids), ('pressure_in', [0])])
     
     # extract target pressures.
     target_pressures = threed_c.get_pointdata_array("avg_pressure")[poi_3d]
     
     # compute initial case
     tmp = Solver0Dcpp(zerod_lpn, last_cycle_only=True, mean_only=True, debug = False)
-    init_sim = tmp.run_sim()
+    init_sim = tmp.run_sim_mean()
     init_sim.convert_to_mmHg()
-    pressures_init = poi_0d(init_sim.result_df)
+    pressures_init = poi_0d(init_sim)
         
-    # submit jobs
-    futures = []
-    with ProcessPoolExecutor() as executor:
-        # iterate through each junction outlet (submit futures)
-        for junc_node in junction_nodes:
-            for idx in junctions[junc_node.ids[0]]:
-                print(f"Changing junction {junc_node.id} downstream vessel {idx}.")
-                futures.append(executor.submit(junc_sim, zerod_lpn.get_fast_lpn(), junc_node.id, idx, [junction_outlet_vessels, segment_vess_ids, [0]]))
-        # iterate through vessel segments
-        for vid in segment_vess_ids:
-            print(f"Changing vessel {vid}.")
-            futures.append(executor.submit(vess_sim, zerod_lpn.get_fast_lpn(), vid, [junction_outlet_vessels, segment_vess_ids, [0]]))
-            
-        
-        pressures = []
-        # parse futures in order
-        print("Retrieving results...")
-        for idx, f in enumerate(futures):
-            
-            ps = f.result()
-            #print(ps, pressures_init)
-            # compute difference
-            pressures.append( ps - pressures_init)
-            print(f"\tRetrieved results for process {idx}/{len(futures)}")
+    # one R = 1 perturbation per junction outlet, then per vessel segment
+    params = []
+    for junc_node in junction_nodes:
+        for idx in junctions[junc_node.ids[0]]:
+            params.append(('junction', junc_node.id, idx))
+    for vid in segment_vess_ids:
+        params.append(('vessel', vid))
     
+    poi = [('pressure_in', junction_outlet_vessels), ('pressure_out', segment_vess_ids), ('pressure_in', [0])]
+    if transient:
+        # one transient simulation per R = 1 perturbation
+        print("Computing transient sensitivities...")
+        with Jacobian(zerod_lpn, [p + ('R',) for p in params], poi, steps = np.ones(len(params)), last_cycle_only=True) as jac:
+            _, J = jac.jacobian()
+        pressures = list(d2m(J).T)
+    else:
+        # dP/dR of every parameter from a single steady state factorization
+        print("Computing steady state sensitivities...")
+        steady = SteadySolver(zerod_lpn)
+        steady.solve()
+        pressures = list(steady.sensitivity(poi, params, mmHg = True).T)
     
-
     # convert to numpy
     # add constant & transpose
     pressures.append(np.ones_like(poi_3d))
@@ -243,6 +201,7 @@ if __name__ == '__main__':
     parser.add_argument("-n", dest = 'name', help = 'Name for stented model')
     parser.add_argument("--points", default=4, type=int, help='Number of points to correct for (should be determined by find_stenosis_regions.py). Defaults to 4.')
     parser.add_argument("--iter", default=5, type=int, help="Number of iterations to correct for.")
+    parser.add_argument("--transient", action='store_true', default=False, help="Compute sensitivities with a transient simulation per perturbation rather than a steady state linear solve.")
     args = parser.parse_args()
     
     
@@ -295,11 +254,11 @@ if __name__ == '__main__':
     M.register('relevant_regions', str(relevant_regions), ['parameterization','corrections', args.name])
     
     # linear transform
-    linear_transform(zerod_lpn,threed_formatted_c, M, junc_ids, vess_ids, args.iter)
+    linear_transform(zerod_lpn,threed_formatted_c, M, junc_ids, vess_ids, args.iter, args.transient)
     
     # run the pipeline
     solver = Solver0Dcpp(zerod_lpn, debug = True)
-    solver.run_sim_pipeline(validate=True, save_csv=True, save_branch=False, out_dir = str(correction_dir))
-    M.register('csv', str(correction_dir / 'branch_results.csv'), ['parameterization','corrections', args.name])
+    solver.run_sim_pipeline(validate=True, save_csv=False, save_branch=False, out_dir = str(correction_dir))
+    M.register('results', str(correction_dir / 'branch_results'), ['parameterization','corrections', args.name])
     M.update()
     
\ No newline at end of file
@@ -12,46 +12,35 @@ from pathlib import Path
 import json
 import argparse
 import time
-from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
-from svinterface.core.zerod.solver import Solver0Dcpp
-from svinterface.core.zerod.lpn import LPN, FastLPN
+from svinterface.core.zerod.solver import SolverResults
+from svinterface.core.zerod.batch import BatchRunner
+from svinterface.core.zerod.lpn import LPN
+from svinterface.core.zerod.parameters import ParameterizationOperator
 from svinterface.manager.baseManager import Manager
+from svinterface.utils.shards import ShardedWriter
 
 
-def remote_run_sim(param, base_lpn: FastLPN, lpn_mapping: tuple):
+def param_operator(base_lpn: LPN, lpn_mapping: tuple):
+    ''' builds the operator mapping a parameterization (one coefficient per simulation) to the resistances of the base lpn '''
     
     all_vess, all_vess_dr, all_juncs, all_juncs_dr = lpn_mapping
-    # take the parameterization and apply it to lpn
-    
-    for idx, coef in enumerate(param):
-        for vidx, max_dr in list(zip(all_vess[idx], all_vess_dr[idx])):
-            # add the modified coefficient
-            base_lpn.change_vessel(vidx, R = max_dr * coef, mode='add')
-    
-        for jidx, max_drs in list(zip(all_juncs[idx], all_juncs_dr[idx])):
+    columns = []
+    for idx in range(len(all_vess)):
+        # the coefficient scales the full change of every relevant vessel and junction outlet
+        changes = [(('vessel', vidx, 'R'), max_dr) for vidx, max_dr in zip(all_vess[idx], all_vess_dr[idx])]
+        for jidx, max_drs in zip(all_juncs[idx], all_juncs_dr[idx]):
             for outlet_idx, max_dr in enumerate(max_drs):
-                base_lpn.change_junction_outlet(int(jidx[1:]), which=all_juncs[idx][jidx][outlet_idx], R=max_dr * coef, mode='add')
-    
-    
-    # run simulation
-    solver = Solver0Dcpp(base_lpn)
-    results = solver.run_sim()
-    
-    # add MPA in
-    vname = base_lpn.lpn_data[base_lpn.VESS][0]['vessel_name']
-    targets = [*results.get_summ_val(vname, 'flow_in'),
-            *results.get_summ_val(vname, 'pressure_in')]
-    # for every vess, get the out
-    for vess in base_lpn.lpn_data[base_lpn.VESS]:
-        vname = vess['vessel_name']
-        
-        targets += [*results.get_summ_val(vname, 'flow_out')]
-        targets += [*results.get_summ_val(vname, 'pressure_out')]
-    
-    del results, solver
+                changes.append((('junction', int(jidx[1:]), all_juncs[idx][jidx][outlet_idx], 'R'), max_dr))
+        columns.append(changes)
+    return ParameterizationOperator(base_lpn.get_parameters(), columns)
 
-    return np.float32(np.array(targets))
+def get_targets(results: SolverResults, vessel_names: list):
+    ''' extracts the MPA (first vessel of the lpn) in and every vessel's out summary values, ordered as the vessels of the lpn '''
+    targets = np.concatenate([results.summarize(fields = ('flow', 'pressure'), which = 'in', vessels = vessel_names[:1]).ravel(),
+                              results.summarize(fields = ('flow', 'pressure'), which = 'out', vessels = vessel_names).ravel()])
+    return np.float32(targets)
 
 def sobol_data_gen(size, num_samples, seed):
     
@@ -97,7 +86,7 @@ def parameterize(M: Manager):
             
 
 
-def generate_data(M: Manager, data_dir: Path, samples: list):
+def generate_data(M: Manager, data_dir: Path, samples: list, shard_size: int = 1024):
     """ Generate Data Proc """
     train_dir = data_dir / 'train_data'
     val_dir = data_dir / 'val_data'
@@ -105,53 +94,34 @@ def generate_data(M: Manager, data_dir: Path, samples: list):
     
     total_sims = len(get_sim_names(M))
     base_lpn, all_vess, all_vess_dr, all_juncs, all_juncs_dr = parameterize(M)
+    op = param_operator(base_lpn, (all_vess, all_vess_dr, all_juncs, all_juncs_dr))
     
-    for idx, (name, mode_dir, num_samples) in enumerate(zip(['train data', 'val data', 'test data'],[train_dir, val_dir, test_dir], samples)):
-        
-        # make dir
-        mode_dir.mkdir(exist_ok=True)
-        
-        # sobol sample data
-        parameterization = sobol_data_gen(size=total_sims,
-                              num_samples=num_samples,
-                              seed=42 + idx)
-
-        # pass to each process, each executor handles incr (128) simulations before creating a fresh set of subprocesses
-
-        y = []
-        cur, incr = 0, 32
-        counter = 0
-        
-        while cur < num_samples:
+    # workers hold the base lpn, so only the changed resistances of each sample are sent
+    vessel_names = [vess['vessel_name'] for vess in base_lpn.lpn_data[base_lpn.VESS]]
+    with BatchRunner(base_lpn, partial(get_targets, vessel_names = vessel_names)) as runner:
+        for idx, (name, mode_dir, num_samples) in enumerate(zip(['train data', 'val data', 'test data'],[train_dir, val_dir, test_dir], samples)):
             
-            # restart executor
-            if cur % (4 * incr) == 0:
-                executor = ProcessPoolExecutor()
-
-            # submit jobs in batches of 32
-            start = time.time()
-            futures = []
-            for p in parameterization[cur:cur + incr]:
-                futures.append(executor.submit(remote_run_sim, p, base_lpn.get_fast_lpn(), (all_vess, all_vess_dr, all_juncs, all_juncs_dr)))
+            # make dir
+            mode_dir.mkdir(exist_ok=True)
             
-            # get futures
-            for f in futures:
-                y.append(f.result())
-                counter += 1
-                print(f"Retrieved results for simulation {counter}/{num_samples}.", flush = True)
-                
-            
-            del futures
-            cur += incr
-            print(f"Time (sec) taken for last {incr} jobs: {time.time() - start}")
-            
-            # restart executor
-            if cur % (4 * incr) == 0:
-                executor.shutdown(wait=True)
+            # sobol sample data
+            parameterization = sobol_data_gen(size=total_sims,
+                                num_samples=num_samples,
+                                seed=42 + idx)
+
+            # write shard by shard, skipping shards completed by a previous run
+            writer = ShardedWriter(mode_dir, parameterization, shard_size = shard_size)
+            if writer.complete:
+                print(f"{name} already generated.")
+                continue
+            print(f"Generating {name}: {writer.num_completed}/{num_samples} samples already completed.")
             
-        y = np.vstack(y)
-        np.save(mode_dir / 'input.npy', parameterization)
-        np.save(mode_dir / 'output.npy', y)
+            start = time.time()
+            # resistances of every pending sample in one sparse product
+            values = op(parameterization[list(writer.pending_indices())])
+            writer.consume(runner.imap_vectors(values, op.params),
+                           callback = lambda shard, completed: print(f"Saved shard {shard}. Completed {completed}/{num_samples} simulations.", flush = True))
+            print(f"Time (sec) taken for {num_samples} jobs: {time.time() - start}")
         
 
 if __name__ == '__main__':
@@ -161,6 +131,7 @@ if __name__ == '__main__':
     parser.add_argument('-ntrain', dest = 'num_train_samples', default = 8192, type = int, help = 'num_train_samples will be generated for training data. Use a power of 2 to guarentee balance properties. Default: 8192 = 2^13.')
     parser.add_argument('-nval', dest = 'num_val_samples', default = 1024, type = int, help = 'num_val_samples will be generated for validation data. Use a power of 2 to guarentee balance properties. Default: 1024 = 2^10.')
     parser.add_argument('-ntest', dest = 'num_test_samples', default = 1024, type = int, help = 'num_test_samples will be generated for testing data. Use a power of 2 to guarentee balance properties. Default: 1024 = 2^10.')
+    parser.add_argument('-shard_size', dest = 'shard_size', default = 1024, type = int, help = 'Number of samples saved at a time. Reruns resume from the last completed shard. Default: 1024.')
     args = parser.parse_args()
     
     M = Manager(args.config)
@@ -172,6 +143,6 @@ if __name__ == '__main__':
     M.register('model_data', str(data_dir), depth=['NN_DIR'])
     
     # generate data
-    generate_data(M, data_dir, [args.num_train_samples, args.num_val_samples, args.num_test_samples])
+    generate_data(M, data_dir, [args.num_train_samples, args.num_val_samples, args.num_test_samples], shard_size = args.shard_size)
     
     
\ No newline at end of file
@@ -18,6 +18,8 @@ from pytorch_lightning.callbacks import ModelCheckpoint, EarlyStopping
 from pytorch_lightning.loggers import CSVLogger
 from pathlib import Path
 
+from svinterface.utils.shards import ShardedWriter
+
 
 class BasicNN(nn.Module):
     """ Basic Neural Network """
@@ -96,8 +98,8 @@ class Dataset0D(tdata.Dataset):
     """Dataset for input and outputs, performs a transformation"""
     
     def __init__(self, input_file, output_file, train=False):
-        self.input = np.load(input_file)
-        self.output= np.load(output_file)
+        # memory mapped, copied on write
+        self.input, self.output = ShardedWriter.load(Path(input_file).parent, Path(input_file).name, Path(output_file).name)
         self.train = train
         
     def reduce_data(self, count):
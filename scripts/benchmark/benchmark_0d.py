@@ -0,0 +1,152 @@
+# File: benchmark_0d.py
+#
+# Description: Benchmarks the 0D interface (solve, result extraction, tree construction, gid mapping and centerline projection) on synthetic pulmonary trees of increasing size. Reports timings, throughput and peak memory as JSON.
+
+from svinterface.core.zerod.solver import Solver0Dcpp, SolverResults
+from svinterface.core.zerod.projection import CenterlineProjection
+from svinterface.core.zerod.synthetic import MorphometricTree
+
+import numpy as np
+import argparse
+import json
+import time
+import platform
+import resource
+import tracemalloc
+from pathlib import Path
+
+
+#############
+# Benchmark #
+#############
+
+def measure(fn, repeat: int):
+    """Times fn over repeats, then measures the peak python memory of one more call.
+    Tracing slows calls down, so memory is measured separately, and allocations inside the C++ solver are not traced.
+
+    Args:
+        fn (callable): function to benchmark
+        repeat (int): number of timed calls
+
+    Returns:
+        tuple: (result of the last timed call, stats dict)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'min_s': min(times), 'median_s': float(np.median(times)), 'mean_s': float(np.mean(times)), 'peak_python_bytes': peak}
+
+def benchmark_tree(generations: int, segments: int, points_per_segment: int, num_time_pts: int, num_cycles: int, repeat: int, solve = True):
+    """Benchmarks every stage on one synthetic tree.
+
+    Args:
+        generations (int): number of bifurcation generations
+        segments (int): vessel segments per branch
+        points_per_segment (int): centerline points per segment
+        num_time_pts (int): time points per cardiac cycle
+        num_cycles (int): number of cardiac cycles
+        repeat (int): timed calls of each stage
+        solve (bool, optional): benchmark stages that need the 0D solver. Defaults to True.
+
+    Returns:
+        dict: sizes of the tree and stats of each stage
+    """
+    stats = {}
+    def generate():
+        tree = MorphometricTree(generations)
+        return tree.to_lpn(segments = segments, num_cycles = num_cycles, num_time_pts = num_time_pts), tree.to_centerlines(segments * points_per_segment + 1)
+    (lpn, cent), stats['generate'] = measure(generate, 1)
+    lpn_data = lpn.lpn_data
+    num_vessels = len(lpn_data['vessels'])
+    num_points = cent.polydata.GetNumberOfPoints()
+    
+    def throughput(stage, count, unit):
+        stats[stage].setdefault('throughput', {})[unit] = count / stats[stage]['min_s']
+    
+    # tree construction
+    _, stats['get_tree'] = measure(lpn.get_tree, repeat)
+    throughput('get_tree', num_vessels, 'vessels_per_s')
+    
+    # centerline gid mapping
+    _, stats['find_gids'] = measure(lambda: lpn.find_gids(cent), repeat)
+    throughput('find_gids', num_points, 'points_per_s')
+    
+    # projection operator
+    projection, stats['projection_build'] = measure(lambda: CenterlineProjection(lpn, cent), repeat)
+    throughput('projection_build', num_points, 'points_per_s')
+    
+    result = {'generations': generations,
+              'segments': segments,
+              'num_vessels': num_vessels,
+              'num_junctions': len(lpn_data['junctions']),
+              'num_outlets': len(lpn_data['boundary_conditions']) - 1,
+              'num_centerline_points': num_points,
+              'stages': stats}
+    if not solve:
+        return result
+    
+    # full solve, keeping the last cycle
+    results, stats['run_sim'] = measure(lambda: Solver0Dcpp(lpn, last_cycle_only = True).run_sim(), repeat)
+    num_rows = len(results.result_df)
+    throughput('run_sim', num_rows, 'rows_per_s')
+    throughput('run_sim', num_vessels * num_cycles, 'vessel_cycles_per_s')
+    
+    _, stats['run_sim_mean'] = measure(lambda: Solver0Dcpp(lpn, last_cycle_only = True, mean_only = True).run_sim_mean(), repeat)
+    throughput('run_sim_mean', num_vessels * num_cycles, 'vessel_cycles_per_s')
+    
+    # result extraction, on new results objects so cached summaries are not reused
+    _, stats['summarize'] = measure(lambda: SolverResults(results.result_df).summarize(), repeat)
+    throughput('summarize', num_rows, 'rows_per_s')
+    _, stats['convert_to_python'] = measure(lambda: results.convert_to_python(lpn), repeat)
+    throughput('convert_to_python', num_vessels, 'vessels_per_s')
+    
+    # projection of every time step onto the centerlines
+    _, stats['project_to_centerline'] = measure(lambda: results.project_to_centerline(lpn, cent, projection), repeat)
+    throughput('project_to_centerline', num_points * num_time_pts, 'point_steps_per_s')
+    
+    result['num_result_rows'] = num_rows
+    return result
+
+
+if __name__ == '__main__':
+    
+    parser = argparse.ArgumentParser(description = 'Benchmarks the 0D interface on synthetic trees of increasing size and saves timings, throughput and peak memory as JSON.')
+    parser.add_argument('-g', dest = 'generations', type = int, nargs = '+', default = [2, 4, 6, 8], help = 'bifurcation generations of each tree (2^g outlets). Default: 2 4 6 8.')
+    parser.add_argument('-s', dest = 'segments', type = int, default = 3, help = 'vessel segments per branch. Default: 3.')
+    parser.add_argument('-p', dest = 'points', type = int, default = 10, help = 'centerline points per vessel segment. Default: 10.')
+    parser.add_argument('-t', dest = 'time_pts', type = int, default = 50, help = 'time points per cardiac cycle. Default: 50.')
+    parser.add_argument('-c', dest = 'cycles', type = int, default = 6, help = 'number of cardiac cycles. Default: 6.')
+    parser.add_argument('-r', dest = 'repeat', type = int, default = 3, help = 'timed calls of each stage, the fastest is used for throughput. Default: 3.')
+    parser.add_argument('-o', dest = 'outfile', default = 'benchmark_0d.json', help = 'JSON report. Default: benchmark_0d.json.')
+    parser.add_argument('--no_solve', dest = 'solve', action = 'store_false', default = True, help = 'skip stages that need the 0D solver.')
+    args = parser.parse_args()
+    
+    report = {'config': vars(args),
+              'environment': {'python': platform.python_version(),
+                              'numpy': np.__version__,
+                              'platform': platform.platform(),
+                              'processor': platform.processor()},
+              'trees': []}
+    
+    for g in args.generations:
+        print(f"Benchmarking a tree of {g} generations...", flush = True)
+        result = benchmark_tree(g, args.segments, args.points, args.time_pts, args.cycles, args.repeat, args.solve)
+        report['trees'].append(result)
+        print(f"\t{result['num_vessels']} vessels, {result['num_centerline_points']} centerline points")
+        for stage, st in result['stages'].items():
+            rates = ', '.join(f"{v:.4g} {k}" for k, v in st.get('throughput', {}).items())
+            print(f"\t{stage:<24}{st['min_s']:>10.4f} s   {rates}")
+    
+    # peak resident memory of the whole run (kilobytes on linux)
+    report['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    
+    outfile = Path(args.outfile)
+    with outfile.open('w') as ofile:
+        json.dump(report, ofile, indent = 4)
+    print(f"Saved report to {outfile}.")
@@ -0,0 +1,37 @@
+# File: make_synthetic_lpn.py
+#
+# Description: Writes a synthetic LPN (and optionally matching centerlines) of a morphometric pulmonary tree, for scale testing without SimVascular.
+
+from svinterface.core.zerod.synthetic import MorphometricTree
+from svinterface.core.bc import Inflow
+from pathlib import Path
+import argparse
+
+if __name__ == '__main__':
+    
+    parser = argparse.ArgumentParser(description = 'Writes a synthetic LPN of a morphometric tree')
+    
+    parser.add_argument('-o', dest = 'outfile', help = 'path of the lpn file to write')
+    parser.add_argument('-g', dest = 'generations', type = int, default = 8, help = 'maximum number of bifurcation generations: Default = 8')
+    parser.add_argument('-s', dest = 'segments', type = int, default = 1, help = 'vessel segments per branch: Default = 1')
+    parser.add_argument('-a', dest = 'asymmetry', type = float, default = 1.0, help = 'radius ratio of the minor to major child of each bifurcation: Default = 1.0')
+    parser.add_argument('--min_radius', type = float, default = 0.0, help = 'do not split branches below this radius (cm): Default = 0.0')
+    parser.add_argument('--variability', type = float, default = 0.0, help = 'lognormal variability of asymmetry and lengths: Default = 0.0')
+    parser.add_argument('--seed', type = int, default = None, help = 'random seed: Default = None')
+    parser.add_argument('-i', dest = 'inflow', default = None, help = 'inflow file: Default = a synthetic inflow')
+    parser.add_argument('-c', dest = 'centerlines', action = 'store_true', default = False, help = 'also write centerlines next to the lpn: Default = False')
+    
+    args = parser.parse_args()
+    
+    tree = MorphometricTree(args.generations, asymmetry = args.asymmetry, min_radius = args.min_radius, variability = args.variability, seed = args.seed)
+    inflow = Inflow.from_file(args.inflow) if args.inflow else None
+    lpn = tree.to_lpn(inflow, segments = args.segments)
+    
+    outfile = Path(args.outfile)
+    lpn.write_lpn_file(str(outfile))
+    print(f"Wrote an LPN of {len(tree)} branches, {lpn.num_vessels()} vessels and {len(tree.outlets)} outlets to {outfile}.")
+    
+    if args.centerlines:
+        cent = tree.to_centerlines()
+        cent.write_polydata(str(outfile.with_suffix('.vtp')))
+        print(f"Wrote centerlines to {outfile.with_suffix('.vtp')}.")
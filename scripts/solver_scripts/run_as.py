@@ -7,6 +7,7 @@
 # Description: Solves an LPN
 
 from svinterface.core.zerod.solver import Solver0Dcpp
+from svinterface.core.zerod.cache import ResultCache
 from svinterface.core.zerod.lpn import LPN
 from svinterface.manager.baseManager import Manager
 
@@ -19,11 +20,15 @@ if __name__ == '__main__':
     
     parser.add_argument('-i', dest = 'config', help = 'path to input lpn')
     parser.add_argument('-sim', type = int, help = 'as_simulation number')
-    parser.add_argument('-c', dest = 'csv', action = 'store_true', default = False, help = 'save csv file: Default = False')
+    parser.add_argument('-c', dest = 'csv', action = 'store_true', default = False, help = 'also save a csv file (binary results are always saved): Default = False')
     parser.add_argument('-b', dest = 'branch', action = 'store_true', default=False,  help = 'to convert c output to python branch files: Default = False')
     parser.add_argument('--l', dest = 'last_cycle', action = 'store_true', default = False, help = 'only save the last cycle worth of results: Default = False')
     parser.add_argument('--m', dest = 'mean_only', action = 'store_true', default = False, help = 'only save the mean of the results: Default = False')
     parser.add_argument('-v', dest = 'validate', action = 'store_true', default = False, help = 'validate the run with inlet pressure waveform: Default = False')
+    parser.add_argument('--converge', dest = 'converge', type = float, default = None, help = 'run 3 cycles and rerun with the LPN number of cycles only if the cycle-to-cycle relative change is above this tolerance, keeping only the final cycle: Default = None (fixed number of cycles)')
+    parser.add_argument('--cache', dest = 'cache', default = None, help = 'directory of a result cache, reusing results of an identical lpn solved before: Default = None (no cache)')
+    parser.add_argument('--profile', dest = 'profile', action = 'store_true', default = False, help = 'time each stage of the run and save a profile.json report with the results: Default = False')
+    parser.add_argument('--cprofile', dest = 'cprofile', action = 'store_true', default = False, help = 'also capture a cProfile of the run (implies --profile): Default = False')
     
     
     
@@ -42,14 +47,15 @@ if __name__ == '__main__':
     # sim
     counter = args.sim
     
-    solver = Solver0Dcpp(lpn, last_cycle_only=args.last_cycle, mean_only=args.mean_only, debug = True)
+    solver = Solver0Dcpp(lpn, last_cycle_only=args.last_cycle, mean_only=args.mean_only, debug = True, cache = ResultCache(args.cache) if args.cache else None)
     
-    results = solver.run_sim_pipeline(validate = args.validate, save_csv = args.csv, save_branch = args.branch, out_dir = rez_dir)
+    results = solver.run_sim_pipeline(validate = args.validate, save_csv = args.csv, save_branch = args.branch, out_dir = rez_dir, converge_tol = args.converge, profile = args.profile, cprofile = args.cprofile)
     
+    M.register(key = "results", value = str(rez_dir / "branch_results"), depth = ['as_simulations', counter])
     if args.csv:
         M.register(key = "csv", value = str(rez_dir / "branch_results.csv"), depth = ['as_simulations', counter])    
     if args.branch:
-        M.register(key = "npy", value = str(rez_dir / "branch_results.npy"), depth = ['as_simulations', counter])    
+        M.register(key = "npz", value = str(rez_dir / "branch_results.npz"), depth = ['as_simulations', counter])    
     
     M.update()
     
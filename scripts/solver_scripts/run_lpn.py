@@ -7,6 +7,7 @@
 # Description: Solves an LPN
 
 from svinterface.core.zerod.solver import Solver0Dcpp
+from svinterface.core.zerod.cache import ResultCache
 from svinterface.core.zerod.lpn import LPN
 from svinterface.manager.baseManager import Manager
 
@@ -19,11 +20,15 @@ if __name__ == '__main__':
     
     parser.add_argument('-i', dest = 'config', help = 'path to input lpn')
     parser.add_argument("-n", dest = 'name', default = None, help = 'name of simulation')
-    parser.add_argument('-c', dest = 'csv', action = 'store_true', default = False, help = 'save csv file: Default = False')
+    parser.add_argument('-c', dest = 'csv', action = 'store_true', default = False, help = 'also save a csv file (binary results are always saved): Default = False')
     parser.add_argument('-b', dest = 'branch', action = 'store_true', default=False,  help = 'to convert c output to python branch files: Default = False')
     parser.add_argument('--l', dest = 'last_cycle', action = 'store_true', default = False, help = 'only save the last cycle worth of results: Default = False')
     parser.add_argument('--m', dest = 'mean_only', action = 'store_true', default = False, help = 'only save the mean of the results: Default = False')
     parser.add_argument('-v', dest = 'validate', action = 'store_true', default = False, help = 'validate the run with inlet pressure waveform: Default = False')
+    parser.add_argument('--converge', dest = 'converge', type = float, default = None, help = 'run 3 cycles and rerun with the LPN number of cycles only if the cycle-to-cycle relative change is above this tolerance, keeping only the final cycle: Default = None (fixed number of cycles)')
+    parser.add_argument('--cache', dest = 'cache', default = None, help = 'directory of a result cache, reusing results of an identical lpn solved before: Default = None (no cache)')
+    parser.add_argument('--profile', dest = 'profile', action = 'store_true', default = False, help = 'time each stage of the run and save a profile.json report with the results: Default = False')
+    parser.add_argument('--cprofile', dest = 'cprofile', action = 'store_true', default = False, help = 'also capture a cProfile of the run (implies --profile): Default = False')
     
     
     
@@ -57,15 +62,16 @@ if __name__ == '__main__':
     
     M.register(key = counter, value = {}, depth = ['simulations'])
     
-    solver = Solver0Dcpp(lpn, last_cycle_only=args.last_cycle, mean_only=args.mean_only, debug = True)
+    solver = Solver0Dcpp(lpn, last_cycle_only=args.last_cycle, mean_only=args.mean_only, debug = True, cache = ResultCache(args.cache) if args.cache else None)
     
-    results = solver.run_sim_pipeline(validate = args.validate, save_csv = args.csv, save_branch = args.branch, out_dir = rez_dir)
+    results = solver.run_sim_pipeline(validate = args.validate, save_csv = args.csv, save_branch = args.branch, out_dir = rez_dir, converge_tol = args.converge, profile = args.profile, cprofile = args.cprofile)
     M.register(key = "dir", value = str(rez_dir), depth = ['simulations',counter])
     
+    M.register(key = "results", value = str(rez_dir / "branch_results"), depth = ['simulations', counter])
     if args.csv:
         M.register(key = "csv", value = str(rez_dir / "branch_results.csv"), depth = ['simulations', counter])    
     if args.branch:
-        M.register(key = "npy", value = str(rez_dir / "branch_results.npy"), depth = ['simulations', counter])    
+        M.register(key = "npz", value = str(rez_dir / "branch_results.npz"), depth = ['simulations', counter])    
     
     # save a copy of the lpn
     lpn.write_lpn_file(str(rez_dir / lpn_file.name))
@@ -53,12 +53,12 @@ if __name__ == '__main__':
     lpn = LPN.from_file(sim['lpn'])
     
     # load results
-    results = SolverResults.from_csv(sim['csv'])
+    results = SolverResults.load(sim['results'] if 'results' in sim else sim['csv'])
     if args.mmHg:
         results.convert_to_mmHg()
 
     # update centerlines
-    c = results.project_to_centerline(lpn, c)
+    c = results.project_to_centerline(lpn, c, save_time_steps = not args.summary)
     
     output_file = 'centerline_projection.vtp'
     
@@ -0,0 +1,813 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy as v2n
+from scipy.spatial import cKDTree
+
+from svinterface.core.polydata import Centerlines
+from svinterface.utils.io import write_json
+
+
+##########
+# Most Code provited by Martin @ https://github.com/StanfordCBCL/DataCuration/blob/36f0e23ebe8c6a593d3d0c1b26cced940e25de40/get_mean_flow_3d.py#L60-L122
+###########
+
+
+class Integration:
+    """
+    Class to perform integration on slices
+    """
+
+    def __init__(self, inp):
+        try:
+            self.integrator = vtk.vtkIntegrateAttributes()
+        except AttributeError:
+            raise Exception('vtkIntegrateAttributes is currently only supported by pvpython')
+
+        if not inp.GetOutput().GetNumberOfPoints():
+            raise Exception('Empty slice')
+
+        self.integrator.SetInputData(inp.GetOutput())
+        self.integrator.Update()
+
+    def evaluate(self, res_name):
+        """
+        Evaluate integral.
+        Distinguishes between scalar integration (e.g. pressure) and normal projection (velocity)
+        Optionally divides integral by integrated area
+        Args:
+            field: pressure, velocity, ...
+            res_name: name of array
+        Returns:
+            Scalar integral
+        """
+        # type of result
+        field = res_name.split('_')[0]
+
+        if field == 'velocity':
+            int_name = 'normal_' + res_name
+        else:
+            int_name = res_name
+
+        # evaluate integral
+        integral = v2n(self.integrator.GetOutput().GetPointData().GetArray(int_name))[0]
+
+        # choose if integral should be divided by area
+        if field == 'velocity':
+            return integral
+        else:
+            return integral / self.area()
+
+    def area(self):
+        """
+        Evaluate integrated surface area
+        Returns:
+        Area
+        """
+        return v2n(self.integrator.GetOutput().GetCellData().GetArray('Area'))[0]
+
+
+def _reader(fname):
+    ''' xml reader of a vtp surface or vtu volume '''
+    _, ext = os.path.splitext(fname)
+    if ext == '.vtp':
+        reader = vtk.vtkXMLPolyDataReader()
+    elif ext == '.vtu':
+        reader = vtk.vtkXMLUnstructuredGridReader()
+    else:
+        raise ValueError('File extension ' + ext + ' unknown.')
+    reader.SetFileName(fname)
+    return reader
+
+def read_geo(fname):
+    """
+    Read geometry from file, chose corresponding vtk reader
+    Args:
+        fname: vtp surface or vtu volume mesh
+    Returns:
+        vtk reader, point data, cell data
+    """
+    reader = _reader(fname)
+    reader.Update()
+
+    return reader
+
+def read_array_names(fname):
+    """
+    Reads point data array names of a geometry file without reading its data
+    Args:
+        fname: vtp surface or vtu volume mesh
+    Returns:
+        list of point data array names
+    """
+    reader = _reader(fname)
+    reader.UpdateInformation()
+    return [reader.GetPointArrayName(i) for i in range(reader.GetNumberOfPointArrays())]
+
+def write_geo(fname, input):
+    """
+    Write geometry to file
+    Args:
+        fname: file name
+    """
+    _, ext = os.path.splitext(fname)
+    if ext == '.vtp':
+        writer = vtk.vtkXMLPolyDataWriter()
+    elif ext == '.vtu':
+        writer = vtk.vtkXMLUnstructuredGridWriter()
+    else:
+        raise ValueError('File extension ' + ext + ' unknown.')
+    writer.SetFileName(fname)
+    writer.SetInputData(input)
+    writer.Update()
+    writer.Write()
+
+def cut_plane(inp, origin, normal):
+    """
+    Cuts geometry at a plane
+    Args:
+        inp: InputConnection
+        origin: cutting plane origin
+        normal: cutting plane normal
+    Returns:
+        cut: cutter object
+    """
+    # define cutting plane
+    plane = vtk.vtkPlane()
+    plane.SetOrigin(origin[0], origin[1], origin[2])
+    plane.SetNormal(normal[0], normal[1], normal[2])
+
+    # define cutter
+    cut = vtk.vtkCutter()
+    cut.SetInputData(inp)
+    cut.SetCutFunction(plane)
+    cut.Update()
+    return cut
+
+def connectivity(inp, origin):
+    """
+    If there are more than one unconnected geometries, extract the closest one
+    Args:
+        inp: InputConnection
+        origin: region closest to this point will be extracted
+    Returns:
+        con: connectivity object
+    """
+    con = vtk.vtkConnectivityFilter()
+    con.SetInputData(inp.GetOutput())
+    con.SetExtractionModeToClosestPointRegion()
+    con.SetClosestPoint(origin[0], origin[1], origin[2])
+    con.Update()
+    return con
+
+def calculator(inp, function, inp_arrays, out_array):
+    """
+    Function to add vtk calculator
+    Args:
+        inp: InputConnection
+        function: string with function expression
+        inp_arrays: list of input point data arrays
+        out_array: name of output array
+    Returns:
+        calc: calculator object
+    """
+    calc = vtk.vtkArrayCalculator()
+    for a in inp_arrays:
+        calc.AddVectorArrayName(a)
+    calc.SetInputData(inp.GetOutput())
+    if hasattr(calc, 'SetAttributeModeToUsePointData'):
+        calc.SetAttributeModeToUsePointData()
+    else:
+        calc.SetAttributeTypeToPointData()
+    calc.SetFunction(function)
+    calc.SetResultArrayName(out_array)
+    calc.Update()
+    return calc
+
+def filter_res_names(names, res_fields):
+    ''' names of time step arrays (<field>_<time>) of res_fields
+    '''
+    res = []
+    for res_name in names:
+        field = res_name.split('_')[0]
+        num = res_name.split('_')[-1]
+
+        # check if field should be added to output
+        if field in res_fields:
+            try:
+                float(num)
+                res += [res_name]
+            except ValueError:
+                pass
+    return res
+
+def get_res_names(inp, res_fields):
+    ''' names of time step point data arrays of res_fields in a dataset
+    '''
+    pointdata = inp.GetPointData()
+    return filter_res_names([pointdata.GetArrayName(i) for i in range(pointdata.GetNumberOfArrays())], res_fields)
+
+def slice_vessel(inp_3d, origin, normal):
+    """
+    Slice 3d geometry at certain plane
+    Args:
+        inp_1d: vtk InputConnection for 1d centerline
+        inp_3d: vtk InputConnection for 3d volume model
+        origin: plane origin
+        normal: plane normal
+    Returns:
+        Integration object
+    """
+    # cut 3d geometry
+    cut_3d = cut_plane(inp_3d, origin, normal)
+
+    # extract region closest to centerline
+    con = connectivity(cut_3d, origin)
+
+    return con
+
+def get_integral(inp_3d, origin, normal):
+    """
+    Slice simulation at certain plane and integrate
+    Args:
+        inp_1d: vtk InputConnection for 1d centerline
+        inp_3d: vtk InputConnection for 3d volume model
+        origin: plane origin
+        normal: plane normal
+    Returns:
+        Integration object
+    """
+    # slice vessel at given location
+    inp = slice_vessel(inp_3d, origin, normal)
+
+    # recursively add calculators for normal velocities
+    for v in get_res_names(inp_3d, 'velocity'):
+        fun = 'dot((iHat*'+repr(normal[0])+'+jHat*'+repr(normal[1])+'+kHat*'+repr(normal[2])+'),' + v + ')'
+        inp = calculator(inp, fun, [v], 'normal_' + v)
+
+    return Integration(inp)
+
+
+##########################
+# Parallel Slice Engine  #
+##########################
+
+# per-process worker state, set once by _init_worker
+_worker = {}
+
+class SliceLocator:
+    """
+    Finds the cells of a volume near a slice, so only those are cut rather than the whole mesh.
+    Cell centers are stored in a prebuilt KD-tree, along with the distance from each center to its furthest vertex.
+    The few largest cells are kept out of the tree and always checked, so the tree is searched with a radius padded by the size of typical cells only.
+    """
+
+    def __init__(self, volume, quantile = 0.99):
+        """
+        Args:
+            volume: vtkUnstructuredGrid
+            quantile: cells with radii above this quantile are always checked rather than searched for
+        """
+        self.volume = volume
+
+        # cell centers and radii
+        cells = volume.GetCells()
+        offsets = v2n(cells.GetOffsetsArray())
+        conn = v2n(cells.GetConnectivityArray())
+        points = v2n(volume.GetPoints().GetData())[conn]
+        sizes = np.diff(offsets)
+        self.centers = np.add.reduceat(points, offsets[:-1], axis = 0) / sizes[:, None]
+        dist = np.linalg.norm(points - np.repeat(self.centers, sizes, axis = 0), axis = 1)
+        self.radii = np.maximum.reduceat(dist, offsets[:-1])
+
+        # tree of typical cells
+        self.pad = np.quantile(self.radii, quantile)
+        typical = self.radii <= self.pad
+        self.typical = np.flatnonzero(typical)
+        self.large = np.flatnonzero(~typical)
+        self.tree = cKDTree(self.centers[self.typical])
+
+    def cells_near(self, origin, normal, radius):
+        """
+        Ids of cells that may intersect a disk in the plane
+        Args:
+            origin: plane origin
+            normal: unit plane normal
+            radius: radius of the disk around origin
+        Returns:
+            np.ndarray of cell ids
+        """
+        found = np.array(self.tree.query_ball_point(origin, radius + self.pad, return_sorted = False), dtype = int)
+        ids = np.concatenate([self.typical[found], self.large])
+
+        # keep cells crossing the plane within the disk
+        d = self.centers[ids] - origin
+        along = d @ normal
+        across = np.linalg.norm(d - along[:, None] * normal, axis = 1)
+        r = self.radii[ids]
+        return ids[(np.abs(along) <= r) & (across <= radius + r)]
+
+    def clip(self, origin, normal, radius):
+        """
+        Extracts cells that may intersect a disk in the plane
+        Args:
+            origin: plane origin
+            normal: plane normal
+            radius: radius of the disk around origin
+        Returns:
+            vtkUnstructuredGrid of the cells
+        """
+        ids = self.cells_near(np.asarray(origin, dtype = float), np.asarray(normal, dtype = float) / np.linalg.norm(normal), radius)
+        cells = vtk.vtkIdList()
+        cells.SetNumberOfIds(len(ids))
+        for k, i in enumerate(ids.tolist()):
+            cells.SetId(k, i)
+        extract = vtk.vtkExtractCells()
+        extract.SetInputData(self.volume)
+        extract.SetCellList(cells)
+        extract.Update()
+        return extract.GetOutput()
+
+def local_slice(locator, origin, normal, radius, scale = 1.5, max_grow = 4):
+    """
+    Slices a volume at a plane, cutting only the cells near the origin.
+    Cells intersecting a disk of scale * radius are cut, and the disk is doubled until the extracted cross section lies within it, falling back on the whole volume.
+    Args:
+        locator: SliceLocator of the volume
+        origin: plane origin
+        normal: plane normal
+        radius: approximate radius of the cross section, or None to cut the whole volume
+        scale: radius of the disk relative to radius
+        max_grow: maximum number of times the disk is doubled
+    Returns:
+        con: connectivity object of the cross section
+    """
+    if radius is not None and radius > 0:
+        disk = scale * radius
+        for _ in range(max_grow + 1):
+            local = locator.clip(origin, normal, disk)
+            if local.GetNumberOfCells():
+                con = connectivity(cut_plane(local, origin, normal), origin)
+                out = con.GetOutput()
+                # every cell within the disk is cut, so a cross section inside it is complete
+                if out.GetNumberOfPoints() and np.linalg.norm(v2n(out.GetPoints().GetData()) - origin, axis = 1).max() < disk:
+                    return con
+            disk *= 2
+    return slice_vessel(locator.volume, origin, normal)
+
+def _init_worker(fpath_3d, res_names, local = True):
+    ''' loads the volume once per worker process, and builds its cell locator when slicing locally
+    '''
+    _worker['volume'] = read_geo(fpath_3d).GetOutput()
+    _worker['locator'] = SliceLocator(_worker['volume']) if local else None
+    _worker['res_names'] = res_names
+
+def integration_weights(surface):
+    """
+    Point weights integrating linearly interpolated point data over the polygons of a surface.
+    Polygons are split into triangle fans, and each vertex is given a third of the area of its triangles.
+    Args:
+        surface: vtkPolyData or vtkUnstructuredGrid of polygons (i.e. a slice)
+    Returns:
+        point weights, area
+    """
+    cells = surface.GetPolys() if isinstance(surface, vtk.vtkPolyData) else surface.GetCells()
+    offsets = v2n(cells.GetOffsetsArray())
+    conn = v2n(cells.GetConnectivityArray())
+    points = v2n(surface.GetPoints().GetData()) if surface.GetNumberOfPoints() else np.zeros((0, 3))
+
+    # fan triangles (v0, vk, vk+1) of every cell, lines and vertices have none
+    num_tris = np.maximum(np.diff(offsets) - 2, 0)
+    first = np.repeat(offsets[:-1], num_tris)
+    k = np.arange(num_tris.sum()) - np.repeat(np.cumsum(num_tris) - num_tris, num_tris)
+    tris = np.stack([conn[first], conn[first + k + 1], conn[first + k + 2]], axis = 1)
+
+    p = points[tris]
+    areas = 0.5 * np.linalg.norm(np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0]), axis = 1)
+    weights = np.bincount(tris.ravel(), weights = np.repeat(areas / 3, 3), minlength = len(points))
+    return weights, areas.sum()
+
+def integrate_arrays(surface, normal, res_names):
+    """
+    Integrates every time step of result arrays over a surface at once, as weighted sums of [points, time steps] matrices.
+    Velocities are projected onto the normal (flows), and other fields are divided by the area (mean pressures).
+    Args:
+        surface: vtkPolyData or vtkUnstructuredGrid of polygons (i.e. a slice)
+        normal: surface normal
+        res_names: point data arrays to integrate
+    Returns:
+        integrals of res_names, area
+    """
+    weights, area = integration_weights(surface)
+    if area == 0:
+        raise Exception('Empty slice')
+    pointdata = surface.GetPointData()
+    values = np.empty(len(res_names))
+
+    velocities = [j for j, name in enumerate(res_names) if name.split('_')[0] == 'velocity']
+    scalars = [j for j, name in enumerate(res_names) if name.split('_')[0] != 'velocity']
+    if velocities:
+        # [points, time steps, 3] . normal
+        vel = np.stack([v2n(pointdata.GetArray(res_names[j])) for j in velocities], axis = 1)
+        values[velocities] = weights @ (vel @ np.asarray(normal, dtype = float))
+    if scalars:
+        # [points, time steps]
+        sca = np.stack([v2n(pointdata.GetArray(res_names[j])) for j in scalars], axis = 1)
+        values[scalars] = weights @ sca / area
+    return values, area
+
+def integrate_slice(volume, origin, normal, res_names, locator = None, radius = None):
+    """Slices a volume at a plane and integrates result arrays over the cross section.
+
+    Args:
+        volume (vtkUnstructuredGrid): 3D results
+        origin (np.ndarray): plane origin
+        normal (np.ndarray): plane normal
+        res_names (list): result arrays to integrate
+        locator (SliceLocator, optional): locator of volume, to only cut cells near the origin. Defaults to None (cut the whole volume).
+        radius (float, optional): approximate radius of the cross section, sizing the cut region. Defaults to None (cut the whole volume).
+
+    Returns:
+        tuple: (integrals of res_names (mean pressures and flows), area)
+    """
+    if locator is None:
+        inp = slice_vessel(volume, origin, normal)
+    else:
+        inp = local_slice(locator, origin, normal, radius)
+
+    return integrate_arrays(inp.GetOutput(), normal, res_names)
+
+def _integrate_chunk(chunk):
+    ''' integrates a chunk of (point id, origin, normal, radius) slices in a worker, returning the error message of slices that failed '''
+    out = []
+    for i, origin, normal, radius in chunk:
+        try:
+            values, area = integrate_slice(_worker['volume'], origin, normal, _worker['res_names'], _worker['locator'], radius)
+            error = None
+        except Exception as e:
+            values, area, error = None, None, f'{type(e).__name__}: {e}'
+        out.append((i, values, area, error))
+    return out
+
+def _imap_unordered(executor, chunks, max_pending):
+    ''' submits chunks while bounding the number in flight, yielding results in order of completion
+    '''
+    chunks = iter(chunks)
+    pending = set()
+
+    def submit():
+        chunk = next(chunks, None)
+        if chunk is not None:
+            pending.add(executor.submit(_integrate_chunk, chunk))
+        return chunk is not None
+
+    for _ in range(max_pending):
+        if not submit():
+            break
+
+    while pending:
+        done, _ = wait(pending, return_when = FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+            submit()
+            yield future.result()
+
+def integrate_slices(fpath_3d, ids, origins, normals, res_names, radii = None, num_workers = 1, chunksize = 8, progress = None):
+    """Slices and integrates the volume at many points, partitioning slices across worker processes that each load the volume once.
+    When radii are given, each worker builds a SliceLocator of the volume and only cuts the cells near each slice.
+
+    Args:
+        fpath_3d (str): vtu file of 3D results
+        ids (np.ndarray): point ids of slices
+        origins (np.ndarray): [slices, 3] plane origins
+        normals (np.ndarray): [slices, 3] plane normals
+        res_names (list): result arrays to integrate
+        radii (np.ndarray, optional): [slices] approximate cross section radii. Defaults to None (cut the whole volume at every slice).
+        num_workers (int, optional): number of worker processes. Defaults to 1 (in this process).
+        chunksize (int, optional): slices per task. Defaults to 8.
+        progress (callable, optional): wraps an iterable of chunks to report progress, i.e. tqdm. Defaults to None.
+
+    Yields:
+        tuple: (point id, integrals of res_names, area, error message), in order of completion. Failed slices have None integrals and area, and others a None error.
+    """
+    local = radii is not None
+    if not local:
+        radii = [None] * len(ids)
+    slices = list(zip(ids, origins, normals, radii))
+    chunks = [slices[i:i + chunksize] for i in range(0, len(slices), chunksize)]
+    if progress is None:
+        progress = lambda it, total: it
+
+    if num_workers == 1:
+        _init_worker(fpath_3d, res_names, local)
+        for chunk in progress(chunks, total = len(chunks)):
+            yield from _integrate_chunk(chunk)
+        return
+
+    executor = ProcessPoolExecutor(max_workers = num_workers, initializer = _init_worker, initargs = (fpath_3d, res_names, local))
+    try:
+        for out in progress(_imap_unordered(executor, chunks, 2 * num_workers), total = len(chunks)):
+            yield from out
+    except BaseException:
+        # drop queued chunks rather than running them, so an interrupted extraction can save its checkpoint right away
+        executor.shutdown(wait = False, cancel_futures = True)
+        raise
+    executor.shutdown(wait = True)
+
+
+def slice_planes(centerlines: Centerlines, ids, eps_norm = 1.0e-3):
+    """Plane origins and normals of slices at points of the centerlines. Caps are slightly moved inwards to ensure nice integration.
+
+    Args:
+        centerlines (Centerlines): centerlines
+        ids (np.ndarray): point ids to slice
+        eps_norm (float, optional): distance caps are moved along the normal. Defaults to 1.0e-3.
+
+    Returns:
+        tuple: (origins, normals)
+    """
+    polydata = centerlines.polydata
+    points = centerlines.get_points()[ids].copy()
+    normals = centerlines.get_pointdata_array(centerlines.PointDataFields.NORMAL)[ids]
+    gid = centerlines.get_pointdata_array(centerlines.PointDataFields.NODEID)[ids]
+
+    cells = vtk.vtkIdList()
+    for k, i in enumerate(ids):
+        # check if point is cap
+        polydata.GetPointCells(int(i), cells)
+        # shift points at caps for better integration
+        if cells.GetNumberOfIds() == 1:
+            if gid[k] == 0:
+                # inlet
+                points[k] += eps_norm * normals[k]
+            else:
+                # outlets
+                points[k] -= eps_norm * normals[k]
+    return points, normals
+
+def slice_locations(centerlines: Centerlines, only_caps = False, only_juncs = False, all = False, eps_norm = 1.0e-3):
+    """Points of the centerlines to slice, with plane origins and normals. Caps are always sliced, slightly moved inwards to ensure nice integration.
+
+    Args:
+        centerlines (Centerlines): centerlines
+        only_caps (bool, optional): only slice caps. Defaults to False.
+        only_juncs (bool, optional): only slice caps and junctions. Defaults to False.
+        all (bool, optional): only slice caps, junctions and 0D vessel ends. Defaults to False.
+        eps_norm (float, optional): distance caps are moved along the normal. Defaults to 1.0e-3.
+
+    Returns:
+        tuple: (point ids, origins, normals)
+    """
+    polydata = centerlines.polydata
+    num_points = polydata.GetNumberOfPoints()
+
+    # get valid array
+    valid = np.ones(num_points)
+    if only_caps:
+        valid = centerlines.get_pointdata_array('Caps_0D') + 1
+    elif only_juncs:
+        valid = centerlines.get_pointdata_array('Junctions_0D') + 1
+    elif all:
+        valid = centerlines.get_pointdata_array('Junctions_0D') + centerlines.get_pointdata_array('Vessels_0D') + centerlines.get_pointdata_array('Caps_0D') + 3
+
+    # caps are always sliced
+    cells = vtk.vtkIdList()
+    caps = np.zeros(num_points, dtype = bool)
+    for i in range(num_points):
+        polydata.GetPointCells(i, cells)
+        caps[i] = cells.GetNumberOfIds() == 1
+
+    ids = np.flatnonzero(caps | (valid != 0))
+    return (ids,) + slice_planes(centerlines, ids, eps_norm)
+
+
+# quantities an LPN can request slices for
+PLAN_QUANTITIES = ('caps', 'junctions', 'vessels')
+
+def plan_slices(lpn, centerlines: Centerlines, quantities = PLAN_QUANTITIES, stride = None):
+    """Minimal set of centerline points to slice for quantities of an LPN, from the gids of its vessels and junctions.
+
+    Args:
+        lpn (FastLPN | LPN): LPN of the centerlines, with gids. If missing, they are found using LPN.find_gids.
+        centerlines (Centerlines): centerlines the LPN was built from
+        quantities (list, optional): any of 'caps' (inlet and outlets), 'junctions' (inlets and outlets of junctions) and 'vessels' (ends of every vessel). Defaults to all.
+        stride (float, optional): also slice every stride of path length along each branch. Defaults to None.
+
+    Returns:
+        np.ndarray: sorted point ids to slice
+    """
+    unknown = set(quantities) - set(PLAN_QUANTITIES)
+    if unknown:
+        raise ValueError(f'Unknown quantities {sorted(unknown)}, expected any of {PLAN_QUANTITIES}.')
+
+    vessels = lpn.lpn_data[lpn.VESS]
+    if any('gid' not in vess for vess in vessels):
+        if not hasattr(lpn, 'find_gids'):
+            raise ValueError('LPN does not contain gids. Load it as an LPN to find them.')
+        lpn.find_gids(centerlines)
+
+    gids = []
+    if 'caps' in quantities:
+        for vess in vessels:
+            bcs = vess.get('boundary_conditions', {})
+            if 'inlet' in bcs:
+                gids.append(vess['gid'][0])
+            if 'outlet' in bcs:
+                gids.append(vess['gid'][-1])
+    if 'junctions' in quantities:
+        for junc in lpn.lpn_data[lpn.JUNC]:
+            # only junctions between branches have gids
+            if 'gid' in junc:
+                gid_in, gid_out = junc['gid']
+                gids += [gid_in] + list(gid_out)
+    if 'vessels' in quantities:
+        for vess in vessels:
+            gids += vess['gid']
+
+    # gids to point ids
+    node_ids = centerlines.get_pointdata_array(centerlines.PointDataFields.NODEID).astype(int)
+    point_ids = np.full(node_ids.max() + 1, -1)
+    point_ids[node_ids] = np.arange(len(node_ids))
+    ids = point_ids[np.array(gids, dtype = int)]
+
+    if stride is not None:
+        ids = np.concatenate([ids, stride_points(centerlines, stride)])
+    return np.unique(ids)
+
+def stride_points(centerlines: Centerlines, stride: float):
+    """Points closest to every stride of path length along each branch, from its start.
+
+    Args:
+        centerlines (Centerlines): centerlines
+        stride (float): path length between points
+
+    Returns:
+        np.ndarray: point ids
+    """
+    if stride <= 0:
+        raise ValueError('Stride must be positive.')
+    branch_ids = centerlines.get_pointdata_array(centerlines.PointDataFields.BRANCHID)
+    paths = centerlines.get_pointdata_array(centerlines.PointDataFields.PATH)
+    ids = []
+    for br in np.unique(branch_ids[branch_ids >= 0]):
+        br_ids = np.flatnonzero(branch_ids == br)
+        br_paths = paths[br_ids]
+        targets = np.arange(0, br_paths.max() + stride / 2, stride)
+        ids.append(br_ids[np.abs(br_paths[None, :] - targets[:, None]).argmin(axis = 1)])
+    return np.concatenate(ids) if ids else np.array([], dtype = int)
+
+
+def slice_radii(centerlines: Centerlines, ids):
+    """Approximate cross section radii at points of the centerlines, from the larger of the section area and the maximum inscribed sphere radius.
+
+    Args:
+        centerlines (Centerlines): centerlines
+        ids (np.ndarray): point ids
+
+    Returns:
+        np.ndarray: radii, or None if the centerlines have neither array
+    """
+    pointdata = centerlines.polydata.GetPointData()
+    radii = []
+    if pointdata.HasArray(centerlines.PointDataFields.AREA):
+        radii.append(np.sqrt(np.abs(centerlines.get_pointdata_array(centerlines.PointDataFields.AREA)[ids]) / np.pi))
+    if pointdata.HasArray('MaximumInscribedSphereRadius'):
+        radii.append(centerlines.get_pointdata_array('MaximumInscribedSphereRadius')[ids])
+    if not radii:
+        return None
+    return np.max(radii, axis = 0)
+
+
+def save_checkpoint(fpath, res_names, values, area, done, failed):
+    """
+    Saves the integrals of completed slices, replacing the checkpoint atomically so an interrupted save does not lose it
+    Args:
+        fpath: npz checkpoint file
+        res_names: integrated result arrays
+        values: [points, res_names] integrals
+        area: [points] areas
+        done: [points] whether each point was sliced (successfully or not)
+        failed: dict of point id to error message of failed slices
+    """
+    tmp = str(fpath) + '.tmp'
+    with open(tmp, 'wb') as tfile:
+        np.savez(tfile, res_names = np.array(res_names, dtype = str), values = values, area = area, done = done,
+                 failed_ids = np.array(list(failed.keys()), dtype = int), failed_errors = np.array(list(failed.values()), dtype = str))
+    os.replace(tmp, fpath)
+
+def load_checkpoint(fpath, num_points, res_names):
+    """
+    Loads a checkpoint of an extraction
+    Args:
+        fpath: npz checkpoint file
+        num_points: number of centerline points of the extraction
+        res_names: result arrays of the extraction
+    Returns:
+        values, area, done, failed (as in save_checkpoint)
+    """
+    with np.load(fpath) as ckpt:
+        if list(ckpt['res_names']) != list(res_names) or len(ckpt['done']) != num_points:
+            raise ValueError(f'Checkpoint {fpath} does not match the centerlines and 3D results being extracted. Delete it to restart.')
+        failed = dict(zip(ckpt['failed_ids'].tolist(), ckpt['failed_errors'].tolist()))
+        return ckpt['values'], ckpt['area'], ckpt['done'], failed
+
+
+def extract_results(fpath_1d, fpath_3d, fpath_out, only_caps = False, only_juncs = False, all = False, num_workers = 1, chunksize = 8, progress = None, local = True, checkpoint = None, checkpoint_interval = 600, restart = False, lpn = None, quantities = PLAN_QUANTITIES, stride = None):
+    """
+    Extract 3d results at 1d model nodes (integrate over cross-section)
+    Completed slices are saved to a checkpoint periodically and when interrupted, and an extraction resumes from its checkpoint, which is removed once the output is written.
+    Slices that fail are reported in <fpath_out>.failed.json and marked invalid.
+    Args:
+        fpath_1d: path to 1d model
+        fpath_3d: path to 3d simulation results
+        fpath_out: output path
+        only_caps: extract solution only at caps, not in interior (much faster)
+        only_juncs: extract solution only at caps and junctions
+        all: extract solution only at caps, junctions and 0D vessel ends
+        num_workers: number of worker processes, each loading the volume once
+        chunksize: slices per task sent to a worker
+        progress: wraps an iterable to report progress, i.e. tqdm
+        local: only cut cells of the volume near each slice, sized from the centerline section radii
+        checkpoint: npz checkpoint file, defaults to <fpath_out>.ckpt.npz
+        checkpoint_interval: seconds between checkpoints
+        restart: ignore an existing checkpoint
+        lpn: LPN of the centerlines. If given, only the points needed for its quantities are sliced (see plan_slices) rather than using the caps/juncs/all flags
+        quantities: quantities of the LPN to slice for
+        stride: with an LPN, also slice every stride of path length along each branch
+    Returns:
+        Centerlines: centerlines with integrated results, area and valid arrays
+    """
+    # read 1d model and the result array names of the 3d model
+    centerlines = Centerlines.load_centerlines(fpath_1d)
+    res_names = filter_res_names(read_array_names(fpath_3d), ['pressure', 'velocity'])
+    num_points = centerlines.polydata.GetNumberOfPoints()
+    if checkpoint is None:
+        checkpoint = str(fpath_out) + '.ckpt.npz'
+
+    # resume
+    if os.path.exists(checkpoint) and not restart:
+        values, area, done, failed = load_checkpoint(checkpoint, num_points, res_names)
+        print(f'Resuming from {checkpoint}: {int(done.sum())} points already sliced.')
+    else:
+        values = np.zeros((num_points, len(res_names)))
+        area = np.zeros(num_points)
+        done = np.zeros(num_points, dtype = bool)
+        failed = {}
+
+    if lpn is not None:
+        ids = plan_slices(lpn, centerlines, quantities, stride)
+        origins, normals = slice_planes(centerlines, ids)
+    else:
+        ids, origins, normals = slice_locations(centerlines, only_caps, only_juncs, all)
+    radii = slice_radii(centerlines, ids) if local else None
+    todo = ~done[ids]
+    ids, origins, normals = ids[todo], origins[todo], normals[todo]
+    if radii is not None:
+        radii = radii[todo]
+
+    # integrate, merging results of workers
+    last_save = time.time()
+    slices = integrate_slices(fpath_3d, ids, origins, normals, res_names, radii, num_workers, chunksize, progress)
+    try:
+        for i, vals, a, error in slices:
+            if error is None:
+                values[i] = vals
+                area[i] = a
+            else:
+                failed[int(i)] = error
+            done[i] = True
+            if time.time() - last_save > checkpoint_interval:
+                save_checkpoint(checkpoint, res_names, values, area, done, failed)
+                last_save = time.time()
+    except BaseException:
+        save_checkpoint(checkpoint, res_names, values, area, done, failed)
+        print(f'Extraction interrupted, saved {int(done.sum())} sliced points to {checkpoint}.')
+        # then stop the workers
+        slices.close()
+        raise
+
+    # output arrays
+    valid = done.astype(np.int32)
+    valid[list(failed.keys())] = 0
+    for j, name in enumerate(res_names):
+        centerlines.add_pointdata(values[:, j].copy(), name)
+    centerlines.add_pointdata(area, 'area')
+    centerlines.add_pointdata(valid, 'valid')
+
+    centerlines.write_polydata(fpath_out)
+
+    # report failed slices
+    report = str(fpath_out) + '.failed.json'
+    if failed:
+        gids = centerlines.get_pointdata_array(centerlines.PointDataFields.NODEID)
+        write_json(report, {'num_sliced': int(done.sum()),
+                            'num_failed': len(failed),
+                            'failed': [{'point_id': i, 'gid': int(gids[i]), 'error': error} for i, error in sorted(failed.items())]}, sort_keys = False)
+        print(f'{len(failed)} of {int(done.sum())} slices failed, see {report}.')
+    elif os.path.exists(report):
+        os.remove(report)
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return centerlines
@@ -0,0 +1,188 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from itertools import islice
+import numpy as np
+
+from .lpn import FastLPN
+from .solver import SolverSession
+
+# short value names used by change_vessel/change_junction_outlet
+SHORT_KEYS = {'R': 'R_poiseuille', 'C': 'C', 'L': 'L', 'S': 'stenosis_coefficient'}
+
+# per-process worker state, set once by _init_worker
+_worker = {}
+
+def _init_worker(lpn_data, extract, mean, solver_kwargs):
+    ''' constructs the base LPN and solver session once per worker process
+    '''
+    _worker['session'] = SolverSession(FastLPN(lpn_data), **solver_kwargs)
+    _worker['base'] = _worker['session'].get_parameters().values
+    _worker['extract'] = extract
+    _worker['mean'] = mean
+
+def _apply_changes(session: SolverSession, changes: list):
+    """Adds a list of changes to the session, returning the changes needed to restore the original values.
+
+    Args:
+        session (SolverSession): worker session
+        changes (list): list of ('vessel', vessel_id, values), ('junction', junction_id, which, values) or ('bc', bc_name, values),
+            where values is a dict of deltas (R, C, L, S for vessels and junctions, bc value names for bcs).
+
+    Returns:
+        list: changes to replace modified values with their originals.
+    """
+    lpn = session.lpn
+    restore = []
+    for change in changes:
+        if change[0] == 'vessel':
+            _, vessel_id, values = change
+            orig = lpn.get_vessel(vessel_id)['zero_d_element_values']
+            restore.append(('vessel', vessel_id, {key: orig[SHORT_KEYS[key]] for key in values}))
+            session.change_vessel(vessel_id, mode = 'add', **values)
+        elif change[0] == 'junction':
+            _, junction_id, which, values = change
+            orig = lpn.get_junction(junction_id)['junction_values']
+            restore.append(('junction', junction_id, which, {key: orig[SHORT_KEYS[key]][which] for key in values}))
+            session.change_junction_outlet(junction_id, which, mode = 'add', **values)
+        elif change[0] == 'bc':
+            _, bc_name, values = change
+            orig = session.bc_map[bc_name]['bc_values']
+            restore.append(('bc', bc_name, {key: orig[key] for key in values}))
+            session.change_bc(bc_name, mode = 'add', **values)
+        else:
+            raise ValueError(f"Unknown change type {change[0]}. Must be one of vessel, junction, bc.")
+    return restore
+
+def _restore_changes(session: SolverSession, restore: list):
+    ''' replaces values with the originals recorded by _apply_changes
+    '''
+    for change in reversed(restore):
+        if change[0] == 'vessel':
+            session.change_vessel(change[1], mode = 'replace', **change[2])
+        elif change[0] == 'junction':
+            session.change_junction_outlet(change[1], change[2], mode = 'replace', **change[3])
+        else:
+            session.change_bc(change[1], mode = 'replace', **change[2])
+
+def _run_chunk(chunk: list):
+    ''' runs a chunk of tasks in a worker
+    '''
+    session = _worker['session']
+    out = []
+    for changes in chunk:
+        restore = _apply_changes(session, changes)
+        try:
+            results = session.run_sim_mean() if _worker['mean'] else session.run_sim()
+            out.append(np.asarray(_worker['extract'](results)))
+        finally:
+            _restore_changes(session, restore)
+    return out
+
+def _run_vector_chunk(chunk: np.ndarray, positions: np.ndarray):
+    ''' runs a chunk of parameter vectors in a worker, restoring the base values afterwards
+    '''
+    session = _worker['session']
+    base = _worker['base']
+    out = []
+    try:
+        for row in chunk:
+            values = base.copy()
+            if positions is None:
+                values[:] = row
+            else:
+                values[positions] = row
+            session.set_parameters(values)
+            results = session.run_sim_mean() if _worker['mean'] else session.run_sim()
+            out.append(np.asarray(_worker['extract'](results)))
+    finally:
+        session.set_parameters(base)
+    return out
+
+
+class BatchRunner():
+    """ Parallel batch simulation of perturbations of one base LPN.
+    The base LPN is sent to each long-lived worker once, and each task only sends its parameter changes or parameter vector values.
+    """
+
+    def __init__(self, lpn, extract, mean = False, max_workers = None, chunksize = 8, max_pending = None, **solver_kwargs):
+        """
+        Args:
+            lpn (FastLPN | LPN): base LPN
+            extract (callable): picklable (module level) function mapping SolverResults (or MeanResults when mean) to a numpy array.
+            mean (bool, optional): whether to use run_sim_mean. Defaults to False.
+            max_workers (int, optional): number of worker processes. Defaults to the number of cpus.
+            chunksize (int, optional): tasks per submission. Defaults to 8.
+            max_pending (int, optional): max chunks in flight. Defaults to 2 per worker.
+            **solver_kwargs: passed to the SolverSession of each worker (use_steady, last_cycle_only, mean_only).
+        """
+        self.chunksize = chunksize
+        self.parameters = lpn.get_parameters()
+        self.max_workers = max_workers if max_workers is not None else os.cpu_count()
+        self.executor = ProcessPoolExecutor(max_workers = self.max_workers,
+                                            initializer = _init_worker,
+                                            initargs = (lpn.lpn_data, extract, mean, solver_kwargs))
+        self.max_pending = max_pending if max_pending is not None else 2 * self.max_workers
+
+    def imap(self, tasks):
+        """Runs tasks, yielding results in order.
+
+        Args:
+            tasks (iterable): each task is a list of changes, i.e. [('vessel', 3, {'R': 1.0}), ('junction', 2, 0, {'R': 1.0})]. Changes are added to the base LPN and undone after the task.
+
+        Yields:
+            np.ndarray: extracted results of each task
+        """
+        tasks = iter(tasks)
+        return self._imap(iter(lambda: list(islice(tasks, self.chunksize)), []), _run_chunk)
+
+    def imap_vectors(self, X: np.ndarray, params: list = None):
+        """Runs parameter vectors, yielding results in order. Vectors are written into the base parameter vector of each worker (see ParameterVector), so no LPN is copied.
+
+        Args:
+            X (np.ndarray): (number of tasks, number of values) parameter values of each task.
+            params (list, optional): parameters of the columns of X, as in ParameterVector.indices. Defaults to every parameter of the vector.
+
+        Yields:
+            np.ndarray: extracted results of each task
+        """
+        X = np.atleast_2d(np.asarray(X, dtype = float))
+        positions = None if params is None else self.parameters.indices(params)
+        chunks = (X[i:i + self.chunksize] for i in range(0, len(X), self.chunksize))
+        return self._imap(chunks, _run_vector_chunk, positions)
+
+    def _imap(self, chunks, fn, *args):
+        ''' submits chunks while bounding the number in flight, yielding results in order
+        '''
+        pending = deque()
+
+        def submit():
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append(self.executor.submit(fn, chunk, *args))
+            return chunk is not None
+
+        for _ in range(self.max_pending):
+            if not submit():
+                break
+
+        while pending:
+            out = pending.popleft().result()
+            submit()
+            for res in out:
+                yield res
+
+    def run(self, tasks):
+        ''' Runs tasks and returns results stacked in order as a numpy array
+        '''
+        return np.stack(list(self.imap(tasks)))
+
+    def close(self):
+        ''' shuts down the workers '''
+        self.executor.shutdown(wait = True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
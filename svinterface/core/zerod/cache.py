@@ -0,0 +1,212 @@
+import os
+import json
+import shutil
+import hashlib
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+
+from .solver import SolverResults, MeanResults
+
+
+def _json_default(obj):
+    ''' serializes numpy values in lpn dicts '''
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class ResultCache():
+    """ Cache of 0D results keyed by a hash of the LPN and solver options.
+    Results are kept in an in-memory LRU and, when a directory is given, on disk so other processes (and later runs) can reuse them.
+    Disk entries are written to a temporary name and renamed into place, so readers never see partial entries and concurrent writers of the same key are safe.
+    Hits always return a new results object, so callers may modify (i.e. convert_to_mmHg) what they receive.
+    """
+
+    def __init__(self, directory: Path = None, max_memory: int = 256 * 2**20, max_disk: int = 2**30):
+        """
+        Args:
+            directory (Path, optional): directory of the disk cache. Defaults to None (memory only).
+            max_memory (int, optional): max bytes of results kept in memory. Defaults to 256 MB.
+            max_disk (int, optional): max bytes of results kept on disk, evicting least recently used entries. Defaults to 1 GB.
+        """
+        self.directory = None if directory is None else Path(directory)
+        if self.directory is not None:
+            self.directory.mkdir(parents = True, exist_ok = True)
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(lpn_data: dict, kind: str, **options):
+        """Hash of an LPN and the options of a run. Output options of the solver are part of the simulation parameters of the LPN.
+
+        Args:
+            lpn_data (dict): lpn dict to be simulated
+            kind (str): kind of results, i.e. results or mean
+            **options: any other options affecting the results
+
+        Returns:
+            str: sha256 hex digest
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps({'kind': kind, 'options': options}, sort_keys = True, default = _json_default).encode())
+        h.update(json.dumps(lpn_data, sort_keys = True, separators = (',', ':'), default = _json_default).encode())
+        return h.hexdigest()
+
+    def get(self, key: str):
+        """Retrieves results.
+
+        Args:
+            key (str): key of the results
+
+        Returns:
+            SolverResults | MeanResults: a new results object, or None if the key is not cached
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._from_payload(self._memory[key])
+        results = self._read(key)
+        if results is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._remember(key, self._to_payload(results))
+        return results
+
+    def put(self, key: str, results):
+        """Stores results, copying them so later changes to results are not cached.
+
+        Args:
+            key (str): key of the results
+            results (SolverResults | MeanResults): results to store
+        """
+        self._remember(key, self._to_payload(results))
+        if self.directory is not None:
+            self._write(key, results)
+            self._evict_disk()
+
+    def clear(self):
+        ''' clears the memory and disk caches '''
+        self._memory.clear()
+        self._memory_size = 0
+        if self.directory is not None:
+            for entry in self._entries():
+                self._remove(entry)
+
+    # memory
+
+    @staticmethod
+    def _to_payload(results):
+        ''' copies results into (kind, data, size in bytes) '''
+        if isinstance(results, MeanResults):
+            arrays = {f: np.array(v) for f, v in results.arrays.items()}
+            return 'mean', (arrays, list(results.vessel_names)), sum(a.nbytes for a in arrays.values())
+        df = results.result_df.copy()
+        return 'results', df, int(df.memory_usage(index = False, deep = False).sum())
+
+    @staticmethod
+    def _from_payload(payload):
+        kind, data, _ = payload
+        if kind == 'mean':
+            arrays, names = data
+            return MeanResults({f: a.copy() for f, a in arrays.items()}, list(names))
+        return SolverResults(data.copy())
+
+    def _remember(self, key, payload):
+        ''' adds a payload to the memory LRU, evicting least recently used entries '''
+        if key in self._memory:
+            self._memory_size -= self._memory.pop(key)[2]
+        if payload[2] > self.max_memory:
+            return
+        self._memory[key] = payload
+        self._memory_size += payload[2]
+        while self._memory_size > self.max_memory:
+            _, old = self._memory.popitem(last = False)
+            self._memory_size -= old[2]
+
+    # disk
+
+    def _path(self, key):
+        return self.directory / key[:2] / key
+
+    def _read(self, key):
+        ''' loads an entry from disk, returning None on a miss or an entry evicted while reading '''
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            if (path / 'mean.npz').is_file():
+                with np.load(path / 'mean.npz') as data:
+                    arrays = {f: data[f] for f in MeanResults.FIELDS}
+                    names = data['vessel_names'].tolist()
+                results = MeanResults(arrays, names)
+            elif (path / 'index.json').is_file():
+                results = SolverResults.from_binary(path)
+            else:
+                return None
+            # mark as recently used
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return results
+
+    def _write(self, key, results):
+        ''' writes an entry to a temporary directory and atomically renames it into place '''
+        path = self._path(key)
+        if path.is_dir():
+            return
+        path.parent.mkdir(parents = True, exist_ok = True)
+        tmp = path.parent / f".{key}.{uuid.uuid4().hex}.tmp"
+        try:
+            if isinstance(results, MeanResults):
+                tmp.mkdir()
+                np.savez(tmp / 'mean.npz', vessel_names = np.array(results.vessel_names), **results.arrays)
+            else:
+                results.save(tmp)
+            os.rename(tmp, path)
+        except OSError:
+            # another process wrote the same entry first
+            shutil.rmtree(tmp, ignore_errors = True)
+
+    def _entries(self):
+        ''' completed disk entries '''
+        return [entry for sub in self.directory.iterdir() if sub.is_dir() for entry in sub.iterdir() if entry.is_dir() and not entry.name.startswith('.')]
+
+    @staticmethod
+    def _size(entry: Path):
+        return sum(f.stat().st_size for f in entry.iterdir())
+
+    @staticmethod
+    def _remove(entry: Path):
+        # rename first so readers never see a partially deleted entry
+        trash = entry.parent / f".{entry.name}.{uuid.uuid4().hex}.del"
+        try:
+            os.rename(entry, trash)
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors = True)
+
+    def _evict_disk(self):
+        ''' removes least recently used disk entries above max_disk '''
+        if self.max_disk is None:
+            return
+        entries = []
+        for entry in self._entries():
+            try:
+                entries.append((entry.stat().st_mtime, self._size(entry), entry))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key = lambda e: e[0]):
+            if total <= self.max_disk:
+                break
+            self._remove(entry)
+            total -= size
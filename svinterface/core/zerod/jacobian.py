@@ -0,0 +1,119 @@
+from functools import partial
+import numpy as np
+
+from .batch import BatchRunner
+from .solver import MeanResults
+
+# index of each statistic in SolverResults.summarize
+STATS = {'min': 0, 'mean': 1, 'max': 2}
+
+def extract_outputs(results, outputs: list):
+    """Extracts outputs from results, run in batch workers.
+
+    Args:
+        results (MeanResults | SolverResults): simulation results
+        outputs (list): list of (field, vessel ids) or (field, vessel ids, stat) where stat is one of min, mean, max (defaults to mean).
+
+    Returns:
+        np.ndarray: concatenated outputs in the order requested
+    """
+    if isinstance(results, MeanResults):
+        return results.get_poi([out[:2] for out in outputs])
+    vals = []
+    for out in outputs:
+        field, vids = out[:2]
+        stat = out[2] if len(out) > 2 else 'mean'
+        name, which = field.split('_')
+        vals.append(results.summarize(fields = (name,), which = which, vessels = [results.vessel_names[v] for v in vids])[:, 0, STATS[stat]])
+    return np.concatenate(vals)
+
+
+class Jacobian():
+    """ Finite difference Jacobian of 0D outputs with respect to LPN parameters, evaluated in parallel by a BatchRunner.
+    Workers hold the base LPN, so any parameter vector is evaluated by sending only its values, which are written into the base ParameterVector of the worker. Solutions are cached by parameter vector, so the base solution is only computed once.
+    """
+
+    def __init__(self, lpn, params: list, outputs: list, steps = None, rel_step = 1e-3, max_workers = None, chunksize = 1, **solver_kwargs):
+        """
+        Args:
+            lpn (FastLPN | LPN): base LPN
+            params (list): list of ('vessel', vessel_id, key) with key one of R, C, L, S; ('junction', junction_id, which, key); or ('bc', bc_name, key) with key a bc value name (i.e. Rp, C, Rd, Pd for RCR).
+            outputs (list): list of (field, vessel ids) or (field, vessel ids, stat) where stat is one of min, mean, max. When every stat is mean, only mean values are simulated.
+            steps (np.ndarray, optional): absolute step of each parameter. Defaults to rel_step * max(|x|, 1).
+            rel_step (float, optional): relative step used when steps are not provided. Defaults to 1e-3.
+            max_workers (int, optional): number of worker processes. Defaults to the number of cpus.
+            chunksize (int, optional): tasks per submission. Defaults to 1.
+            **solver_kwargs: passed to the SolverSession of each worker.
+        """
+        self.params = [tuple(p) for p in params]
+        self.outputs = outputs
+        self.steps = None if steps is None else np.asarray(steps, dtype = float)
+        self.rel_step = rel_step
+
+        self.mean = all(len(out) < 3 or out[2] == 'mean' for out in outputs)
+        if self.mean:
+            solver_kwargs['mean_only'] = True
+        self.runner = BatchRunner(lpn, partial(extract_outputs, outputs = outputs), mean = self.mean, max_workers = max_workers, chunksize = chunksize, **solver_kwargs)
+        self.x0 = self.runner.parameters.values[self.runner.parameters.indices(self.params)]
+        self._cache = {}
+
+    def _steps(self, x):
+        if self.steps is not None:
+            return self.steps
+        return self.rel_step * np.maximum(np.abs(x), 1)
+
+    def evaluate(self, X: np.ndarray):
+        """Evaluates outputs at many parameter vectors in parallel, reusing cached solutions.
+
+        Args:
+            X (np.ndarray): (number of points, number of params) parameter vectors
+
+        Returns:
+            np.ndarray: (number of points, number of outputs) outputs
+        """
+        X = np.atleast_2d(np.asarray(X, dtype = float))
+        keys = [x.tobytes() for x in X]
+        missing = list({key: x for key, x in zip(keys, X) if key not in self._cache}.items())
+        if missing:
+            for (key, _), out in zip(missing, self.runner.imap_vectors(np.stack([x for _, x in missing]), self.params)):
+                self._cache[key] = out
+        return np.stack([self._cache[key] for key in keys])
+
+    def __call__(self, x: np.ndarray = None):
+        ''' outputs at a single parameter vector (defaults to the base values)
+        '''
+        return self.evaluate(self.x0 if x is None else x)[0]
+
+    def jacobian(self, x: np.ndarray = None, central = False):
+        """Computes the Jacobian, with every perturbation solved in parallel.
+
+        Args:
+            x (np.ndarray, optional): parameter vector. Defaults to the base values.
+            central (bool, optional): use central rather than forward differences. Defaults to False.
+
+        Returns:
+            tuple: (outputs at x, (number of outputs, number of params) Jacobian)
+        """
+        x = self.x0 if x is None else np.asarray(x, dtype = float)
+        h = self._steps(x)
+        dX = np.diag(h)
+        if central:
+            f = self.evaluate(np.vstack([x, x + dX, x - dX]))
+            n = len(x)
+            return f[0], ((f[1:n + 1] - f[n + 1:]) / (2 * h[:, None])).T
+        f = self.evaluate(np.vstack([x, x + dX]))
+        return f[0], ((f[1:] - f[0]) / h[:, None]).T
+
+    def clear_cache(self):
+        ''' clears cached solutions '''
+        self._cache = {}
+
+    def close(self):
+        ''' shuts down the workers '''
+        self.runner.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -10,6 +10,7 @@ from scipy.interpolate import interp1d
 from svinterface.utils.io import write_json
 from svinterface.core.bc import Inflow, RCR
 from svinterface.core.polydata import Centerlines
+from .parameters import ParameterVector
 from abc import ABC, abstractclassmethod
 
 
@@ -42,6 +43,14 @@ class FastLPN():
             FastLPN: a copy of this LPN
         """
         return FastLPN(deepcopy(self.lpn_data))
+    
+    def get_parameters(self):
+        """Parameter vector view of the LPN. Perturb copies of the vector instead of copying the LPN.
+
+        Returns:
+            ParameterVector: vessel, junction outlet and bc values of this LPN
+        """
+        return ParameterVector(self.lpn_data)
 
     def get_junction(self, id):
         """Gets junction according to ordering
@@ -199,6 +208,14 @@ class OriginalLPN():
         """
         return FastLPN(deepcopy(self.lpn_data))
     
+    def get_parameters(self):
+        """Parameter vector view of the LPN. Perturb copies of the vector instead of copying the LPN.
+
+        Returns:
+            ParameterVector: vessel, junction outlet and bc values of this LPN
+        """
+        return ParameterVector(self.lpn_data)
+    
     def get_full_lpn(self):
         """Initializes a full LPN
         """
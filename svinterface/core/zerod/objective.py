@@ -0,0 +1,120 @@
+from functools import partial
+import numpy as np
+
+from .batch import BatchRunner
+from .parameters import ParameterizationOperator
+
+
+def extract_traces(results, traces: list):
+    """Extracts waveforms as arrays, run in batch workers.
+
+    Args:
+        results (SolverResults): simulation results
+        traces (list): list of (vessel name, field) with field one of flow_in, flow_out, pressure_in, pressure_out
+
+    Returns:
+        np.ndarray: [1 + number of traces, time] array of the time points followed by each trace
+    """
+    vessels = list(dict.fromkeys(name for name, _ in traces))
+    fields = list(dict.fromkeys(field for _, field in traces))
+    arr = results.to_array(['time'] + fields, vessels)
+    rows = [arr[0, 0]] + [arr[vessels.index(name), 1 + fields.index(field)] for name, field in traces]
+    return np.stack(rows)
+
+
+class TuningObjective():
+    """ Vectorized objective of a tuning problem, evaluating a whole population of candidate vectors in one call.
+    Candidates are mapped linearly to LPN parameter values and solved in parallel by a BatchRunner, whose workers only send back the requested traces as arrays. Residuals are then computed from the traces of the whole population at once.
+    Solutions are cached by candidate, so optimizers revisiting points do not solve again.
+    """
+
+    def __init__(self, lpn, columns: list, traces: list, residuals, max_workers = None, chunksize = 1, **solver_kwargs):
+        """
+        Args:
+            lpn (FastLPN | LPN): base LPN
+            columns (list): for each entry of a candidate x, a list of (param, coefficient) pairs (params as in ParameterVector.indices). Each param is set to the sum of coefficient * x over entries.
+            traces (list): list of (vessel name, field) traces extracted from each solution
+            residuals (callable): function of (time [time], traces [candidates, traces, time]) returning [candidates, residuals]
+            max_workers (int, optional): number of worker processes. Defaults to the number of cpus.
+            chunksize (int, optional): candidates per submission. Defaults to 1.
+            **solver_kwargs: passed to the SolverSession of each worker.
+        """
+        self.operator = ParameterizationOperator(lpn.get_parameters(), columns)
+        self.traces = traces
+        self.residual_fn = residuals
+        self.runner = BatchRunner(lpn, partial(extract_traces, traces = traces), max_workers = max_workers, chunksize = chunksize, **solver_kwargs)
+        self.num_evals = 0
+        self._cache = {}
+
+    def parameter_values(self, X: np.ndarray):
+        ''' (candidates, params) LPN values of candidates, in the order of operator.params '''
+        return self.operator.deltas(X)
+
+    def solve(self, X: np.ndarray):
+        """Solves candidates in parallel, reusing cached solutions.
+
+        Args:
+            X (np.ndarray): (candidates, number of coefficients) candidates
+
+        Returns:
+            tuple: (time [time], traces [candidates, traces, time])
+        """
+        X = np.atleast_2d(np.asarray(X, dtype = float))
+        keys = [x.tobytes() for x in X]
+        missing = list({key: x for key, x in zip(keys, X) if key not in self._cache}.items())
+        if missing:
+            values = self.parameter_values(np.stack([x for _, x in missing]))
+            for (key, _), out in zip(missing, self.runner.imap_vectors(values, self.operator.params)):
+                self._cache[key] = out
+            self.num_evals += len(missing)
+        out = np.stack([self._cache[key] for key in keys])
+        return out[0, 0], out[:, 1:]
+
+    def residuals(self, X: np.ndarray):
+        ''' (candidates, residuals) residuals of candidates '''
+        return np.asarray(self.residual_fn(*self.solve(X)))
+
+    def loss(self, X: np.ndarray):
+        ''' (candidates,) sum of squared residuals of candidates '''
+        return (self.residuals(X) ** 2).sum(axis = -1)
+
+    def __call__(self, x: np.ndarray):
+        ''' loss of a single candidate, or of every row of a (candidates, coefficients) population '''
+        x = np.asarray(x, dtype = float)
+        loss = self.loss(x)
+        return loss[0] if x.ndim == 1 else loss
+
+    def jacobian(self, x: np.ndarray, rel_step: float = 1e-3, central = False):
+        """Finite difference Jacobian of the residuals, with every perturbation solved in parallel.
+
+        Args:
+            x (np.ndarray): candidate
+            rel_step (float, optional): step relative to |x| (or absolute where x is 0). Defaults to 1e-3.
+            central (bool, optional): use central rather than forward differences. Defaults to False.
+
+        Returns:
+            tuple: (residuals at x, (number of residuals, number of coefficients) Jacobian)
+        """
+        x = np.asarray(x, dtype = float)
+        h = rel_step * np.where(x != 0, np.abs(x), 1.0)
+        dX = np.diag(h)
+        if central:
+            r = self.residuals(np.vstack([x, x + dX, x - dX]))
+            n = len(x)
+            return r[0], ((r[1:n + 1] - r[n + 1:]) / (2 * h[:, None])).T
+        r = self.residuals(np.vstack([x, x + dX]))
+        return r[0], ((r[1:] - r[0]) / h[:, None]).T
+
+    def clear_cache(self):
+        ''' clears cached solutions '''
+        self._cache = {}
+
+    def close(self):
+        ''' shuts down the workers '''
+        self.runner.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,198 @@
+import numpy as np
+from scipy import sparse
+from copy import copy
+
+
+class ParameterVector():
+    """ Parameter vector view of an LPN.
+    Vessel (R, C, L, S), BloodVesselJunction outlet (R, C, L, S) and boundary condition values are gathered into one contiguous array, with an index map from parameters to positions.
+    Perturbations are array writes on a copy of the vector, and are only written back into the lpn dict (materialized) when solving.
+    """
+    # value order of vessels and junction outlets
+    KEYS = ('R', 'C', 'L', 'S')
+    VALUE_NAMES = ('R_poiseuille', 'C', 'L', 'stenosis_coefficient')
+    # boundary condition values, by bc type
+    BC_KEYS = {'RCR': ('Rp', 'C', 'Rd', 'Pd'),
+               'RESISTANCE': ('R', 'Pd')}
+
+    def __init__(self, lpn_data: dict, values: np.ndarray = None):
+        """
+        Args:
+            lpn_data (dict): lpn dict the vector is gathered from and materialized into.
+            values (np.ndarray, optional): parameter values. Defaults to the current values of lpn_data.
+        """
+        self.lpn_data = lpn_data
+        self._build_index()
+        self.values = self.gather() if values is None else np.array(values, dtype = float)
+
+    def _build_index(self):
+        ''' builds the parameter -> position map
+        '''
+        nk = len(self.KEYS)
+        self.index = {}
+        pos = 0
+        for vess in self.lpn_data['vessels']:
+            for k in self.KEYS:
+                self.index[('vessel', vess['vessel_id'], k)] = pos
+                pos += 1
+        self.num_vessels = len(self.lpn_data['vessels'])
+
+        # junction outlets, (junction id, which) of every row
+        self.outlets = []
+        for jidx, junc in enumerate(self.lpn_data['junctions']):
+            if junc['junction_type'] != 'BloodVesselJunction':
+                continue
+            for which in range(len(junc['outlet_vessels'])):
+                for k in self.KEYS:
+                    self.index[('junction', jidx, which, k)] = pos
+                    pos += 1
+                self.outlets.append((jidx, which))
+        self.bc_start = pos
+
+        self.bcs = []
+        for bc in self.lpn_data['boundary_conditions']:
+            if bc['bc_type'] not in self.BC_KEYS:
+                continue
+            for k in self.BC_KEYS[bc['bc_type']]:
+                self.index[('bc', bc['bc_name'], k)] = pos
+                pos += 1
+            self.bcs.append(bc)
+        self.size = pos
+        self._junction_end = self.num_vessels * nk + len(self.outlets) * nk
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def vessels(self):
+        ''' [n_vessels, 4] view of vessel (R, C, L, S) values '''
+        return self.values[:self.num_vessels * len(self.KEYS)].reshape(-1, len(self.KEYS))
+
+    @property
+    def junctions(self):
+        ''' [n_outlets, 4] view of junction outlet (R, C, L, S) values, in the order of outlets '''
+        return self.values[self.num_vessels * len(self.KEYS):self._junction_end].reshape(-1, len(self.KEYS))
+
+    def indices(self, params: list):
+        """Positions of parameters in the vector.
+
+        Args:
+            params (list): list of ('vessel', vessel_id, key), ('junction', junction_id, which, key), or ('bc', bc_name, key)
+
+        Returns:
+            np.ndarray: positions
+        """
+        return np.array([self.index[tuple(p)] for p in params], dtype = int)
+
+    def copy(self):
+        ''' copy of the values, sharing the lpn dict and index map
+        '''
+        new = copy(self)
+        new.values = self.values.copy()
+        return new
+
+    def __getitem__(self, param):
+        return self.values[self.index[tuple(param)]]
+
+    def __setitem__(self, param, value):
+        self.values[self.index[tuple(param)]] = value
+
+    def add(self, params: list, deltas):
+        ''' adds deltas to params '''
+        self.values[self.indices(params)] += deltas
+
+    def gather(self):
+        ''' reads current values from the lpn dict
+        '''
+        values = np.empty(self.size)
+        nk = len(self.KEYS)
+        for i, vess in enumerate(self.lpn_data['vessels']):
+            vals = vess['zero_d_element_values']
+            values[i * nk:(i + 1) * nk] = [vals.get(name, 0) for name in self.VALUE_NAMES]
+        pos = self.num_vessels * nk
+        for jidx, which in self.outlets:
+            vals = self.lpn_data['junctions'][jidx]['junction_values']
+            values[pos:pos + nk] = [vals[name][which] for name in self.VALUE_NAMES]
+            pos += nk
+        for bc in self.bcs:
+            keys = self.BC_KEYS[bc['bc_type']]
+            values[pos:pos + len(keys)] = [bc['bc_values'][k] for k in keys]
+            pos += len(keys)
+        return values
+
+    def materialize(self, changed = None):
+        """Writes values into the lpn dict for solving.
+
+        Args:
+            changed (np.ndarray, optional): positions to write. Defaults to all.
+
+        Returns:
+            tuple: (vessel ids, (junction id, which) outlets, bc names) whose values were written, to sync with a SolverSession.
+        """
+        nk = len(self.KEYS)
+        positions = np.arange(self.size) if changed is None else np.unique(changed)
+        vessels = set()
+        outlets = set()
+        bcs = set()
+        bc_pos = self._bc_positions()
+        for pos in positions:
+            val = float(self.values[pos])
+            if pos < self.num_vessels * nk:
+                vess = self.lpn_data['vessels'][pos // nk]
+                vess['zero_d_element_values'][self.VALUE_NAMES[pos % nk]] = val
+                vessels.add(vess['vessel_id'])
+            elif pos < self._junction_end:
+                jidx, which = self.outlets[(pos - self.num_vessels * nk) // nk]
+                self.lpn_data['junctions'][jidx]['junction_values'][self.VALUE_NAMES[pos % nk]][which] = val
+                outlets.add((jidx, which))
+            else:
+                bc, key = bc_pos[pos - self.bc_start]
+                bc['bc_values'][key] = val
+                bcs.add(bc['bc_name'])
+        return sorted(vessels), sorted(outlets), sorted(bcs)
+
+    def _bc_positions(self):
+        ''' (bc, key) of every bc position '''
+        return [(bc, k) for bc in self.bcs for k in self.BC_KEYS[bc['bc_type']]]
+
+
+class ParameterizationOperator():
+    """ Sparse linear map from coefficient vectors to parameter values of an LPN.
+    Each coefficient scales a fixed set of parameter deltas, so a batch of coefficient vectors C becomes parameter values x0 + C @ A.T with a single sparse product.
+    Only parameters touched by some coefficient are kept, in the order of params, to be sent to BatchRunner.imap_vectors.
+    """
+
+    def __init__(self, parameters: ParameterVector, columns: list):
+        """
+        Args:
+            parameters (ParameterVector): base parameter values
+            columns (list): for each coefficient, a list of (param, delta) pairs giving the change of param at a coefficient of 1. Deltas of repeated params are summed.
+        """
+        keys, cols, vals = [], [], []
+        for col, changes in enumerate(columns):
+            for param, delta in changes:
+                keys.append(tuple(param))
+                cols.append(col)
+                vals.append(delta)
+        positions = parameters.indices(keys) if keys else np.zeros(0, dtype = int)
+        self.positions, first, rows = np.unique(positions, return_index = True, return_inverse = True)
+        self.params = [keys[i] for i in first]
+        self.x0 = parameters.values[self.positions]
+        self.num_coefs = len(columns)
+        self.matrix = sparse.csr_matrix((np.asarray(vals, dtype = float), (rows, np.asarray(cols, dtype = int))), shape = (len(self.positions), self.num_coefs))
+
+    def deltas(self, coefs: np.ndarray):
+        """Parameter deltas of a batch of coefficient vectors.
+
+        Args:
+            coefs (np.ndarray): (number of samples, number of coefficients) coefficients
+
+        Returns:
+            np.ndarray: (number of samples, number of params) deltas
+        """
+        coefs = np.atleast_2d(np.asarray(coefs, dtype = float))
+        return np.asarray((self.matrix @ coefs.T).T)
+
+    def __call__(self, coefs: np.ndarray):
+        ''' (number of samples, number of params) parameter values of a batch of coefficient vectors '''
+        return self.x0 + self.deltas(coefs)
@@ -0,0 +1,120 @@
+import numpy as np
+from scipy import sparse
+
+from .lpn import LPN
+from svinterface.core.polydata import Centerlines
+
+
+def _interp_weights(xp: np.ndarray, x: np.ndarray):
+    ''' linear interpolation weights of x within xp, as (left index, right index, right weight)
+    '''
+    left = np.clip(np.searchsorted(xp, x, side = 'right') - 1, 0, len(xp) - 2)
+    right = left + 1
+    t = (x - xp[left]) / (xp[right] - xp[left])
+    return left, right, t
+
+
+class CenterlineProjection():
+    """ Sparse operator mapping 0D branch node values onto centerline points.
+    Branch nodes are the inlet of the first vessel followed by the outlet of every vessel of a branch, as in SolverResults.convert_to_python.
+    Values are linearly interpolated along each branch path, and junction points blend the upstream branch outlet with each downstream branch inlet, averaged over the junction outlets.
+    Built once per LPN and centerline pair, projecting any result is a single sparse matrix product.
+    Modified from: https://github.com/SimVascular/SimVascular/blob/master/Python/site-packages/sv_rom_extract_results/post.py
+    """
+
+    def __init__(self, lpn: LPN, centerlines: Centerlines):
+        branch_id = centerlines.get_pointdata_array('BranchId')
+        path = centerlines.get_pointdata_array('Path')
+        bifurcation_id = centerlines.get_pointdata_array('BifurcationId')
+        centerline_id = centerlines.get_pointdata_array('CenterlineId')
+        points = centerlines.get_points()
+        self.num_points = len(path)
+
+        # branch nodes, (vessel name, in/out) and their distance along the branch
+        self.node_vessels = []
+        self.node_sides = []
+        branch_nodes = {}
+        distances = {}
+        for node in lpn.tree_bfs_iterator(lpn.get_tree(), allow = 'branch'):
+            start = len(self.node_vessels)
+            self.node_vessels.append(node.vessel_info[0]['vessel_name'])
+            self.node_sides.append('in')
+            dist = [0.0]
+            for vessel in node.vessel_info:
+                self.node_vessels.append(vessel['vessel_name'])
+                self.node_sides.append('out')
+                dist.append(dist[-1] + vessel['vessel_length'])
+            branch_nodes[node.id] = np.arange(start, len(self.node_vessels))
+            distances[node.id] = np.array(dist)
+        self.num_nodes = len(self.node_vessels)
+
+        # check if ROM branch has same ids as centerline
+        ids_cent = np.unique(branch_id).tolist()
+        ids_cent.remove(-1)
+        assert ids_cent == sorted(branch_nodes.keys()), 'Centerline and ROM results have different branch ids'
+
+        rows, cols, vals = [], [], []
+        n_outlet = np.zeros(self.num_points)
+        for br, nodes in branch_nodes.items():
+            # get centerline path
+            br_points = np.where(branch_id == br)[0]
+            path_cent = path[br_points]
+
+            # get node locations from 0D results
+            path_0d = distances[br]
+            assert np.isclose(path_0d[0], 0.0), 'ROM branch path does not start at 0'
+            assert np.isclose(path_cent[0], 0.0), 'Centerline branch path does not start at 0'
+            assert np.isclose(path_0d[-1], path_cent[-1]), 'ROM results and centerline have different branch path lengths'
+
+            # interpolate ROM onto centerline, normalized to [0, 1] due to slightly incompatible lengths
+            left, right, t = _interp_weights(path_0d / path_0d[-1], path_cent / path_cent[-1])
+            rows += [br_points, br_points]
+            cols += [nodes[left], nodes[right]]
+            vals += [1 - t, t]
+
+            # add upstream part of branch within junction
+            if br == 0:
+                continue
+
+            # first point of branch
+            ip = br_points[0]
+            # centerline that passes through branch (first occurence)
+            cid = np.where(centerline_id[ip])[0][0]
+            # id of upstream junction
+            jc = bifurcation_id[ip - 1]
+            # centerline within junction
+            jc_cent = np.where(np.logical_and(bifurcation_id == jc, centerline_id[:, cid]))[0]
+
+            # length of centerline within junction
+            jc_path = np.append(0, np.cumsum(np.linalg.norm(np.diff(points[jc_cent], axis=0), axis=1)))
+            jc_path /= jc_path[-1]
+
+            # blend upstream branch outlet and this branch inlet
+            upstream = branch_nodes[branch_id[jc_cent[0] - 1]]
+            rows += [jc_cent, jc_cent]
+            cols += [np.full(len(jc_cent), upstream[-1]), np.full(len(jc_cent), nodes[0])]
+            vals += [1 - jc_path, jc_path]
+
+            # count number of outlets of this junction
+            n_outlet[jc_cent] += 1
+
+        matrix = sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape = (self.num_points, self.num_nodes))
+
+        # normalize results within junctions by number of junction outlets
+        scale = np.ones(self.num_points)
+        scale[n_outlet > 0] = 1 / n_outlet[n_outlet > 0]
+        self.matrix = sparse.diags(scale) @ matrix
+
+    def project(self, node_values: np.ndarray):
+        """Projects node values onto the centerline.
+
+        Args:
+            node_values (np.ndarray): [nodes, ...] values at the branch nodes, i.e. [nodes, time]
+
+        Returns:
+            np.ndarray: [points, ...] values at centerline points
+        """
+        return self.matrix @ node_values
+
+    def __call__(self, node_values: np.ndarray):
+        return self.project(node_values)
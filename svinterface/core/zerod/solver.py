@@ -2,22 +2,25 @@
 import numpy as np
 import pandas as pd  
 from .lpn import LPN
-from collections import defaultdict
 import pysvzerod
 import matplotlib.pyplot as plt
 from pathlib import Path
 from svinterface.utils.misc import d2m
+from svinterface.utils.io import read_json, write_json
+from svinterface.utils.profiling import Profiler, timer, count
 from svinterface.core.polydata import Centerlines
-from scipy.interpolate import interp1d
+from .projection import CenterlineProjection
 from vtk.util.numpy_support import numpy_to_vtk as n2v
 
 class Solver0Dcpp():
     ''' Interface to 0D C++ Solver
     '''
     
-    def __init__(self, lpn: LPN, use_steady = True, last_cycle_only = True, mean_only = False, debug = False):
+    def __init__(self, lpn: LPN, use_steady = True, last_cycle_only = True, mean_only = False, debug = False, cache = None):
     
         self.lpn = lpn
+        # optional ResultCache, skipping simulations of an lpn solved before
+        self.cache = cache
         self.use_steady = use_steady
         self.last_cycle_only = last_cycle_only
         self.mean_only = mean_only
@@ -27,6 +30,8 @@ class Solver0Dcpp():
 
         self.lpn.lpn_data['simulation_parameters']['output_mean_only'] = mean_only
         self.debug = debug
+        # optional Profiler timing solves and post-processing
+        self.profiler = None
         
     def _last_cycle(self, last_cycle_only):
         # old version
@@ -39,74 +44,487 @@ class Solver0Dcpp():
         if self.debug:
             print(s, end = end, flush = flush)
     
+    def _cached(self, kind, simulate):
+        ''' runs simulate unless results of the current lpn are cached '''
+        if self.cache is None:
+            return simulate()
+        with timer(self.profiler, 'cache'):
+            key = self.cache.key(self.lpn.lpn_data, kind)
+            results = self.cache.get(key)
+        if results is not None:
+            self._print("Loaded cached results.")
+            count(self.profiler, 'cache_hits')
+            return results
+        results = simulate()
+        with timer(self.profiler, 'cache'):
+            self.cache.put(key, results)
+        return results
+    
     def run_sim(self):
         ''' run a simulation '''
-        
+        return self._cached('results', self._simulate)
+    
+    def _simulate(self):
         self._print("Running solver...", end = '\t', flush = True)
     
-        results_df = pysvzerod.simulate(self.lpn.lpn_data)
+        with timer(self.profiler, 'solve'):
+            results_df = pysvzerod.simulate(self.lpn.lpn_data)
         self._print('Done')
         
-        return SolverResults(results_df)
+        return self._results(results_df)
     
-    def run_sim_pipeline(self, validate, save_csv, save_branch, out_dir):
-            # resolve validation and last_cycle/mean_only conflict
-        if validate and self.mean_only:
-            print("Cannot validate with mean_only.")
-            exit(1)
-        elif validate and self.last_cycle_only:
-            self._last_cycle(False)
-            post_convert_last_cycle = True
-        else:
-            post_convert_last_cycle = False
-
+    def _results(self, results_df):
+        ''' wraps a solver dataframe, counting solves and rows '''
+        count(self.profiler, 'solves')
+        count(self.profiler, 'rows', len(results_df))
+        with timer(self.profiler, 'build_results'):
+            return SolverResults(results_df)
+    
+    def _solve(self):
+        ''' runs the C++ model and returns the solver object '''
+        solver = pysvzerod.Solver(self.lpn.lpn_data)
+        solver.run()
+        return solver
+    
+    def run_sim_mean(self):
+        ''' run a simulation and return time-averaged values of every vessel as numpy arrays, skipping the dataframe '''
+        return self._cached('mean', self._simulate_mean)
+    
+    def _simulate_mean(self):
+        self._print("Running solver...", end = '\t', flush = True)
+        
+        with timer(self.profiler, 'solve'):
+            solver = self._solve()
+        count(self.profiler, 'solves')
+        with timer(self.profiler, 'build_results'):
+            results = MeanResults.from_solver(solver, self.lpn.lpn_data)
+        self._print('Done')
+        
+        return results
+    
+    def run_sim_converged(self, tol = 1e-3, min_cycles = 3, max_cycles = None, keep_cycles = 1):
+        """Runs min_cycles and checks the cycle-to-cycle change of the inlet pressure and outlet flows, rerunning with max_cycles only if it has not reached a periodic steady state.
+        The C++ solver cannot resume from a previous state, so there is at most one rerun, costing min_cycles + max_cycles cycles in the worst case.
+
+        Args:
+            tol (float, optional): relative tolerance between the last two cycles. Defaults to 1e-3.
+            min_cycles (int, optional): cycles of the first attempt. Defaults to 3.
+            max_cycles (int, optional): cycles of the rerun. Defaults to the number_of_cardiac_cycles of the LPN.
+            keep_cycles (int, optional): number of final cycles retained in the results. Defaults to 1.
+
+        Returns:
+            SolverResults: results of the final keep_cycles cycles, with time starting at 0.
+        """
+        if self.mean_only:
+            raise ValueError("Cannot check convergence with mean_only.")
+        
+        sim_params = self.lpn.lpn_data['simulation_parameters']
+        orig_cycles = sim_params['number_of_cardiac_cycles']
+        num_pts = int(sim_params['number_of_time_pts_per_cardiac_cycle'])
+        if max_cycles is None:
+            max_cycles = orig_cycles
+        
+        # inlet pressure and outlet flows are checked
+        checks = []
+        for vess in self.lpn.lpn_data['vessels']:
+            bcs = vess.get('boundary_conditions', {})
+            if 'inlet' in bcs:
+                checks.append((vess['vessel_name'], 'pressure_in'))
+            if 'outlet' in bcs:
+                checks.append((vess['vessel_name'], 'flow_out'))
+        
+        first = max(min_cycles, keep_cycles, 2)
+        attempts = [first, max_cycles] if max_cycles > first else [first]
+        try:
+            for cycles in attempts:
+                sim_params['number_of_cardiac_cycles'] = cycles
+                # also rebuilds the C++ model of a SolverSession
+                self._last_cycle(False)
+                results = self.run_sim()
+                err = results.periodicity_error(num_pts, checks)
+                self._print(f"Cycle-to-cycle error after {cycles} cycles: {err:.3e}")
+                if err < tol:
+                    break
+            else:
+                print(f"Warning: solution did not converge to tol {tol} within {cycles} cycles (error {err:.3e}).")
+        finally:
+            # reset back to avoid future issue
+            sim_params['number_of_cardiac_cycles'] = orig_cycles
+            self._last_cycle(self.last_cycle_only)
+        
+        return results.last_cycles(num_pts, keep_cycles)
+    
+    def run_sim_pipeline(self, validate, save_csv, save_branch, out_dir, converge_tol = None, save_results = True, profile = False, cprofile = False):
+        """Solves and post-processes the LPN, saving outputs to out_dir.
+
+        Args:
+            validate (bool): plot the inlet pressure over every cycle
+            save_csv (bool): save results as a csv
+            save_branch (bool): save python branch results
+            out_dir (Path): output directory
+            converge_tol (float, optional): run until a periodic steady state of this tolerance (see run_sim_converged). Defaults to None.
+            save_results (bool, optional): save binary results. Defaults to True.
+            profile (bool, optional): time every stage and count solves and rows, writing a profile.json report to out_dir. Defaults to False.
+            cprofile (bool, optional): also capture a cProfile, listed in the report and saved as profile.prof. Implies profile. Defaults to False.
+
+        Returns:
+            SolverResults: results
+        """
         out_dir = Path(out_dir)
+        if not (profile or cprofile):
+            return self._pipeline(validate, save_csv, save_branch, out_dir, converge_tol, save_results)
+        
+        self.profiler = Profiler(cprofile = cprofile)
+        try:
+            with self.profiler:
+                results = self._pipeline(validate, save_csv, save_branch, out_dir, converge_tol, save_results)
+            self.profiler.save(out_dir / 'profile.json',
+                               num_vessels = len(self.lpn.lpn_data['vessels']),
+                               num_cardiac_cycles = self.lpn.simulation_params['number_of_cardiac_cycles'],
+                               num_time_pts_per_cycle = self.lpn.simulation_params['number_of_time_pts_per_cardiac_cycle'])
+        finally:
+            self.profiler = None
+        return results
     
-        results = self.run_sim()
+    def _pipeline(self, validate, save_csv, save_branch, out_dir, converge_tol, save_results):
+        
+        if converge_tol is not None:
+            # stop at a periodic steady state, keeping 3 cycles for validation
+            num_pts = int(self.lpn.simulation_params['number_of_time_pts_per_cardiac_cycle'])
+            results = self.run_sim_converged(tol = converge_tol, keep_cycles = 3 if validate else 1)
+            post_convert_last_cycle = validate
+        else:
+            # resolve validation and last_cycle/mean_only conflict
+            if validate and self.mean_only:
+                print("Cannot validate with mean_only.")
+                exit(1)
+            elif validate and self.last_cycle_only:
+                self._last_cycle(False)
+                post_convert_last_cycle = True
+            else:
+                post_convert_last_cycle = False
+        
+            results = self.run_sim()
 
         # validate
         if validate:
             print("Validating results...", end = '\t', flush = True)
-            results.validate_results(self.lpn, str(out_dir / "inlet_pressure_validation.png"))
+            with timer(self.profiler, 'validate'):
+                results.validate_results(self.lpn, str(out_dir / "inlet_pressure_validation.png"))
             print("Done")
         
         # convert to last cycle
         if post_convert_last_cycle:
-            results = results.only_last_cycle(self.lpn.inflow.tc)
-            # reset back to avoid future issue
-            self.lpn.simulation_params['output_last_cycle_only'] = True
-
+            if converge_tol is not None:
+                with timer(self.profiler, 'last_cycle'):
+                    results = results.last_cycles(num_pts, 1)
+            else:
+                with timer(self.profiler, 'last_cycle'):
+                    results = results.only_last_cycle(self.lpn.inflow.tc)
+                # reset back to avoid future issue
+                self._last_cycle(True)
+
+        # save binary results
+        if save_results:
+            print("Saving results...", end = '\t', flush = True)
+            with timer(self.profiler, 'save_results'):
+                results.save(out_dir / 'branch_results')
+            print("Done")
+            
         # save csv
         if save_csv:
             print("Saving csv...", end = '\t', flush = True)
-            results.save_csv(str(out_dir / 'branch_results.csv'))
+            with timer(self.profiler, 'save_csv'):
+                results.save_csv(str(out_dir / 'branch_results.csv'))
             print("Done")
 
         # save branch results
         if save_branch:
             print("Converting to python branch results...", end = '\t', flush = True)
-            branch_results = results.convert_to_python(self.lpn)
-            np.save(str(out_dir / 'branch_results.npy'), branch_results, allow_pickle = True)
+            with timer(self.profiler, 'branch_conversion'):
+                branch_results = results.convert_to_python(self.lpn)
+            with timer(self.profiler, 'save_branch'):
+                results.save_branch_results(branch_results, str(out_dir / 'branch_results.npz'))
             print("Done")
         return results
 
+class SolverSession(Solver0Dcpp):
+    ''' Persistent interface to the 0D C++ Solver. The C++ model is constructed once and only block parameters are updated between runs.
+    '''
+    # parameter ordering of each block in the C++ solver
+    VESSEL_PARAMS = ('R_poiseuille', 'C', 'L', 'stenosis_coefficient')
+    JUNCTION_PARAMS = ('R_poiseuille', 'L', 'stenosis_coefficient')
+    BC_PARAMS = {'RCR': ('Rp', 'C', 'Rd', 'Pd'),
+                 'RESISTANCE': ('R', 'Pd')}
+    
+    def __init__(self, lpn: LPN, use_steady = True, last_cycle_only = True, mean_only = False, debug = False, cache = None):
+        self.solver = None
+        self.dofs = None
+        # parameter vector of the values currently in the C++ model, built on first use
+        self._parameters = None
+        super().__init__(lpn, use_steady, last_cycle_only, mean_only, debug, cache)
+        self.bc_map = {bc['bc_name']: bc for bc in self.lpn.lpn_data['boundary_conditions']}
+        self._build()
+    
+    def _build(self):
+        ''' constructs the C++ model from the LPN '''
+        self._print("Constructing solver...", end = '\t', flush = True)
+        with timer(self.profiler, 'build_model'):
+            self.solver = pysvzerod.Solver(self.lpn.lpn_data)
+        self._print('Done')
+    
+    def _last_cycle(self, last_cycle_only):
+        super()._last_cycle(last_cycle_only)
+        # output options are fixed when the C++ model is constructed, so rebuild it
+        if self.solver is not None:
+            self._build()
+    
+    def _simulate(self):
+        ''' run a simulation with the current parameters '''
+        self._print("Running solver...", end = '\t', flush = True)
+        with timer(self.profiler, 'solve'):
+            self.solver.run()
+            results_df = self.solver.get_full_result()
+        self._print('Done')
+        
+        return self._results(results_df)
+    
+    def run(self):
+        ''' alias of run_sim '''
+        return self.run_sim()
+    
+    def _solve(self):
+        self.solver.run()
+        return self.solver
+    
+    def _simulate_mean(self):
+        self._print("Running solver...", end = '\t', flush = True)
+        if self.dofs is None:
+            self.dofs = MeanResults.vessel_dofs(self.lpn.lpn_data)
+        with timer(self.profiler, 'solve'):
+            solver = self._solve()
+        count(self.profiler, 'solves')
+        with timer(self.profiler, 'build_results'):
+            results = MeanResults.from_solver(solver, self.lpn.lpn_data, self.dofs)
+        self._print('Done')
+        return results
+    
+    def update_parameters(self, block_name, values):
+        ''' replaces the full parameter list of a block in the C++ model (in C++ solver ordering). Bypasses lpn_data, so do not combine with a cache. '''
+        self.solver.update_block_params(block_name, [float(v) for v in values])
+    
+    def sync(self, vessels = None, junctions = None, bcs = None):
+        """Pushes the current LPN values of blocks to the C++ model. Use after modifying lpn_data directly.
+
+        Args:
+            vessels (list, optional): vessel ids to push. Defaults to all vessels.
+            junctions (list, optional): junction ids to push. Defaults to all BloodVesselJunctions.
+            bcs (list, optional): bc names to push. Defaults to all RCR and RESISTANCE bcs.
+        """
+        if vessels is None:
+            vessels = range(len(self.lpn.lpn_data['vessels']))
+        if junctions is None:
+            junctions = [idx for idx, junc in enumerate(self.lpn.lpn_data['junctions']) if junc['junction_type'] == 'BloodVesselJunction']
+        if bcs is None:
+            bcs = [name for name, bc in self.bc_map.items() if bc['bc_type'] in self.BC_PARAMS]
+        
+        for vessel_id in vessels:
+            vess = self.lpn.lpn_data['vessels'][vessel_id]
+            vals = vess['zero_d_element_values']
+            self.update_parameters(vess['vessel_name'], [vals.get(key, 0) for key in self.VESSEL_PARAMS])
+        for junction_id in junctions:
+            junc = self.lpn.lpn_data['junctions'][junction_id]
+            vals = junc['junction_values']
+            params = []
+            for key in self.JUNCTION_PARAMS:
+                params += vals[key]
+            self.update_parameters(junc['junction_name'], params)
+        for bc_name in bcs:
+            bc = self.bc_map[bc_name]
+            self.update_parameters(bc_name, [bc['bc_values'][key] for key in self.BC_PARAMS[bc['bc_type']]])
+    
+    def change_vessel(self, vessel_id: int, R: float = None, C: float = None, L: float = None, S: float = None, mode: str = 'replace'):
+        """Changing Vessel in both the LPN and the C++ model
+
+        Args:
+            vessel_id (int): vessel id
+            R (float, optional): R poiseuille resistance. Defaults to None.
+            C (float, optional): capacitance. Defaults to None.
+            L (float, optional): inductance. Defaults to None.
+            S (float, optional): stenosis coefficient. Defaults to None.
+            mode (str, optional): replace or add. Defaults to replace
+        """
+        self.lpn.change_vessel(vessel_id, R = R, C = C, L = L, S = S, mode = mode)
+        self.sync(vessels = [vessel_id], junctions = [], bcs = [])
+        self._parameters = None
+    
+    def change_junction_outlet(self, junction_id: int, which: int, R: float = None, C: float = None, L: float = None, S: float = None, mode: str = 'replace'):
+        """Changing Junction Outlets in both the LPN and the C++ model
+
+        Args:
+            junction_id (int): junction id
+            which (int): which outlet of the junction to change
+            R (float, optional): R poiseuille resistance. Defaults to None.
+            C (float, optional): capacitance. Defaults to None.
+            L (float, optional): inductance. Defaults to None.
+            S (float, optional): stenosis coefficient. Defaults to None.
+            mode (str, optional): replace or add. Defaults to replace
+        """
+        self.lpn.change_junction_outlet(junction_id, which, R = R, C = C, L = L, S = S, mode = mode)
+        self.sync(vessels = [], junctions = [junction_id], bcs = [])
+        self._parameters = None
+    
+    def change_bc(self, bc_name: str, mode: str = 'replace', **values):
+        """Changing an RCR or RESISTANCE boundary condition in both the LPN and the C++ model
+
+        Args:
+            bc_name (str): name of the bc
+            mode (str, optional): replace or add. Defaults to replace
+            **values: new bc values, i.e. Rp, C, Rd, Pd for RCR
+        """
+        bc_values = self.bc_map[bc_name]['bc_values']
+        for key, val in values.items():
+            bc_values[key] = val if mode == 'replace' else val + bc_values[key]
+        self.sync(vessels = [], junctions = [], bcs = [bc_name])
+        self._parameters = None
+    
+    def get_parameters(self):
+        """Parameter vector of the current model values. Perturb copies of it and pass them to set_parameters.
+
+        Returns:
+            ParameterVector: current vessel, junction outlet and bc values
+        """
+        if self._parameters is None:
+            self._parameters = self.lpn.get_parameters()
+        return self._parameters.copy()
+    
+    def set_parameters(self, values):
+        """Sets the model to a parameter vector, materializing and pushing only the blocks whose values differ from the current ones.
+
+        Args:
+            values (ParameterVector | np.ndarray): parameter vector, or its values, in the ordering of get_parameters
+        """
+        if self._parameters is None:
+            self._parameters = self.lpn.get_parameters()
+        current = self._parameters
+        values = np.asarray(getattr(values, 'values', values), dtype = float)
+        changed = np.flatnonzero(values != current.values)
+        if len(changed) == 0:
+            return
+        current.values[changed] = values[changed]
+        vessels, outlets, bcs = current.materialize(changed)
+        self.sync(vessels = vessels, junctions = sorted({jidx for jidx, _ in outlets}), bcs = bcs)
+
 class SolverResults():
     ''' 0D C solver results file
     '''
+    # value fields written per vessel by the solver
+    FIELDS = ('flow_in', 'flow_out', 'pressure_in', 'pressure_out')
+    
     def __init__(self, df: pd.DataFrame):
         self.result_df = df
+        # memory mapped columns, scale factors and cached (min, mean, max) of lazily opened results
+        self._columns = None
+        self._scale = {}
+        self._summary = None
+        self._build_index()
+    
+    @property
+    def result_df(self):
+        ''' long format dataframe of results, materialized on first access for lazily opened results
+        '''
+        if self._df is None:
+            counts = [len(rows) for rows in self._rows]
+            data = {'name': np.repeat(np.array(self.vessel_names, dtype = object), counts)}
+            for f in ('time',) + self.FIELDS:
+                data[f] = self._take(f, slice(None))
+            self._df = pd.DataFrame(data)
+        return self._df
+    
+    @result_df.setter
+    def result_df(self, df):
+        self._df = df
+    
+    def _take(self, field, rows):
+        ''' values of a field at row positions, only paging in those rows for lazily opened results
+        '''
+        if self._columns is None:
+            return self._df[field].to_numpy()[rows]
+        vals = np.asarray(self._columns[field][rows])
+        if field in self._scale:
+            vals = vals * self._scale[field]
+        return vals
+    
+    def _build_index(self):
+        ''' Builds a one-time vessel name -> row index so accessors avoid filtering the whole dataframe.
+        Vessels are kept in order of appearance (the vessel order of the LPN).
+        '''
+        codes, names = pd.factorize(self.result_df['name'].to_numpy())
+        order = np.argsort(codes, kind = 'stable')
+        counts = np.bincount(codes, minlength = len(names))
+        
+        self.vessel_names = list(names)
+        self._vessel_idx = {name: idx for idx, name in enumerate(self.vessel_names)}
+        if len(counts) > 0 and np.all(counts == counts[0]):
+            # every vessel has the same time points, so rows form a dense [vessel, time] matrix
+            self._rows = order.reshape(len(names), counts[0])
+        else:
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            self._rows = [order[offsets[i]:offsets[i + 1]] for i in range(len(names))]
+    
+    def _vessel_rows(self, vessel_name):
+        ''' row positions of a vessel in result_df
+        '''
+        return self._rows[self._vessel_idx[vessel_name]]
+    
+    def vessel_arr(self, vessel_name, val = 'flow_in'):
+        ''' retrieves a single field of a vessel as a numpy array
+        '''
+        return self._take(val, self._vessel_rows(vessel_name))
         
     def only_last_cycle(self, tc):
         ''' Returns a Solver Results with only last cycle
         '''
-        df = self.result_df.copy()
-        df = df[df['time'] >= df['time'].max() - tc].copy()
+        time = self._take('time', slice(None))
+        df = self.result_df[time >= time.max() - tc].copy()
+        df['time'] -= df['time'].min()
+        return SolverResults(df)
+    
+    def last_cycles(self, num_pts, n = 1):
+        ''' Returns a Solver Results with only the last n cycles, using num_pts time points per cycle
+        '''
+        keep = (num_pts - 1) * n + 1
+        df = self.result_df.iloc[self._rows[:, -keep:].ravel()].copy()
         df['time'] -= df['time'].min()
         return SolverResults(df)
     
+    def periodicity_error(self, num_pts, checks):
+        """Relative change between the last two cycles.
+
+        Args:
+            num_pts (int): number of time points per cycle
+            checks (list): list of (vessel name, field) pairs to check
+
+        Returns:
+            float: max over checks of max|last - previous| / max|last|
+        """
+        err = 0
+        for vessel_name, field in checks:
+            vals = self.vessel_arr(vessel_name, field)
+            last = vals[-num_pts:]
+            prev = vals[-(2 * num_pts - 1):-(num_pts - 1)]
+            err = max(err, np.abs(last - prev).max() / max(np.abs(last).max(), 1e-12))
+        return err
+    
     def convert_to_mmHg(self):
         '''Performs conversion on all pressures to mmHg (will cause errors when applied multiple times)
         '''
+        if self._columns is not None:
+            # lazily opened, so scale on read
+            for f in ('pressure_in', 'pressure_out'):
+                self._scale[f] = d2m(self._scale.get(f, 1.0))
+            if self._df is None:
+                return
         self.result_df['pressure_in'] = d2m(self.result_df['pressure_in'])
         self.result_df['pressure_out'] = d2m(self.result_df['pressure_out'])
     
@@ -190,44 +608,202 @@ class SolverResults():
         df = pd.read_csv(fp)
         return cls(df)
     
+    def save(self, out_dir, dtype = np.float64):
+        """Saves results in a binary directory: one flat .npy per field (time included) in vessel order, vessel row offsets, and an index of vessel names.
+
+        Args:
+            out_dir (str): directory to save to, i.e. branch_results
+            dtype (type, optional): dtype of the fields. Defaults to np.float64.
+        """
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents = True, exist_ok = True)
+        
+        rows = [self._vessel_rows(name) for name in self.vessel_names]
+        order = np.concatenate(rows) if rows else np.array([], dtype = int)
+        offsets = np.concatenate([[0], np.cumsum([len(r) for r in rows])])
+        np.save(out_dir / 'offsets.npy', offsets.astype(np.int64))
+        for f in ('time',) + self.FIELDS:
+            np.save(out_dir / (f + '.npy'), self._take(f, order).astype(dtype))
+        if isinstance(self._rows, np.ndarray) and self._rows.shape[1] > 1:
+            # cache (min, mean, max) of every field
+            np.save(out_dir / 'summary.npy', self._compute_summary().astype(dtype))
+        write_json(out_dir / 'index.json', {'vessel_names': self.vessel_names, 'fields': list(self.FIELDS)}, sort_keys = False)
+    
+    @classmethod
+    def from_binary(cls, fp, vessels = None):
+        """Loads results saved by save, reading only the requested vessels.
+
+        Args:
+            fp (str): directory of saved results
+            vessels (list, optional): vessel names to load. Defaults to all vessels.
+        """
+        fp = Path(fp)
+        index = read_json(fp / 'index.json')
+        offsets = np.load(fp / 'offsets.npy')
+        names = index['vessel_names']
+        if vessels is None:
+            vessels = names
+        vessel_idx = {name: idx for idx, name in enumerate(names)}
+        
+        # contiguous slices of each requested vessel
+        slices = [slice(offsets[vessel_idx[name]], offsets[vessel_idx[name] + 1]) for name in vessels]
+        data = {'name': np.repeat(np.array(vessels, dtype = object), [s.stop - s.start for s in slices])}
+        for f in ['time'] + index['fields']:
+            arr = np.load(fp / (f + '.npy'), mmap_mode = 'r')
+            data[f] = np.concatenate([arr[s] for s in slices]) if slices else np.array([])
+        return cls(pd.DataFrame(data))
+    
+    @classmethod
+    def open(cls, fp, mmap_mode = 'r'):
+        """Opens results saved by save lazily. Fields are memory mapped, so only the vessels and fields accessed are read, and summary statistics are read from the cache written alongside.
+        result_df is only built when accessed directly.
+
+        Args:
+            fp (str): directory of saved results
+            mmap_mode (str, optional): memmap mode. Defaults to 'r'.
+        """
+        fp = Path(fp)
+        index = read_json(fp / 'index.json')
+        offsets = np.load(fp / 'offsets.npy')
+        counts = np.diff(offsets)
+        
+        self = cls.__new__(cls)
+        self._df = None
+        self._scale = {}
+        self.vessel_names = list(index['vessel_names'])
+        self._vessel_idx = {name: idx for idx, name in enumerate(self.vessel_names)}
+        if len(counts) > 0 and np.all(counts == counts[0]):
+            self._rows = np.arange(offsets[-1]).reshape(len(counts), counts[0])
+        else:
+            self._rows = [np.arange(offsets[i], offsets[i + 1]) for i in range(len(counts))]
+        self._columns = {f: np.load(fp / (f + '.npy'), mmap_mode = mmap_mode) for f in ['time'] + index['fields']}
+        self._summary = np.load(fp / 'summary.npy') if (fp / 'summary.npy').is_file() else None
+        return self
+    
+    @classmethod
+    def load(cls, fp, vessels = None, lazy = True):
+        ''' Loads results from a binary results directory (lazily unless vessels are given or lazy is False) or a csv
+        '''
+        if str(fp).endswith('.csv'):
+            return cls.from_csv(fp)
+        if lazy and vessels is None:
+            return cls.open(fp)
+        return cls.from_binary(fp, vessels)
+    
+    @staticmethod
+    def save_branch_results(branch_results: dict, fp):
+        ''' Saves python branch results (from convert_to_python) to an npz without pickling
+        '''
+        arrays = {'time': branch_results['time']}
+        for key in ('distance', 'flow', 'pressure'):
+            for branch_id, arr in branch_results[key].items():
+                arrays[f'{key}/{branch_id}'] = arr
+        np.savez(fp, **arrays)
+    
+    @staticmethod
+    def load_branch_results(fp):
+        ''' Loads python branch results saved by save_branch_results
+        '''
+        branch_results = {'distance': {}, 'flow': {}, 'pressure': {}}
+        with np.load(fp) as data:
+            for name in data.files:
+                if name == 'time':
+                    branch_results['time'] = data[name]
+                else:
+                    key, branch_id = name.split('/')
+                    branch_results[key][int(branch_id)] = data[name]
+        return branch_results
+    
     def vessel_df(self, vessel_name):
         ''' retrieves a df isolated by name
         '''
-        return self.result_df[self.result_df['name'] == vessel_name]
+        if vessel_name not in self._vessel_idx:
+            return self.result_df.iloc[[]]
+        if self._columns is not None and self._df is None:
+            rows = self._vessel_rows(vessel_name)
+            data = {'name': [vessel_name] * len(rows)}
+            for f in ('time',) + self.FIELDS:
+                data[f] = self._take(f, rows)
+            return pd.DataFrame(data)
+        return self.result_df.iloc[self._vessel_rows(vessel_name)]
     
     def get_avg_val(self,vessel_name, val = 'flow_in'):
         ''' get the average flow of a result '''
-        assert val in {'flow_in', 'flow_out', 'pressure_in', 'pressure_out'}, "Must be one of flow_in, flow_out, pressure_in, pressure_out"
-        df = self.vessel_df(vessel_name)
-        flow = np.array(df[val])
-        time = np.array(df['time'])
+        assert val in self.FIELDS, "Must be one of flow_in, flow_out, pressure_in, pressure_out"
+        if self._summary is not None:
+            return self._cached_summary(self._vessel_idx[vessel_name], val)[1]
+        flow = self.vessel_arr(vessel_name, val)
+        time = self.vessel_arr(vessel_name, 'time')
         return np.trapz(flow, time) / (time[-1] - time[0])
     
     def get_max_val(self,vessel_name, val = 'flow_in'):
         ''' get the max value of a result '''
-        assert val in {'flow_in', 'flow_out', 'pressure_in', 'pressure_out'}, "Must be one of flow_in, flow_out, pressure_in, pressure_out"
-        df = self.vessel_df(vessel_name)
-        return np.array(df[val]).max()
+        assert val in self.FIELDS, "Must be one of flow_in, flow_out, pressure_in, pressure_out"
+        if self._summary is not None:
+            return self._cached_summary(self._vessel_idx[vessel_name], val)[2]
+        return self.vessel_arr(vessel_name, val).max()
     
     def get_min_val(self,vessel_name, val = 'flow_in'):
         ''' get the max value of a result '''
-        assert val in {'flow_in', 'flow_out', 'pressure_in', 'pressure_out'}, "Must be one of flow_in, flow_out, pressure_in, pressure_out"
-        df = self.vessel_df(vessel_name)
-        return np.array(df[val]).min()
+        assert val in self.FIELDS, "Must be one of flow_in, flow_out, pressure_in, pressure_out"
+        if self._summary is not None:
+            return self._cached_summary(self._vessel_idx[vessel_name], val)[0]
+        return self.vessel_arr(vessel_name, val).min()
     
     def get_summ_val(self, vessel_name, val = 'flow_in'):
         """Gets min, avg, max of a result"""
-        assert val in {'flow_in', 'flow_out', 'pressure_in', 'pressure_out'}, "Must be one of flow_in, flow_out, pressure_in, pressure_out"
-        df = self.vessel_df(vessel_name)
-        flow = np.array(df[val])
-        time = np.array(df['time'])
-        return np.array(df[val]).min(), np.trapz(flow, time) / (time[-1] - time[0]), np.array(df[val]).max()
+        assert val in self.FIELDS, "Must be one of flow_in, flow_out, pressure_in, pressure_out"
+        if self._summary is not None:
+            return tuple(self._cached_summary(self._vessel_idx[vessel_name], val))
+        flow = self.vessel_arr(vessel_name, val)
+        time = self.vessel_arr(vessel_name, 'time')
+        return flow.min(), np.trapz(flow, time) / (time[-1] - time[0]), flow.max()
+
+    def to_array(self, fields = FIELDS, vessels = None):
+        ''' reshapes results into a dense [vessel, field, time] array. Vessels default to solver (LPN) order.
+        '''
+        if not isinstance(self._rows, np.ndarray):
+            raise ValueError("Vessels do not share the same time points, so results cannot be reshaped.")
+        rows = self._rows if vessels is None else self._rows[[self._vessel_idx[name] for name in vessels]]
+        return np.stack([self._take(f, rows) for f in fields], axis = 1)
+    
+    def summarize(self, fields = ('flow', 'pressure'), which = 'in', vessels = None):
+        """Gets min, time-averaged mean, and max of fields for all vessels at once.
+
+        Args:
+            fields (tuple, optional): any of flow or pressure. Defaults to ('flow', 'pressure').
+            which (str, optional): in or out of the vessels. Defaults to 'in'.
+            vessels (list, optional): vessel names to summarize, in order. Defaults to all vessels in solver order.
 
+        Returns:
+            np.ndarray: [n_vessels, n_fields, 3] array of (min, mean, max)
+        """
+        assert which in {'in', 'out'}, "which must be one of in, out"
+        if self._summary is not None:
+            vids = slice(None) if vessels is None else [self._vessel_idx[name] for name in vessels]
+            return np.stack([self._cached_summary(vids, f + '_' + which) for f in fields], axis = 1)
+        return self._compute_summary([f + '_' + which for f in fields], vessels)
+
+    def _compute_summary(self, fields = FIELDS, vessels = None):
+        ''' (min, mean, max) of fields as a [n_vessels, n_fields, 3] array
+        '''
+        vals = self.to_array(fields, vessels)
+        time = self.to_array(['time'], vessels)[:, 0]
+        summ = np.empty(vals.shape[:2] + (3,))
+        summ[..., 0] = vals.min(axis = -1)
+        summ[..., 1] = np.trapz(vals, time[:, None, :], axis = -1) / (time[:, -1] - time[:, 0])[:, None]
+        summ[..., 2] = vals.max(axis = -1)
+        return summ
+    
+    def _cached_summary(self, vids, field):
+        ''' cached (min, mean, max) of a field for vessel positions, scaled like lazily read values
+        '''
+        return np.asarray(self._summary[vids, self.FIELDS.index(field)], dtype = float) * self._scale.get(field, 1.0)
+    
     def get_vessel_names(self):
         ''' get a list of all vessel names
         '''
-        tmp = self.result_df.groupby('name').max()
-        return list(tmp.index)
+        return sorted(self.vessel_names)
     
     def convert_to_python(self, lpn: LPN):
         ''' Convert the c results into python branch_results (not sorted)
@@ -235,7 +811,7 @@ class SolverResults():
         branch_results = {}
         
         # write time
-        branch_results['time'] = self.result_df['time'].unique()
+        branch_results['time'] = pd.unique(self._take('time', slice(None)))
         
         branch_results['distance'] = {}
         branch_results['flow'] = {}
@@ -249,20 +825,19 @@ class SolverResults():
             vess_Q = []
             vess_P = []
             vess_D = [0.0]
-            vess_df = self.vessel_df(node.vessel_info[0]['vessel_name'])
-            vess_Q.append(list(vess_df['flow_in']))
-            vess_Q.append(list(vess_df['flow_out']))
-            vess_P.append(list(vess_df['pressure_in']))
-            vess_P.append(list(vess_df['pressure_out']))
+            vess_name = node.vessel_info[0]['vessel_name']
+            vess_Q.append(self.vessel_arr(vess_name, 'flow_in'))
+            vess_Q.append(self.vessel_arr(vess_name, 'flow_out'))
+            vess_P.append(self.vessel_arr(vess_name, 'pressure_in'))
+            vess_P.append(self.vessel_arr(vess_name, 'pressure_out'))
             vess_D.append(node.vessel_info[0]['vessel_length'])
             
             # if longer than just 1 vessel segment per branch
             if len(node.ids) > 1:
                 cur_idx = 1
                 for vessel in node.vessel_info[1:]:
-                    vess_df = self.vessel_df(vessel['vessel_name'])
-                    vess_Q.append(list(vess_df['flow_out']))
-                    vess_P.append(list(vess_df['pressure_out']))
+                    vess_Q.append(self.vessel_arr(vessel['vessel_name'], 'flow_out'))
+                    vess_P.append(self.vessel_arr(vessel['vessel_name'], 'pressure_out'))
                     vess_D.append(vess_D[-1] + node.vessel_info[cur_idx]['vessel_length'])
                     cur_idx += 1
         
@@ -276,117 +851,53 @@ class SolverResults():
         '''
         self.result_df.to_csv(out_file, sep = ',', header = True, index = False)
         
-    def project_to_centerline(self, lpn: LPN, centerlines: Centerlines):
+    def node_values(self, projection: CenterlineProjection, fields = ('flow', 'pressure')):
+        """Gathers values at the branch nodes of a projection.
+
+        Args:
+            projection (CenterlineProjection): centerline projection
+            fields (tuple, optional): any of flow or pressure. Defaults to ('flow', 'pressure').
+
+        Returns:
+            dict: field -> [nodes, time] values
+        """
+        is_in = np.array(projection.node_sides) == 'in'
+        if isinstance(self._rows, np.ndarray):
+            rows = self._rows[[self._vessel_idx[name] for name in projection.node_vessels]]
+            return {f: np.where(is_in[:, None], self._take(f + '_in', rows), self._take(f + '_out', rows)) for f in fields}
+        return {f: np.array([self.vessel_arr(name, f + '_' + side) for name, side in zip(projection.node_vessels, projection.node_sides)]) for f in fields}
+    
+    def project_to_centerline(self, lpn: LPN, centerlines: Centerlines, projection: CenterlineProjection = None, save_time_steps = True):
         """
         Project rom results onto the centerline
-        Modified from: https://github.com/SimVascular/SimVascular/blob/master/Python/site-packages/sv_rom_extract_results/post.py
+
+        Args:
+            lpn (LPN): lpn the results were simulated with
+            centerlines (Centerlines): centerlines to add arrays to
+            projection (CenterlineProjection, optional): precomputed projection of lpn onto centerlines, reuse when projecting many results. Defaults to building one.
+            save_time_steps (bool, optional): add an array for every time step, otherwise only summary arrays. Defaults to True.
         """
-        
-        # convert c++ to python results
-        results = self.convert_to_python(lpn)
+        if projection is None:
+            projection = CenterlineProjection(lpn, centerlines)
         
         # assemble output dict
-        rec_dd = lambda: defaultdict(rec_dd)
-        arrays = rec_dd()
+        arrays = {}
 
-        # extract point arrays from geometries
-        arrays_cent = {}
-        for arr_name in centerlines.get_pointdata_arraynames():
-            arrays_cent[arr_name] = centerlines.get_pointdata_array(arr_name)
-        
         # add centerline arrays
-        for name, data in arrays_cent.items():
-            arrays[name] = data
-
-        # centerline points
-        points = centerlines.get_points()
-
-        # all branch ids in centerline
-        ids_cent = np.unique(arrays_cent['BranchId']).tolist()
-        ids_cent.remove(-1)
+        for arr_name in centerlines.get_pointdata_arraynames():
+            arrays[arr_name] = centerlines.get_pointdata_array(arr_name)
         
         # retrieve time
-        times = self.result_df['time'].unique()
+        times = pd.unique(self._take('time', slice(None)))
 
         # loop all result fields
-        for f in ['flow', 'pressure']:
-            if f not in results:
-                continue
-
-            # check if ROM branch has same ids as centerline
-            ids_rom = list(results[f].keys())
-            ids_rom.sort()
-            assert ids_cent == ids_rom, 'Centerline and ROM results have different branch ids'
-
-            # initialize output arrays
-            array_f = np.zeros((arrays_cent['Path'].shape[0], len(times)))
-            n_outlet = np.zeros(arrays_cent['Path'].shape[0])
-
-            # loop all branches
-            for br in results[f].keys():
-                # results of this branch
-                res_br = results[f][br]
-
-                # get centerline path
-                path_cent = arrays_cent['Path'][arrays_cent['BranchId'] == br]
-
-                # get node locations from 0D results
-                path_0d_res = results['distance'][br]
-                f_res = res_br
-            
-                assert np.isclose(path_0d_res[0], 0.0), 'ROM branch path does not start at 0'
-                assert np.isclose(path_cent[0], 0.0), 'Centerline branch path does not start at 0'
-                msg = 'ROM results and centerline have different branch path lengths'
-                assert np.isclose(path_0d_res[-1], path_cent[-1]), msg
-
-                # interpolate ROM onto centerline
-                # limit to interval [0,1] to avoid extrapolation error interp1d due to slightly incompatible lenghts
-                f_cent = interp1d(path_0d_res / path_0d_res[-1], f_res.T)(path_cent / path_cent[-1]).T
-
-                # store results of this path
-                array_f[arrays_cent['BranchId'] == br] = f_cent[:, range(len(times))]
-
-                # add upstream part of branch within junction
-                if br == 0:
-                    continue
-
-                # first point of branch
-                ip = np.where(arrays_cent['BranchId'] == br)[0][0]
-
-                # centerline that passes through branch (first occurence)
-                cid = np.where(arrays_cent['CenterlineId'][ip])[0][0]
-
-                # id of upstream junction
-                jc = arrays_cent['BifurcationId'][ip - 1]
-
-                # centerline within junction
-                is_jc = arrays_cent['BifurcationId'] == jc
-                jc_cent = np.where(np.logical_and(is_jc, arrays_cent['CenterlineId'][:, cid]))[0]
-                
-                # length of centerline within junction
-                jc_path = np.append(0, np.cumsum(np.linalg.norm(np.diff(points[jc_cent], axis=0), axis=1)))
-                jc_path /= jc_path[-1]
-                
-                # results at upstream branch
-                res_br_u = results[f][arrays_cent['BranchId'][jc_cent[0] - 1]]
-
-                # results at beginning and end of centerline within junction
-                f0 = res_br_u[-1][range(len(times))]
-                f1 = res_br[0][range(len(times))]
-               
-                # map 1d results to centerline using paths
-                array_f[jc_cent] += interp1d([0, 1], np.vstack((f0, f1)).T)(jc_path).T
-
-                # count number of outlets of this junction
-                n_outlet[jc_cent] += 1
-
-            # normalize results within junctions by number of junction outlets
-            is_jc = n_outlet > 0
-            array_f[is_jc] = (array_f[is_jc].T / n_outlet[is_jc]).T
+        for f, node_vals in self.node_values(projection).items():
+            array_f = projection.project(node_vals)
 
             # assemble time steps
-            for i, t in enumerate(times):
-                arrays[f + '_' + str(t)] = array_f[:, i]
+            if save_time_steps:
+                for i, t in enumerate(times):
+                    arrays[f + '_' + str(t)] = array_f[:, i]
                 
             # compute summary statistics
             avg = np.trapz( array_f, times, axis = 1) / (times[-1] - times[0])
@@ -400,4 +911,71 @@ class SolverResults():
         for f, a in arrays.items():
             centerlines.add_pointdata(array=a, array_name=f)
         
-        return centerlines
\ No newline at end of file
+        return centerlines
+
+class MeanResults():
+    ''' Time-averaged 0D results of every vessel stored as numpy arrays in vessel order (no dataframe)
+    '''
+    FIELDS = SolverResults.FIELDS
+    
+    def __init__(self, arrays: dict, vessel_names: list = None):
+        self.arrays = arrays
+        self.vessel_names = vessel_names
+    
+    @staticmethod
+    def vessel_dofs(lpn_data: dict):
+        ''' Determines the (inlet, outlet) node names of every vessel in the C++ model, which are named <upstream block>:<downstream block>
+        '''
+        upstream = {}
+        downstream = {}
+        for junc in lpn_data['junctions']:
+            for vid in junc['inlet_vessels']:
+                downstream[vid] = junc['junction_name']
+            for vid in junc['outlet_vessels']:
+                upstream[vid] = junc['junction_name']
+        
+        dofs = []
+        for vess in lpn_data['vessels']:
+            vid, name = vess['vessel_id'], vess['vessel_name']
+            bcs = vess.get('boundary_conditions', {})
+            inlet = bcs['inlet'] if 'inlet' in bcs else upstream[vid]
+            outlet = bcs['outlet'] if 'outlet' in bcs else downstream[vid]
+            dofs.append((inlet + ':' + name, name + ':' + outlet))
+        return dofs
+    
+    @classmethod
+    def from_solver(cls, solver, lpn_data: dict, dofs: list = None):
+        ''' Averages vessel inlet and outlet values directly from a run pysvzerod.Solver
+        '''
+        if dofs is None:
+            dofs = cls.vessel_dofs(lpn_data)
+        arrays = {}
+        for field, side in zip(cls.FIELDS, (0, 1, 0, 1)):
+            arrays[field] = np.array([solver.get_single_result_avg(field.split('_')[0] + ':' + nodes[side]) for nodes in dofs])
+        return cls(arrays, [vess['vessel_name'] for vess in lpn_data['vessels']])
+    
+    @classmethod
+    def from_results(cls, results: SolverResults):
+        ''' Converts mean_only SolverResults (one row per vessel)
+        '''
+        return cls({f: results._take(f, results._rows[:, 0]) for f in cls.FIELDS}, list(results.vessel_names))
+    
+    def __getitem__(self, field):
+        return self.arrays[field]
+    
+    def convert_to_mmHg(self):
+        '''Performs conversion on all pressures to mmHg (will cause errors when applied multiple times)
+        '''
+        self.arrays['pressure_in'] = d2m(self.arrays['pressure_in'])
+        self.arrays['pressure_out'] = d2m(self.arrays['pressure_out'])
+    
+    def get_poi(self, poi: list):
+        """Pulls points of interest by vessel index
+
+        Args:
+            poi (list): list of (field, vessel ids) pairs, i.e. [('pressure_in', [1, 2]), ('pressure_out', [0])]
+
+        Returns:
+            np.ndarray: concatenated values in the order requested
+        """
+        return np.concatenate([self.arrays[field][np.asarray(vids, dtype = int)] for field, vids in poi])
@@ -0,0 +1,196 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+from .lpn import FastLPN
+from .solver import MeanResults
+from svinterface.utils.misc import d2m
+
+
+class SteadySolver():
+    ''' Steady state (DC) solve of the resistive 0D network for mean pressures, flows and their sensitivities to resistances.
+    Capacitors are open and inductors are shorted, RCR and RESISTANCE outlets become Rp + Rd (or R) to Pd, and the inlet flow is its cycle mean.
+    Stenosis coefficients are kept as dP = (R + S|Q|)Q and solved with Newton iterations, so mean values match the transient means exactly only when S = 0.
+    '''
+
+    def __init__(self, lpn: FastLPN, tol = 1e-10, max_iter = 50):
+        """
+        Args:
+            lpn (FastLPN | LPN): lpn to solve. Values are read on every solve, so changes to the lpn are reflected.
+            tol (float, optional): relative tolerance of newton iterations. Defaults to 1e-10.
+            max_iter (int, optional): max number of newton iterations. Defaults to 50.
+        """
+        self.lpn = lpn
+        self.tol = tol
+        self.max_iter = max_iter
+        self.lu = None
+
+    def _assemble(self):
+        ''' Builds the nodes and resistive edges of the network
+        '''
+        lpn_data = self.lpn.lpn_data
+        vessels = lpn_data['vessels']
+        num_vess = len(vessels)
+
+        # vessel i has inlet node 2i and outlet node 2i + 1, junctions without values merge nodes
+        parent = list(range(2 * num_vess))
+        def find(n):
+            while parent[n] != n:
+                parent[n] = parent[parent[n]]
+                n = parent[n]
+            return n
+
+        # edges (from node, to node, R, S)
+        edges = []
+        self.edge_map = {}
+        for vess in vessels:
+            vid = vess['vessel_id']
+            vals = vess['zero_d_element_values']
+            self.edge_map[('vessel', vid)] = len(edges)
+            edges.append([2 * vid, 2 * vid + 1, vals.get('R_poiseuille', 0), vals.get('stenosis_coefficient', 0)])
+
+        for jidx, junc in enumerate(lpn_data['junctions']):
+            inlet = 2 * junc['inlet_vessels'][0] + 1
+            for vid in junc['inlet_vessels'][1:]:
+                parent[find(2 * vid + 1)] = find(inlet)
+            if junc['junction_type'] == 'BloodVesselJunction':
+                vals = junc['junction_values']
+                for which, vid in enumerate(junc['outlet_vessels']):
+                    self.edge_map[('junction', jidx, which)] = len(edges)
+                    edges.append([inlet, 2 * vid, vals['R_poiseuille'][which], vals['stenosis_coefficient'][which]])
+            else:
+                for vid in junc['outlet_vessels']:
+                    parent[find(2 * vid)] = find(inlet)
+
+        # renumber merged nodes
+        roots = {}
+        self.node = np.array([roots.setdefault(find(n), len(roots)) for n in range(2 * num_vess)])
+        self.num_nodes = len(roots)
+        edges = np.array(edges, dtype = float).reshape(-1, 4)
+        self.frm = self.node[edges[:, 0].astype(int)]
+        self.to = self.node[edges[:, 1].astype(int)]
+        self.R = edges[:, 2]
+        self.S = edges[:, 3]
+        self.num_edges = len(edges)
+
+        # boundary conditions
+        bc_map = {bc['bc_name']: bc for bc in lpn_data['boundary_conditions']}
+        self.source = np.zeros(self.num_nodes)
+        self.g_bc = np.zeros(self.num_nodes)
+        self.p_bc = np.zeros(self.num_nodes)
+        for vess in vessels:
+            vid = vess['vessel_id']
+            for side, bc_name in vess.get('boundary_conditions', {}).items():
+                bc = bc_map[bc_name]
+                node = self.node[2 * vid + (side == 'outlet')]
+                vals = bc['bc_values']
+                if bc['bc_type'] == 'FLOW':
+                    t, Q = np.asarray(vals['t'], dtype = float), np.asarray(vals['Q'], dtype = float)
+                    self.source[node] += np.trapz(Q, t) / (t[-1] - t[0]) if len(t) > 1 else Q[0]
+                elif bc['bc_type'] in ('RCR', 'RESISTANCE'):
+                    r_total = vals['Rp'] + vals['Rd'] if bc['bc_type'] == 'RCR' else vals['R']
+                    self.g_bc[node] += 1 / r_total
+                    self.p_bc[node] += vals['Pd'] / r_total
+                else:
+                    raise ValueError(f"Boundary condition {bc_name} of type {bc['bc_type']} is not supported in a steady solve.")
+
+        # incidence matrix (node, edge), +1 where the edge leaves the node
+        edge_idx = np.arange(self.num_edges)
+        self.B = sparse.csc_matrix((np.concatenate([np.ones(self.num_edges), -np.ones(self.num_edges)]),
+                                    (np.concatenate([self.frm, self.to]), np.concatenate([edge_idx, edge_idx]))),
+                                   shape = (self.num_nodes, self.num_edges))
+
+    def _jacobian(self, Q):
+        ''' Jacobian of the node balance and edge pressure drop equations in (pressures, flows)
+        '''
+        r_t = self.R + 2 * self.S * np.abs(Q)
+        return sparse.bmat([[sparse.diags(self.g_bc), self.B],
+                            [self.B.T, sparse.diags(-r_t)]], format = 'csc')
+
+    def _residual(self, p, Q):
+        return np.concatenate([self.B @ Q + self.g_bc * p - self.p_bc - self.source,
+                               self.B.T @ p - (self.R + self.S * np.abs(Q)) * Q])
+
+    def solve(self):
+        """Solves for steady pressures and flows, factorizing the network.
+
+        Returns:
+            MeanResults: mean values of every vessel
+        """
+        self._assemble()
+        n = self.num_nodes
+        x = np.zeros(n + self.num_edges)
+        for _ in range(self.max_iter):
+            self.lu = splu(self._jacobian(x[n:]))
+            dx = self.lu.solve(-self._residual(x[:n], x[n:]))
+            x += dx
+            if np.abs(dx).max() <= self.tol * max(np.abs(x).max(), 1):
+                break
+        else:
+            raise RuntimeError(f"Steady solve did not converge in {self.max_iter} iterations.")
+        # factorization at the solution for sensitivities
+        self.lu = splu(self._jacobian(x[n:]))
+        self.pressure = x[:n]
+        self.flow = x[n:]
+
+        num_vess = len(self.lpn.lpn_data['vessels'])
+        vess_flow = self.flow[:num_vess]
+        arrays = {'flow_in': vess_flow.copy(),
+                  'flow_out': vess_flow.copy(),
+                  'pressure_in': self.pressure[self.node[0::2]],
+                  'pressure_out': self.pressure[self.node[1::2]]}
+        return MeanResults(arrays, [vess['vessel_name'] for vess in self.lpn.lpn_data['vessels']])
+
+    def run_sim_mean(self):
+        ''' Alias of solve, matching Solver0Dcpp
+        '''
+        return self.solve()
+
+    def _poi_rows(self, poi: list):
+        ''' Rows of the (pressure, flow) solution vector for each point of interest
+        '''
+        rows = []
+        for field, vids in poi:
+            vids = np.asarray(vids, dtype = int)
+            if field == 'pressure_in':
+                rows.append(self.node[2 * vids])
+            elif field == 'pressure_out':
+                rows.append(self.node[2 * vids + 1])
+            elif field in ('flow_in', 'flow_out'):
+                rows.append(self.num_nodes + vids)
+            else:
+                raise ValueError(f"Unknown field {field}.")
+        return np.concatenate(rows)
+
+    def sensitivity(self, poi: list, params: list, mmHg = False):
+        """Derivatives of the points of interest with respect to resistances, from the factorization of the last solve.
+
+        Args:
+            poi (list): list of (field, vessel ids) pairs, i.e. [('pressure_in', [1, 2]), ('pressure_out', [0])], as in MeanResults.get_poi
+            params (list): list of ('vessel', vessel_id) or ('junction', junction_id, which) resistances
+            mmHg (bool, optional): convert pressure derivatives to mmHg. Defaults to False.
+
+        Returns:
+            np.ndarray: (number of poi values, number of params) matrix of derivatives
+        """
+        if self.lu is None:
+            self.solve()
+        n = self.num_nodes + self.num_edges
+        rows = self._poi_rows(poi)
+        cols = np.array([self.edge_map[tuple(p)] for p in params], dtype = int)
+
+        # dF/dR_e is -Q_e on the pressure drop equation of edge e, so dx/dR_e = J^-1 e_e Q_e
+        if len(rows) < len(cols):
+            # adjoint: one solve per poi
+            W = np.zeros((n, len(rows)))
+            W[rows, np.arange(len(rows))] = 1
+            sens = self.lu.solve(W, trans = 'T')[self.num_nodes + cols].T * self.flow[cols]
+        else:
+            E = np.zeros((n, len(cols)))
+            E[self.num_nodes + cols, np.arange(len(cols))] = self.flow[cols]
+            sens = self.lu.solve(E)[rows]
+
+        if mmHg:
+            pressure = rows < self.num_nodes
+            sens[pressure] = d2m(sens[pressure])
+        return sens
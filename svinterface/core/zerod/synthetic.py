@@ -0,0 +1,303 @@
+import numpy as np
+import vtk
+from vtk.util.numpy_support import numpy_to_vtk as n2v
+
+from .lpn import LPN
+from svinterface.core.bc import Inflow
+from svinterface.core.polydata import Centerlines
+from svinterface.utils.misc import m2d
+
+
+def synthetic_inflow(mean_flow: float = 80.0, tc: float = 1.0, num_pts: int = 101):
+    """Pulsatile inflow with a systolic half-sine over a third of the cycle and no backflow.
+
+    Args:
+        mean_flow (float, optional): time-averaged flow (mL/s). Defaults to 80.0.
+        tc (float, optional): cardiac cycle length (s). Defaults to 1.0.
+        num_pts (int, optional): number of time points. Defaults to 101.
+
+    Returns:
+        Inflow: inflow waveform
+    """
+    t = np.linspace(0, tc, num_pts)
+    pulse = np.sin(np.pi * t / (tc / 3)) * (t < tc / 3)
+    # diastolic flow of a quarter of the systolic amplitude
+    Q = 0.25 + pulse
+    Q *= mean_flow / (np.trapz(Q, t) / tc)
+    return Inflow(np.stack([t, Q], axis = 1), smooth = False)
+
+
+class MorphometricTree():
+    """ Bifurcating vessel tree with morphometric radius and length scaling, to build synthetic LPNs and centerlines without SimVascular.
+    Each bifurcation splits the parent radius between its children following Murray's law r^k = r1^k + r2^k with r2 = asymmetry * r1, and lengths scale as (r / root_radius)^length_exponent.
+    Branches are stored in breadth first order, so branch 0 is the MPA, and its first and second subtrees are the LPA and RPA.
+    """
+    # Olufsen wall stiffness Eh / r = k1 exp(k2 r) + k3 (cgs), as used by SimVascular
+    K1, K2, K3 = 2e7, -22.5267, 8.65e5
+
+    def __init__(self, generations: int = 8, root_radius: float = 1.2, root_length: float = 4.0, asymmetry: float = 1.0, murray_exponent: float = 3.0, length_exponent: float = 1.0, min_radius: float = 0.0, variability: float = 0.0, seed: int = None):
+        """
+        Args:
+            generations (int, optional): maximum number of bifurcation generations. Defaults to 8.
+            root_radius (float, optional): radius of the MPA (cm). Defaults to 1.2.
+            root_length (float, optional): length of the MPA (cm). Defaults to 4.0.
+            asymmetry (float, optional): radius ratio of the minor to major child, in (0, 1]. Defaults to 1.0 (symmetric).
+            murray_exponent (float, optional): exponent of Murray's law. Defaults to 3.0.
+            length_exponent (float, optional): exponent of the length to radius scaling. Defaults to 1.0.
+            min_radius (float, optional): branches below this radius are not split further. Defaults to 0.0.
+            variability (float, optional): standard deviation of a lognormal perturbation of every asymmetry ratio and length. Defaults to 0.0.
+            seed (int, optional): random seed of the perturbations. Defaults to None.
+        """
+        assert 0 < asymmetry <= 1, 'asymmetry must be in (0, 1]'
+        self.generations = generations
+        self.root_radius = root_radius
+        self.root_length = root_length
+        self.asymmetry = asymmetry
+        self.murray_exponent = murray_exponent
+        self.length_exponent = length_exponent
+        self.min_radius = min_radius
+        self.variability = variability
+        self.rng = np.random.default_rng(seed)
+
+        # branches as dicts of parent, generation, radius, length and children
+        self.branches = []
+        self._grow()
+
+    def _jitter(self):
+        return self.rng.lognormal(0, self.variability) if self.variability > 0 else 1.0
+
+    def _grow(self):
+        ''' grows branches breadth first '''
+        self.branches = [{'parent': -1, 'generation': 0, 'radius': self.root_radius, 'length': self.root_length, 'children': []}]
+        for b, branch in enumerate(self.branches):
+            if branch['generation'] >= self.generations or branch['radius'] < self.min_radius:
+                continue
+            ratio = min(self.asymmetry * self._jitter(), 1.0)
+            k = self.murray_exponent
+            major = branch['radius'] / (1 + ratio ** k) ** (1 / k)
+            for r in (major, ratio * major):
+                branch['children'].append(len(self.branches))
+                self.branches.append({'parent': b,
+                                      'generation': branch['generation'] + 1,
+                                      'radius': r,
+                                      'length': self.root_length * (r / self.root_radius) ** self.length_exponent * self._jitter(),
+                                      'children': []})
+
+    def __len__(self):
+        return len(self.branches)
+
+    @property
+    def outlets(self):
+        ''' branch ids of outlets, in breadth first order '''
+        return [b for b, branch in enumerate(self.branches) if not branch['children']]
+
+    def sides(self):
+        ''' lpa or rpa of every branch below the first bifurcation, mpa otherwise '''
+        sides = ['mpa'] * len(self.branches)
+        for b, branch in enumerate(self.branches[1:], start = 1):
+            parent = branch['parent']
+            sides[b] = sides[parent] if parent != 0 else ('lpa' if self.branches[0]['children'][0] == b else 'rpa')
+        return sides
+
+    def vessel_values(self, radius: float, length: float, viscosity: float, density: float):
+        ''' R, C, L of a straight rigid-walled segment, with compliance from the Olufsen wall stiffness (as in SimVascular) '''
+        eh = radius * (self.K1 * np.exp(self.K2 * radius) + self.K3)
+        return {'R_poiseuille': 8 * viscosity * length / (np.pi * radius ** 4),
+                'C': 3 * length * np.pi * radius ** 3 / (2 * eh),
+                'L': density * length / (np.pi * radius ** 2),
+                'stenosis_coefficient': 0.0}
+
+    def to_lpn(self, inflow: Inflow = None, segments: int = 1, num_cycles: int = 6, num_time_pts: int = 100, total_resistance: float = 400.0, proximal_fraction: float = 0.1, total_compliance: float = 1e-3, distal_pressure: float = m2d(8), viscosity: float = 0.04, density: float = 1.06):
+        """Builds an LPN of the tree, with every branch split into equal vessel segments, BloodVesselJunctions at bifurcations and an RCR at every outlet.
+        The total resistance and compliance are distributed over outlets proportionally to r^murray_exponent, the flow split of Murray's law.
+
+        Args:
+            inflow (Inflow, optional): inflow at the MPA. Defaults to synthetic_inflow().
+            segments (int, optional): vessel segments per branch, joined by internal junctions. Defaults to 1.
+            num_cycles (int, optional): number of cardiac cycles. Defaults to 6.
+            num_time_pts (int, optional): number of time points per cardiac cycle. Defaults to 100.
+            total_resistance (float, optional): total resistance of all RCRs in parallel (dyn s/cm^5). Defaults to 400.0.
+            proximal_fraction (float, optional): fraction of each RCR resistance in Rp. Defaults to 0.1.
+            total_compliance (float, optional): total compliance of all RCRs (cm^5/dyn). Defaults to 1e-3.
+            distal_pressure (float, optional): Pd of every RCR (dyn/cm^2). Defaults to 8 mmHg.
+            viscosity (float, optional): blood viscosity (poise). Defaults to 0.04.
+            density (float, optional): blood density (g/cm^3). Defaults to 1.06.
+
+        Returns:
+            LPN: synthetic LPN
+        """
+        if inflow is None:
+            inflow = synthetic_inflow()
+
+        sides = self.sides()
+        outlet_weight = {b: self.branches[b]['radius'] ** self.murray_exponent for b in self.outlets}
+        total_weight = sum(outlet_weight.values())
+
+        vessels = []
+        junctions = []
+        bcs = [{'bc_name': 'INFLOW', 'bc_type': 'FLOW', 'bc_values': {'t': inflow.t.tolist(), 'Q': inflow.Q.tolist()}}]
+        first_vessel = {}
+        last_vessel = {}
+        for b, branch in enumerate(self.branches):
+            seg_len = branch['length'] / segments
+            values = self.vessel_values(branch['radius'], seg_len, viscosity, density)
+            for s in range(segments):
+                vid = len(vessels)
+                vess = {'vessel_id': vid,
+                        'vessel_name': f'branch{b}_seg{s}',
+                        'vessel_length': seg_len,
+                        'zero_d_element_type': 'BloodVessel',
+                        'zero_d_element_values': dict(values)}
+                if s == 0:
+                    first_vessel[b] = vid
+                    if b == 0:
+                        vess['boundary_conditions'] = {'inlet': 'INFLOW'}
+                else:
+                    junctions.append({'junction_name': f'J{len(junctions)}', 'junction_type': 'internal_junction', 'inlet_vessels': [vid - 1], 'outlet_vessels': [vid]})
+                vessels.append(vess)
+            last_vessel[b] = len(vessels) - 1
+
+            if not branch['children']:
+                # rcr of this outlet
+                bc_name = f'RCR_{len(bcs) - 1}'
+                vessels[-1].setdefault('boundary_conditions', {})['outlet'] = bc_name
+                R = total_resistance * total_weight / outlet_weight[b]
+                bcs.append({'bc_name': bc_name,
+                            'bc_type': 'RCR',
+                            'face_name': f'cap_{sides[b]}_{len(bcs) - 1}',
+                            'bc_values': {'Rp': proximal_fraction * R,
+                                          'C': total_compliance * outlet_weight[b] / total_weight,
+                                          'Rd': (1 - proximal_fraction) * R,
+                                          'Pd': distal_pressure}})
+
+        for b, branch in enumerate(self.branches):
+            if not branch['children']:
+                continue
+            n = len(branch['children'])
+            junctions.append({'junction_name': f'J{len(junctions)}',
+                              'junction_type': 'BloodVesselJunction',
+                              'inlet_vessels': [last_vessel[b]],
+                              'outlet_vessels': [first_vessel[c] for c in branch['children']],
+                              'junction_values': {'R_poiseuille': [0.0] * n, 'C': [0.0] * n, 'L': [0.0] * n, 'stenosis_coefficient': [0.0] * n}})
+
+        lpn_data = {LPN.BC: bcs,
+                    LPN.VESS: vessels,
+                    LPN.JUNC: junctions,
+                    LPN.SIM: {'number_of_cardiac_cycles': num_cycles,
+                              'number_of_time_pts_per_cardiac_cycle': num_time_pts,
+                              'density': density,
+                              'viscosity': viscosity},
+                    LPN.DESC: {'description of case': f'synthetic morphometric tree of {len(self.branches)} branches and {len(self.outlets)} outlets'},
+                    # face names of the rcrs are set
+                    LPN.FLAGS: dict(LPN.FLAGS_PRESET, rcrt_map = True)}
+        return LPN.from_dict(lpn_data)
+
+    def to_centerlines(self, points_per_branch: int = 11, junction_pts: int = 3):
+        """Builds centerlines matching the LPN of the tree, in the format of SimVascular centerlines.
+        Branch points are ordered along each branch. Each bifurcation has a point shared by every downstream centerline followed by junction_pts - 1 points diverging towards each child.
+
+        Args:
+            points_per_branch (int, optional): points per branch, including both ends. Defaults to 11.
+            junction_pts (int, optional): points of each centerline within a bifurcation. Defaults to 3.
+
+        Returns:
+            Centerlines: centerlines with GlobalNodeId, BranchId, BifurcationId, Path, CenterlineSectionArea and CenterlineId point data
+        """
+        children = [branch['children'] for branch in self.branches]
+        bifurcation = {b: i for i, b in enumerate(b for b in range(len(self.branches)) if children[b])}
+
+        # outlets below each branch define the centerline ids
+        leaves = {b: i for i, b in enumerate(self.outlets)}
+        below = {}
+        for b in reversed(range(len(self.branches))):
+            below[b] = [leaves[b]] if not children[b] else [cl for c in children[b] for cl in below[c]]
+
+        points, branch_id, bif_id, path, area, cids = [], [], [], [], [], []
+        def add(p, br, bif, s, r, cl):
+            points.append(p)
+            branch_id.append(br)
+            bif_id.append(bif)
+            path.append(s)
+            area.append(np.pi * r ** 2)
+            cids.append(cl)
+
+        # depth first with an explicit stack to allow deep trees. The junction points of a child are added right before its branch points.
+        stack = [('branch', 0, np.zeros(3), np.array([0, 0, 1.0]))]
+        while stack:
+            kind, b, start, direction = stack.pop()
+            radius, length = self.branches[b]['radius'], self.branches[b]['length']
+            if kind == 'junction':
+                parent = self.branches[b]['parent']
+                step = 0.5 * self.branches[parent]['radius'] / junction_pts
+                for i in range(1, junction_pts):
+                    add(start + i * step * direction, -1, bifurcation[parent], 0.0, self.branches[parent]['radius'], below[b])
+                stack.append(('branch', b, start + junction_pts * step * direction, direction))
+                continue
+
+            for si in np.linspace(0, length, points_per_branch):
+                add(start + si * direction, b, -1, si, radius, below[b])
+            if not children[b]:
+                continue
+
+            # a point shared by all downstream centerlines
+            end = start + (length + 0.5 * radius / junction_pts) * direction
+            add(end, -1, bifurcation[b], 0.0, radius, below[b])
+            # children spread in a plane normal to a fixed axis, which changes with direction so the tree spans 3D
+            normal = np.cross(direction, [1.0, 0, 0] if abs(direction[0]) < .9 else [0, 1.0, 0])
+            normal /= np.linalg.norm(normal)
+            for k, c in reversed(list(enumerate(children[b]))):
+                angle = np.pi / 6 * (1 if k % 2 == 0 else -1)
+                child_dir = np.cos(angle) * direction + np.sin(angle) * normal
+                stack.append(('junction', c, end, child_dir / np.linalg.norm(child_dir)))
+
+        num_pts = len(points)
+        centerline_id = np.zeros((num_pts, len(leaves)), dtype = np.uint8)
+        for i, cl in enumerate(cids):
+            centerline_id[i, cl] = 1
+
+        polydata = vtk.vtkPolyData()
+        vtk_points = vtk.vtkPoints()
+        vtk_points.SetData(n2v(np.array(points), deep = True))
+        polydata.SetPoints(vtk_points)
+        # one polyline per centerline
+        lines = vtk.vtkCellArray()
+        for leaf in range(len(leaves)):
+            ids = np.where(centerline_id[:, leaf])[0]
+            line = vtk.vtkPolyLine()
+            line.GetPointIds().SetNumberOfIds(len(ids))
+            for i, pid in enumerate(ids):
+                line.GetPointIds().SetId(i, int(pid))
+            lines.InsertNextCell(line)
+        polydata.SetLines(lines)
+
+        cent = Centerlines(polydata)
+        cent.add_pointdata(np.arange(num_pts), cent.PointDataFields.NODEID)
+        cent.add_pointdata(np.array(branch_id), cent.PointDataFields.BRANCHID)
+        cent.add_pointdata(np.array(bif_id), cent.PointDataFields.BIFURCATIONID)
+        cent.add_pointdata(np.array(path), cent.PointDataFields.PATH)
+        cent.add_pointdata(np.array(area), cent.PointDataFields.AREA)
+        cent.add_pointdata(centerline_id, cent.PointDataFields.CENTID)
+        return cent
+
+
+def synthetic_lpn(generations: int = 8, segments: int = 1, inflow: Inflow = None, num_cycles: int = 6, num_time_pts: int = 100, centerlines: bool = False, points_per_branch: int = 11, **kwargs):
+    """Builds a synthetic LPN of a morphometric tree, optionally with matching centerlines.
+
+    Args:
+        generations (int, optional): maximum number of bifurcation generations. Defaults to 8.
+        segments (int, optional): vessel segments per branch. Defaults to 1.
+        inflow (Inflow, optional): inflow at the MPA. Defaults to synthetic_inflow().
+        num_cycles (int, optional): number of cardiac cycles. Defaults to 6.
+        num_time_pts (int, optional): number of time points per cardiac cycle. Defaults to 100.
+        centerlines (bool, optional): also build centerlines. Defaults to False.
+        points_per_branch (int, optional): centerline points per branch. Defaults to 11.
+        **kwargs: other arguments of MorphometricTree (i.e. asymmetry, min_radius, variability, seed)
+
+    Returns:
+        LPN | tuple: LPN, or (LPN, Centerlines)
+    """
+    tree = MorphometricTree(generations, **kwargs)
+    lpn = tree.to_lpn(inflow, segments, num_cycles, num_time_pts)
+    if not centerlines:
+        return lpn
+    return lpn, tree.to_centerlines(points_per_branch)
@@ -0,0 +1,97 @@
+import io
+import time
+import cProfile
+import pstats
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from .io import write_json
+
+
+class Profiler():
+    """ Per-stage timers and counters of a run, with optional cProfile capture, emitted as a JSON report.
+    Stages are timed with context managers and may be entered repeatedly (i.e. one solve per attempt), accumulating calls and time. Stages should not be nested, so time outside of every stage is reported as untimed.
+    """
+
+    def __init__(self, cprofile = False):
+        """
+        Args:
+            cprofile (bool, optional): also capture a cProfile of the whole run. Defaults to False.
+        """
+        self.stages = {}
+        self.counters = {}
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self._start = None
+        self.wall_time = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        return self
+
+    def __exit__(self, *args):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        self.wall_time += time.perf_counter() - self._start
+
+    @contextmanager
+    def timer(self, name: str):
+        ''' times the enclosed block as stage name '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {'calls': 0, 'total_s': 0.0})
+            stage['calls'] += 1
+            stage['total_s'] += time.perf_counter() - start
+
+    def count(self, name: str, n: int = 1):
+        ''' increments counter name by n '''
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def report(self, top: int = 30, **info):
+        """Builds the report.
+
+        Args:
+            top (int, optional): number of functions of the cProfile listed, by cumulative time. Defaults to 30.
+            **info: any other values to include (i.e. model size)
+
+        Returns:
+            dict: report
+        """
+        stages = {name: dict(st, mean_s = st['total_s'] / st['calls']) for name, st in self.stages.items()}
+        report = {'wall_time_s': self.wall_time,
+                  'stages': stages,
+                  'counters': dict(self.counters),
+                  'untimed_s': self.wall_time - sum(st['total_s'] for st in stages.values())}
+        report.update(info)
+        if self.cprofile is not None:
+            stats = pstats.Stats(self.cprofile, stream = io.StringIO())
+            functions = []
+            for (file, line, func), (_, ncalls, tottime, cumtime, _) in sorted(stats.stats.items(), key = lambda s: -s[1][3])[:top]:
+                functions.append({'function': f"{file}:{line}({func})", 'calls': ncalls, 'tottime_s': tottime, 'cumtime_s': cumtime})
+            report['cprofile'] = functions
+        return report
+
+    def save(self, fp: Path, **info):
+        """Writes the report as JSON, and the raw cProfile stats (for pstats/snakeviz) next to it when captured.
+
+        Args:
+            fp (Path): path of the JSON report
+            **info: any other values to include in the report
+        """
+        fp = Path(fp)
+        write_json(fp, self.report(**info), sort_keys = False)
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(str(fp.with_suffix('.prof')))
+
+
+def timer(profiler: Profiler, name: str):
+    ''' timer of a stage, or a no-op context when profiler is None '''
+    return nullcontext() if profiler is None else profiler.timer(name)
+
+def count(profiler: Profiler, name: str, n: int = 1):
+    ''' increments a counter, if profiling '''
+    if profiler is not None:
+        profiler.count(name, n)
@@ -0,0 +1,134 @@
+import os
+import json
+from pathlib import Path
+from itertools import islice
+import numpy as np
+from numpy.lib.format import open_memmap
+
+
+class ShardedWriter():
+    """ Resumable writer of a (input, output) dataset in fixed size shards.
+    Inputs are saved up front, outputs are written into a memory-mapped .npy shard by shard, and completed shards are recorded in a progress file so an interrupted generation can resume.
+    """
+    PROGRESS = 'progress.json'
+
+    def __init__(self, directory: Path, inputs: np.ndarray, shard_size: int = 1024, input_name = 'input.npy', output_name = 'output.npy'):
+        """
+        Args:
+            directory (Path): directory to write the dataset to
+            inputs (np.ndarray): inputs for every sample. Must be identical when resuming.
+            shard_size (int, optional): number of samples per shard. Defaults to 1024.
+            input_name (str, optional): input file name. Defaults to 'input.npy'.
+            output_name (str, optional): output file name. Defaults to 'output.npy'.
+        """
+        self.directory = Path(directory)
+        self.input_file = self.directory / input_name
+        self.output_file = self.directory / output_name
+        self.progress_file = self.directory / self.PROGRESS
+        self.num_samples = len(inputs)
+        self.shard_size = shard_size
+        self.num_shards = -(-self.num_samples // shard_size)
+        self.output = None
+
+        if self.progress_file.is_file():
+            # resume
+            with self.progress_file.open() as pfile:
+                progress = json.load(pfile)
+            if progress['num_samples'] != self.num_samples or progress['shard_size'] != shard_size:
+                raise ValueError(f"Existing dataset in {self.directory} was generated with {progress['num_samples']} samples and shard size {progress['shard_size']}.")
+            self.input = np.load(self.input_file, mmap_mode = 'r')
+            if not np.array_equal(self.input, inputs):
+                raise ValueError(f"Inputs do not match the existing dataset in {self.directory}.")
+            self.completed = set(progress['completed'])
+            if self.output_file.is_file():
+                self.output = open_memmap(self.output_file, mode = 'r+')
+        else:
+            self.input = open_memmap(self.input_file, mode = 'w+', dtype = inputs.dtype, shape = inputs.shape)
+            self.input[:] = inputs
+            self.input.flush()
+            self.completed = set()
+            self._write_progress()
+
+    @property
+    def complete(self):
+        ''' whether every shard has been written '''
+        return len(self.completed) == self.num_shards
+
+    @property
+    def num_completed(self):
+        ''' number of samples written '''
+        return sum(end - start for start, end in map(self.shard_range, self.completed))
+
+    def shard_range(self, shard: int):
+        ''' sample index range of a shard '''
+        start = shard * self.shard_size
+        return start, min(start + self.shard_size, self.num_samples)
+
+    def pending_shards(self):
+        ''' shards not yet written, in order '''
+        return [shard for shard in range(self.num_shards) if shard not in self.completed]
+
+    def pending_indices(self):
+        ''' sample indices of pending shards, in order '''
+        for shard in self.pending_shards():
+            yield from range(*self.shard_range(shard))
+
+    def write_shard(self, shard: int, values: np.ndarray):
+        """Writes outputs of a shard and records it as completed.
+
+        Args:
+            shard (int): shard index
+            values (np.ndarray): outputs of the shard, of shape (num samples in shard, output size)
+        """
+        start, end = self.shard_range(shard)
+        values = np.asarray(values)
+        if len(values) != end - start:
+            raise ValueError(f"Shard {shard} expects {end - start} samples but {len(values)} were given.")
+        if self.output is None:
+            self.output = open_memmap(self.output_file, mode = 'w+', dtype = values.dtype, shape = (self.num_samples,) + values.shape[1:])
+        self.output[start:end] = values
+        self.output.flush()
+
+        self.completed.add(shard)
+        self._write_progress()
+
+    def consume(self, results, callback = None):
+        """Writes results of the pending samples shard by shard.
+
+        Args:
+            results (iterable): outputs of each sample, in the order of pending_indices.
+            callback (callable, optional): called with (shard, number of completed samples) after each shard is written.
+        """
+        results = iter(results)
+        for shard in self.pending_shards():
+            start, end = self.shard_range(shard)
+            self.write_shard(shard, np.stack(list(islice(results, end - start))))
+            if callback is not None:
+                callback(shard, self.num_completed)
+
+    def _write_progress(self):
+        ''' atomically writes the progress file '''
+        tmp = self.progress_file.with_suffix('.tmp')
+        with tmp.open('w') as pfile:
+            json.dump({'num_samples': self.num_samples, 'shard_size': self.shard_size, 'completed': sorted(self.completed)}, pfile, indent = 4)
+        os.replace(tmp, self.progress_file)
+
+    @staticmethod
+    def load(directory: Path, input_name = 'input.npy', output_name = 'output.npy', mmap_mode = 'c'):
+        """Loads a completed dataset as memmaps.
+
+        Args:
+            directory (Path): dataset directory
+            mmap_mode (str, optional): memmap mode. Defaults to 'c' (copy on write).
+
+        Returns:
+            tuple: (input, output) memmaps
+        """
+        directory = Path(directory)
+        progress_file = directory / ShardedWriter.PROGRESS
+        if progress_file.is_file():
+            with progress_file.open() as pfile:
+                progress = json.load(pfile)
+            if len(progress['completed']) != -(-progress['num_samples'] // progress['shard_size']):
+                raise ValueError(f"Dataset in {directory} is incomplete ({len(progress['completed'])} shards written). Rerun data generation to resume.")
+        return np.load(directory / input_name, mmap_mode = mmap_mode), np.load(directory / output_name, mmap_mode = mmap_mode)